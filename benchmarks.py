@@ -0,0 +1,276 @@
+"""This file contains a benchmark suite that measures the performance of the theory interpreter, conjecture, routine extraction, and minds. Each workload is run at a series of growing sizes, and for each size the suite records the time taken, the number of operations performed per second, and the peak memory allocated, so that the results describe how each workload scales.
+
+The results of a run are a dictionary that can be saved as JSON, and two runs can be compared to find regressions. The suite can also be used from the command line:
+  python benchmarks.py run --output results.json
+  python benchmarks.py compare baseline.json results.json
+
+Results have the following form:
+  {
+    "version": BENCHMARK_VERSION,
+    "python": the python version used for the run,
+    "workloads": {
+      workload name: {
+        "unit": a description of what one operation is,
+        "scaling_exponent": the slope of log(seconds) against log(size), so 1 means linear scaling,
+        "measurements": [{"size", "seconds", "ops", "ops_per_sec", "peak_memory_bytes"}, ...]
+      },
+      ...
+    }
+  }
+"""
+
+import argparse
+import json
+import math
+import platform
+import sys
+import time
+import tracemalloc
+import numpy.random
+import codegen
+import conjecture
+import examples
+import extract
+import language
+import minds
+
+'''BENCHMARK_VERSION is the version of the results format. Results with different versions can't be compared.'''
+BENCHMARK_VERSION=1
+
+'''BENCHMARK_SEED is the random seed used before each measurement, so that every run performs the same work.'''
+BENCHMARK_SEED=0
+
+'''REPEATS is the number of times each measurement is repeated. The fastest repetition is reported, since slower repetitions are slowed down by noise from the rest of the system.'''
+REPEATS=3
+
+def make_claims(count):
+  """Creates a list of distinct claims to use as input for the benchmarks.
+
+  Args:
+    count (int): The number of claims to create.
+
+  Returns:
+    A list of "count" claims, each with two integers.
+  """
+  return [(i%2==0, [i, i%7]) for i in range(count)]
+
+def make_theory(size):
+  """Creates a random theory with at least "size" instructions, by repeatedly applying the variations from conjecture.vary that make the theory longer.
+
+  Args:
+    size (int): The minimum number of instructions in the theory.
+
+  Returns:
+    The random theory.
+  """
+  theory=[]
+  while len(theory)<size:
+    candidate=conjecture.vary([theory], 0, [], steps=1)
+    if len(candidate)>len(theory):
+      theory=candidate
+  return theory
+
+def run_theory_workload(theory, routines, engine=language.run_theory):
+  """Returns a workload that runs a theory on a set of claims of the given size, using an engine with the same signature as language.run_theory. Each operation is one input claim processed."""
+  def workload(size):
+    claims=make_claims(size)
+    def run():
+      engine(0, [theory], routines, claims)
+      return size
+    return run
+  return workload
+
+def run_theory_with_superinstructions(theory_index, theories, routines, input_set, execution_limit=100):
+  """Runs a theory as language.run_theory does, executing its routines with the superinstructions returned by codegen.get_superinstructions."""
+  return list(language.iterate_theory(theory_index, theories, routines, input_set, execution_limit, superinstructions=codegen.get_superinstructions(theories, routines)))
+
+def vary_workload(size):
+  """A workload that varies a random theory with at least "size" instructions 100 times. Each operation is one call to conjecture.vary."""
+  theory=make_theory(size)
+  def run():
+    for i in range(100):
+      conjecture.vary([theory], 0, [], steps=1)
+    return 100
+  return run
+
+def extract_workload(size):
+  """A workload that extracts a routine from three theories with at least "size" instructions each, which share a repeated chunk of code. Each operation is one call to extract.extract_new_routine."""
+  chunk=examples.SUM_THEORY
+  theories=[]
+  for i in range(3):
+    theories.append(make_theory(size-len(chunk))+chunk)
+  exec_instruction=language.instruction_functions.index(language.instruction_exec)
+  def run():
+    extract.extract_new_routine(theories, [], exec_instruction, language.is_program_valid)
+    return 1
+  return run
+
+def add_claim_workload(size):
+  """A workload that adds "size" claims to an empty mind. One in every ten claims contradicts an earlier claim, so problems are created as well. The hash table is sized to the number of claims, as it would be for a mind that is expected to grow to that size. Each operation is one call to minds.add_claim."""
+  claims=make_claims(size)
+  for i in range(0, size, 10):
+    claims[i]=(not claims[i//2][0], claims[i//2][1])
+  def run():
+    mind=minds.new_mind(hash_table_size=max(1000, size))
+    for claim in claims:
+      minds.add_claim(mind, claim, (0, []))
+    return size
+  return run
+
+'''WORKLOADS maps the name of each workload to a tuple (workload, unit, sizes, quick_sizes). "workload" is a function that takes a size and returns a function that performs the work and returns the number of operations it performed. "sizes" is the list of sizes used in a full run, and "quick_sizes" is the list of sizes used in a quick run.'''
+WORKLOADS={
+  "run_theory.increment_theory": (run_theory_workload(examples.INCREMENT_THEORY, []), "input claims", [10, 100, 1000, 10000], [10, 100, 1000]),
+  "run_theory.repeat_increment_10_times_theory": (run_theory_workload(examples.REPEAT_INCREMENT_10_TIMES_THEORY, [examples.INCREMENT_THEORY, examples.REPEAT_INCREMENT_THEORY]), "input claims", [10, 100, 1000, 10000], [10, 100, 1000]),
+  "run_theory.sum_theory": (run_theory_workload(examples.SUM_THEORY, []), "input claims", [10, 100, 1000, 10000], [10, 100, 1000]),
+  "superinstructions.repeat_increment_10_times_theory": (run_theory_workload(examples.REPEAT_INCREMENT_10_TIMES_THEORY, [examples.INCREMENT_THEORY, examples.REPEAT_INCREMENT_THEORY], run_theory_with_superinstructions), "input claims", [10, 100, 1000, 10000], [10, 100, 1000]),
+  "codegen.run_compiled_theory.repeat_increment_10_times_theory": (run_theory_workload(examples.REPEAT_INCREMENT_10_TIMES_THEORY, [examples.INCREMENT_THEORY, examples.REPEAT_INCREMENT_THEORY], codegen.run_compiled_theory), "input claims", [10, 100, 1000, 10000], [10, 100, 1000]),
+  "conjecture.vary": (vary_workload, "variations", [1, 10, 100, 1000], [1, 10, 100]),
+  "extract.extract_new_routine": (extract_workload, "extractions", [25, 50, 100, 200], [25, 50]),
+  "minds.add_claim": (add_claim_workload, "claims added", [1000, 10000, 100000, 1000000], [1000, 10000])
+}
+
+def measure(workload, size):
+  """Measures a workload at one size.
+
+  Args:
+    workload (function): A workload, as described in WORKLOADS.
+    size (int): The size to run the workload at.
+
+  Returns:
+    A dictionary with the keys "size", "seconds", "ops", "ops_per_sec", and "peak_memory_bytes".
+  """
+  numpy.random.seed(BENCHMARK_SEED)
+  run=workload(size)
+  seconds=math.inf
+  for i in range(REPEATS):
+    start=time.perf_counter()
+    ops=run()
+    seconds=min(seconds, time.perf_counter()-start)
+
+  # Peak memory is measured in a separate repetition, because tracing allocations slows execution down.
+  tracemalloc.start()
+  run()
+  peak_memory=tracemalloc.get_traced_memory()[1]
+  tracemalloc.stop()
+
+  return {
+    "size": size,
+    "seconds": seconds,
+    "ops": ops,
+    "ops_per_sec": ops/seconds if seconds>0 else math.inf,
+    "peak_memory_bytes": peak_memory
+  }
+
+def scaling_exponent(measurements):
+  """Fits a line to log(seconds) against log(size) with least squares, and returns its slope. A slope of 1 means the workload scales linearly, and a slope of 2 means it scales quadratically.
+
+  Args:
+    measurements (list): A list of measurements, as returned by "measure".
+
+  Returns:
+    The slope, or None if there are fewer than two measurements.
+  """
+  points=[(math.log(m["size"]), math.log(m["seconds"])) for m in measurements if m["seconds"]>0]
+  if len(points)<2:
+    return None
+  mean_x=sum(p[0] for p in points)/len(points)
+  mean_y=sum(p[1] for p in points)/len(points)
+  variance=sum((p[0]-mean_x)**2 for p in points)
+  if variance==0:
+    return None
+  return sum((p[0]-mean_x)*(p[1]-mean_y) for p in points)/variance
+
+def run_benchmarks(names=None, quick=False, log=None):
+  """Runs the benchmark suite.
+
+  Args:
+    names (list): Defaults to None. The names of the workloads to run. If this is None, every workload in WORKLOADS is run.
+    quick (bool): Defaults to False. If this is True, each workload is run at its smaller "quick_sizes" only.
+    log (file): Defaults to None. If this is not None, a line describing each measurement is written to it as the measurement finishes.
+
+  Returns:
+    The results, as a dictionary in the form described at the top of this file.
+  """
+  results={"version": BENCHMARK_VERSION, "python": platform.python_version(), "workloads": {}}
+  for name in (names if names is not None else WORKLOADS.keys()):
+    workload, unit, sizes, quick_sizes=WORKLOADS[name]
+    measurements=[]
+    for size in (quick_sizes if quick else sizes):
+      measurement=measure(workload, size)
+      measurements.append(measurement)
+      if log is not None:
+        log.write(name+" size="+str(size)+": "+format(measurement["ops_per_sec"], ".1f")+" "+unit+"/sec, peak memory "+str(measurement["peak_memory_bytes"])+" bytes\n")
+        log.flush()
+    results["workloads"][name]={"unit": unit, "scaling_exponent": scaling_exponent(measurements), "measurements": measurements}
+  return results
+
+def compare_results(baseline, current, threshold=0.25):
+  """Compares two sets of results and finds regressions. A measurement has regressed if its throughput is lower, or its peak memory is higher, than the measurement of the same workload at the same size in the baseline, by more than the threshold. Workloads and sizes that only appear in one of the results are ignored.
+
+  Args:
+    baseline (dict): The results to compare against.
+    current (dict): The results to check for regressions.
+    threshold (float): Defaults to 0.25. The relative change that counts as a regression.
+
+  Returns:
+    A list of strings, each describing one regression. The list is empty if there are no regressions.
+  """
+  if baseline["version"]!=current["version"]:
+    raise ValueError("can't compare results with different versions")
+  regressions=[]
+  for name, workload in current["workloads"].items():
+    if name not in baseline["workloads"]:
+      continue
+    baseline_measurements={m["size"]: m for m in baseline["workloads"][name]["measurements"]}
+    for m in workload["measurements"]:
+      if m["size"] not in baseline_measurements:
+        continue
+      b=baseline_measurements[m["size"]]
+      if m["ops_per_sec"]<b["ops_per_sec"]*(1-threshold):
+        regressions.append(name+" size="+str(m["size"])+": throughput fell from "+format(b["ops_per_sec"], ".1f")+" to "+format(m["ops_per_sec"], ".1f")+" "+workload["unit"]+"/sec")
+      if m["peak_memory_bytes"]>b["peak_memory_bytes"]*(1+threshold):
+        regressions.append(name+" size="+str(m["size"])+": peak memory rose from "+str(b["peak_memory_bytes"])+" to "+str(m["peak_memory_bytes"])+" bytes")
+  return regressions
+
+def main(arguments):
+  """Runs the command line interface described at the top of this file.
+
+  Args:
+    arguments (list): The command line arguments, not including the program name.
+
+  Returns:
+    The exit status: 0 on success, or 1 if a comparison found regressions.
+  """
+  parser=argparse.ArgumentParser(description="Benchmarks for the CTP Theory implementation.")
+  subparsers=parser.add_subparsers(dest="command", required=True)
+  run_parser=subparsers.add_parser("run", help="run the benchmarks and save the results as JSON")
+  run_parser.add_argument("--output", "-o", default="-", help="the file to write the results to, or - for stdout")
+  run_parser.add_argument("--quick", action="store_true", help="only run the smaller sizes of each workload")
+  run_parser.add_argument("--workload", action="append", choices=list(WORKLOADS.keys()), help="a workload to run; can be repeated, and defaults to every workload")
+  compare_parser=subparsers.add_parser("compare", help="compare two results files and report regressions")
+  compare_parser.add_argument("baseline")
+  compare_parser.add_argument("current")
+  compare_parser.add_argument("--threshold", type=float, default=0.25, help="the relative change that counts as a regression")
+  args=parser.parse_args(arguments)
+
+  if args.command=="run":
+    results=run_benchmarks(args.workload, args.quick, sys.stderr)
+    if args.output=="-":
+      json.dump(results, sys.stdout, indent=2)
+      sys.stdout.write("\n")
+    else:
+      with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+    return 0
+
+  with open(args.baseline) as f:
+    baseline=json.load(f)
+  with open(args.current) as f:
+    current=json.load(f)
+  regressions=compare_results(baseline, current, args.threshold)
+  for regression in regressions:
+    print(regression)
+  return 1 if len(regressions)>0 else 0
+
+if __name__=="__main__":
+  sys.exit(main(sys.argv[1:]))
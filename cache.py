@@ -0,0 +1,251 @@
+"""This file contains a persistent cache of the artifacts that are derived from programs, so that a new worker process can load them from disk instead of analyzing and compiling every theory of a mind again. The artifacts of an inlined program are:
+-its verdict, as returned by language.is_program_valid
+-its control map, as returned by language.get_control_map
+-its fork guards, as returned by language.get_fork_guards
+-the python bytecode of its branch function, as compiled by codegen.compile_theory
+
+The cache is a directory with one file per program, named after the program's fingerprint from store.program_fingerprint. Each file holds the pickled artifacts, including the program itself, so programs with the same fingerprint are told apart when they are loaded. Bytecode can only be loaded by the version of python that compiled it, and artifacts change when the interpreter or the compiler does, so the files are kept in a subdirectory named after ENGINE_VERSION and python's bytecode version, and artifacts from other versions are never read.
+
+Several processes can use the same cache at once. Every file is written to a temporary file first and then moved into place, so a reader never sees a half-written file. The cache is kept below a maximum size by evicting the least recently used files, where a file is used when it is written or loaded. Eviction is done while holding an exclusive lock (fcntl.flock) on the cache's lock file, so two processes never evict at once. Each process estimates the size of the cache from its last scan of the directory and the files it has written since, and evicts once the estimate exceeds the maximum, so the cache can briefly be larger than the maximum by what other processes wrote since then.
+
+A cache is a dictionary with the following keys:
+-"directory" is the versioned directory that holds the files
+-"max_bytes" is the maximum size of the cache, in bytes
+-"size" is this process's estimate of the size of the cache, in bytes
+-"hits" and "misses" are the number of programs whose artifacts were and weren't found in the cache by this process
+
+Example:
+  c=cache.open_cache("/var/cache/ctp")
+  cache.warm_start(c, mind[0], mind[1])
+"""
+
+import fcntl
+import importlib.util
+import marshal
+import os
+import pickle
+import tempfile
+import codegen
+import language
+import store
+
+'''ENGINE_VERSION is the version of the artifacts stored in the cache. It should be incremented whenever a change to language.py or codegen.py changes the artifacts of a program, so that stale artifacts are never loaded.'''
+ENGINE_VERSION=1
+
+'''DEFAULT_MAX_BYTES is the default maximum size of a cache, in bytes.'''
+DEFAULT_MAX_BYTES=256*1024*1024
+
+'''EVICTION_TARGET is the fraction of the maximum size that a cache is shrunk to when it is found to be too large, so that it isn't scanned again after every write.'''
+EVICTION_TARGET=0.75
+
+'''ENTRY_SUFFIX is the file extension of the files that hold artifacts.'''
+ENTRY_SUFFIX=".entry"
+
+def get_engine_key():
+  """Returns the name of the subdirectory of a cache that holds the artifacts of this version of the engine, which combines ENGINE_VERSION and python's bytecode version."""
+  return "engine-"+str(ENGINE_VERSION)+"-"+importlib.util.MAGIC_NUMBER.hex()
+
+def open_cache(directory, max_bytes=DEFAULT_MAX_BYTES):
+  """Opens a cache, creating its directory if it doesn't exist yet.
+
+  Args:
+    directory (str): The directory of the cache. It can be shared by several processes, and by different versions of the engine.
+    max_bytes (int): Defaults to DEFAULT_MAX_BYTES. The maximum size of the cache, in bytes.
+
+  Returns:
+    The cache, as a dictionary.
+  """
+  versioned_directory=os.path.join(directory, get_engine_key())
+  os.makedirs(versioned_directory, exist_ok=True)
+  cache={
+    "directory": versioned_directory,
+    "max_bytes": max_bytes,
+    "size": 0,
+    "hits": 0,
+    "misses": 0
+  }
+  cache["size"]=sum(entry[2] for entry in get_cache_entries(cache))
+  return cache
+
+def get_cache_entries(cache):
+  """Lists the files of a cache.
+
+  Args:
+    cache (dict): The cache.
+
+  Returns:
+    A list of tuples (path, last_used, size), where "last_used" is the time the file was last written or loaded, as a modification time.
+  """
+  entries=[]
+  for directory_entry in os.scandir(cache["directory"]):
+    if directory_entry.name.endswith(ENTRY_SUFFIX):
+      try:
+        stat=directory_entry.stat()
+      except FileNotFoundError:
+        continue
+      entries.append((directory_entry.path, stat.st_mtime, stat.st_size))
+  return entries
+
+def get_entry_path(cache, program):
+  """Returns the path of the file that holds the artifacts of a normalized program."""
+  return os.path.join(cache["directory"], format(store.program_fingerprint(program), "016x")+ENTRY_SUFFIX)
+
+def build_artifacts(program):
+  """Analyzes and compiles an inlined program.
+
+  Args:
+    program (tuple): An inlined program, normalized with store.normalize_program.
+
+  Returns:
+    A dictionary of the program's artifacts, with the keys "program", "verdict", "control_map", "fork_guards", and "code". If the program isn't valid, it can't be compiled, and the last three are None. "code" is the marshalled code object of the source returned by codegen.generate_source.
+  """
+  artifacts={"program": program, "verdict": language.is_program_valid(program), "control_map": None, "fork_guards": None, "code": None}
+  if artifacts["verdict"]:
+    artifacts["control_map"]=language.get_control_map(program)
+    artifacts["fork_guards"]=language.get_fork_guards(program)
+    artifacts["code"]=marshal.dumps(compile(codegen.generate_source(program), "<compiled theory "+str(store.program_fingerprint(program))+">", "exec"))
+  return artifacts
+
+def load_artifacts(cache, program):
+  """Loads the artifacts of a program from a cache, and marks them as used.
+
+  Args:
+    cache (dict): The cache.
+    program (tuple): An inlined program, normalized with store.normalize_program.
+
+  Returns:
+    The artifacts of the program, as returned by build_artifacts, or None if they aren't in the cache.
+  """
+  path=get_entry_path(cache, program)
+  try:
+    with open(path, "rb") as f:
+      artifacts=pickle.load(f)
+    os.utime(path)
+  except (OSError, EOFError, pickle.UnpicklingError):
+    return None
+  if artifacts["program"]!=program:
+    return None
+  return artifacts
+
+def save_artifacts(cache, artifacts):
+  """Saves the artifacts of a program to a cache, replacing any artifacts already saved for a program with the same fingerprint, and evicts old artifacts if the cache has become too large.
+
+  Args:
+    cache (dict): The cache.
+    artifacts (dict): The artifacts to save, as returned by build_artifacts.
+  """
+  path=get_entry_path(cache, artifacts["program"])
+  descriptor, temporary_path=tempfile.mkstemp(dir=cache["directory"], suffix=".tmp")
+  try:
+    with os.fdopen(descriptor, "wb") as f:
+      pickle.dump(artifacts, f, pickle.HIGHEST_PROTOCOL)
+      size=f.tell()
+    os.replace(temporary_path, path)
+  except BaseException:
+    os.unlink(temporary_path)
+    raise
+  cache["size"]+=size
+  if cache["size"]>cache["max_bytes"]:
+    evict_artifacts(cache)
+
+def evict_artifacts(cache):
+  """Deletes the least recently used files of a cache until it is no larger than EVICTION_TARGET times its maximum size, while holding the cache's lock.
+
+  Args:
+    cache (dict): The cache.
+  """
+  with open(os.path.join(cache["directory"], "lock"), "wb") as lock_file:
+    fcntl.flock(lock_file, fcntl.LOCK_EX)
+    try:
+      entries=sorted(get_cache_entries(cache), key=lambda entry: entry[1])
+      size=sum(entry[2] for entry in entries)
+      target=cache["max_bytes"]*EVICTION_TARGET
+      for path, last_used, entry_size in entries:
+        if size<=target:
+          break
+        try:
+          os.unlink(path)
+        except FileNotFoundError:
+          pass
+        size-=entry_size
+      cache["size"]=size
+    finally:
+      fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+def get_artifacts(cache, program):
+  """Returns the artifacts of an inlined program, loading them from a cache if they are there, and building them and saving them to the cache otherwise.
+
+  Args:
+    cache (dict): The cache.
+    program (list): An inlined program, which must not contain any "exec" instructions.
+
+  Returns:
+    The artifacts of the program, as returned by build_artifacts.
+  """
+  normal_program=store.normalize_program(program)
+  artifacts=load_artifacts(cache, normal_program)
+  if artifacts is not None:
+    cache["hits"]+=1
+    return artifacts
+  cache["misses"]+=1
+  artifacts=build_artifacts(normal_program)
+  save_artifacts(cache, artifacts)
+  return artifacts
+
+def install_artifacts(program, artifacts):
+  """Adds the branch function in a program's artifacts to codegen.COMPILED_THEORIES, so that codegen.compile_theory returns it without compiling the program again.
+
+  Args:
+    program (list): The inlined program, in the form that will be passed to codegen.compile_theory.
+    artifacts (dict): The artifacts of the program. The program must be valid.
+
+  Returns:
+    A tuple (branch, fork_guards), as returned by codegen.compile_theory.
+  """
+  key=tuple(program)
+  found, compiled=codegen.use_cache_entry(codegen.COMPILED_THEORIES, key)
+  if found:
+    return compiled
+  namespace={"fork_branches": codegen.fork_branches}
+  exec(marshal.loads(artifacts["code"]), namespace)
+  return codegen.add_cache_entry(codegen.COMPILED_THEORIES, key, (namespace["branch"], artifacts["fork_guards"]), codegen.MAX_COMPILED_THEORIES)
+
+def compile_theory(cache, theory):
+  """Compiles an inlined theory as in codegen.compile_theory, using the artifacts in a cache instead of compiling it if they are there.
+
+  Args:
+    cache (dict): The cache.
+    theory (list): An inlined theory. It must be valid.
+
+  Returns:
+    A tuple (branch, fork_guards), as returned by codegen.compile_theory.
+  """
+  found, compiled=codegen.use_cache_entry(codegen.COMPILED_THEORIES, tuple(theory))
+  if found:
+    return compiled
+  return install_artifacts(theory, get_artifacts(cache, theory))
+
+def warm_start(cache, theories, routines, program_store=None):
+  """Prepares a process to run a mind's theories, by inlining every theory and loading its artifacts from a cache, or building them and saving them to the cache if they aren't there yet. Afterwards, codegen.compile_theory returns the branch functions of the theories without compiling them.
+
+  Args:
+    cache (dict): The cache.
+    theories (list): The mind's theories.
+    routines (list): The mind's routines.
+    program_store (dict): Defaults to None. If this is not None, the verdict and control map of each inlined theory are also recorded in this store, so that store.get_program_verdict and store.get_compiled_program don't need to compute them.
+
+  Returns:
+    The number of theories whose artifacts were loaded from the cache.
+  """
+  hits=cache["hits"]
+  for i in range(len(theories)):
+    theory=language.inline_execs(i, theories, routines)
+    artifacts=get_artifacts(cache, theory)
+    if artifacts["verdict"]:
+      install_artifacts(theory, artifacts)
+    if program_store is not None:
+      entry=store.intern_program(program_store, theory)[0]
+      entry[1]=artifacts["verdict"]
+      if artifacts["verdict"]:
+        entry[2]=artifacts["control_map"]
+  return cache["hits"]-hits
@@ -0,0 +1,580 @@
+"""This file contains a compiler that turns inlined theories into python functions, which produce the same outputs as language.run_theory without going through the interpreter's dispatch loop. Each basic instruction is compiled into a few lines of python that operate directly on the stacks, instead of being a call to an "instruction_" function.
+
+A compiled theory is a generator function with the same role as language.iterate_theory_branch: it takes a position in the theory and a program state, and yields the outputs of every strand of execution from that point. Since a fork can happen inside a loop, and each branch of the fork has to resume from the forking instruction, control flow can't be compiled into python's own loops. Instead, the theory is split into basic blocks, each of which is a run of straight-line code that starts at a forking instruction, a control flow instruction, or the target of a jump, and the compiled function loops over a binary tree of comparisons that jumps to the block at the current position.
+
+The interpreter checks the execution limit after every instruction. A compiled block checks once whether the whole block fits within the limit, and runs an unchecked copy of the block if it does, or a copy that checks after every instruction if it doesn't, so branches are cut off at exactly the same instruction as in the interpreter.
+
+Compiled functions are cached by the theory's content, so each distinct theory is only compiled once per process. The bytecode of compiled functions can also be kept on disk with cache.py, so that new processes don't need to compile them at all. Forks are executed as in the interpreter, including running each distinct claim once and skipping claims that can't pass a fork guard. Deadlines, cancellation, and profiling are not supported by compiled theories; use language.run_theory for those.
+
+This file also compiles superinstructions, which let the interpreter itself execute a whole routine at once. A routine without control flow is compiled into a single python function, which checks once that the stacks are deep enough for every instruction of the routine and that none of them would fork, and then runs the routine's instructions without those checks. language.iterate_theory runs the superinstruction wherever the routine was inlined, and falls back to executing the routine one instruction at a time when the checks fail or the routine could reach the execution limit. get_superinstructions compiles superinstructions for the routines that appear most often in the inlined theories, and measure_superinstructions reports the speedup of each one.
+
+The constants in a compiled theory or superinstruction are python integers, so if a theory's constants are numpy integers, arithmetic that would overflow numpy's 64-bit integers in the interpreter gives the exact result in compiled code instead.
+"""
+
+import itertools
+import time
+import language
+import store
+
+'''COMPILED_THEORIES maps each compiled theory, as a tuple of instructions, to a tuple (branch, fork_guards), as returned by compile_theory. Tuples are hashed by their content, so looking a theory up only costs one hash of its instructions. It holds at most MAX_COMPILED_THEORIES theories, and the least recently used theory is dropped when a new one is added.'''
+COMPILED_THEORIES={}
+
+'''MAX_COMPILED_THEORIES is the maximum number of theories kept in COMPILED_THEORIES.'''
+MAX_COMPILED_THEORIES=4096
+
+'''FUSED_ROUTINES maps the inlined implementation of each routine that a superinstruction was compiled for, as a tuple of instructions, to its "fused" function, or to None if the routine can't be executed by a superinstruction. It holds at most MAX_FUSED_ROUTINES routines, and the least recently used routine is dropped when a new one is added.'''
+FUSED_ROUTINES={}
+
+'''MAX_FUSED_ROUTINES is the maximum number of routines kept in FUSED_ROUTINES.'''
+MAX_FUSED_ROUTINES=4096
+
+'''MAX_SUPERINSTRUCTIONS is the default number of routines that get_superinstructions compiles superinstructions for.'''
+MAX_SUPERINSTRUCTIONS=32
+
+def get_block_starts(theory):
+  """Finds the positions at which the basic blocks of a theory start.
+
+  Args:
+    theory (list): An inlined theory.
+
+  Returns:
+    A sorted list of positions. Every control flow instruction and every forking instruction starts a block, as does every instruction after a control flow instruction.
+  """
+  starts=set([0])
+  for i in range(len(theory)):
+    instruction_function=language.instruction_functions[theory[i][0]]
+    if instruction_function in language.forking_functions:
+      starts.add(i)
+    if instruction_function in (language.instruction_if, language.instruction_else, language.instruction_while, language.instruction_for, language.instruction_end):
+      starts.add(i)
+      starts.add(i+1)
+  return sorted(start for start in starts if start<len(theory))
+
+def get_instruction_lines(instruction, check_depths=True, exit_statement="return"):
+  """Generates the python code for a basic instruction that isn't a control flow instruction. The code operates on the int-stack "I" and the claim-stack "C", and executes "return" when the instruction is undefined for the program state, which ends the branch without outputs, as in the interpreter.
+
+  Args:
+    instruction (tuple): The instruction.
+    check_depths (bool): Defaults to True. If this is False, the code doesn't check that the stacks are deep enough for the instruction, so the caller must have checked this already. Checks that depend on the values on the stacks are always made.
+    exit_statement (str): Defaults to "return". The statement executed when the instruction is undefined for the program state.
+
+  Returns:
+    A list of lines of python code, without indentation.
+  """
+  f=language.instruction_functions[instruction[0]]
+  args=[int(arg) for arg in instruction[1:]]
+  L=language
+  def check(condition):
+    return ["if "+condition+": "+exit_statement] if check_depths else []
+  if f==L.instruction_forward_int or f==L.instruction_forward_claim_set:
+    s="I" if f==L.instruction_forward_int else "C"
+    return check(str(args[0]+1)+">=len("+s+")")+["v="+s+"["+str(-(2+args[0]))+"]", "del "+s+"["+str(-(2+args[0]))+"]", s+".append(v)"]
+  if f==L.instruction_swap_int or f==L.instruction_swap_claim_set:
+    s="I" if f==L.instruction_swap_int else "C"
+    index=str(-(2+args[0]))
+    return check(str(args[0]+1)+">=len("+s+")")+["v="+s+"["+index+"]", s+"["+index+"]="+s+"[-1]", s+"[-1]=v"]
+  if f==L.instruction_duplicate_int:
+    return check(str(args[0])+">=len(I)")+["I.append(I["+str(-(1+args[0]))+"])"]
+  if f==L.instruction_remove_int or f==L.instruction_remove_claim_set:
+    s="I" if f==L.instruction_remove_int else "C"
+    return check(str(args[0])+">=len("+s+")")+["del "+s+"["+str(-(1+args[0]))+"]"]
+  if f==L.instruction_duplicate_claim_set:
+    return check(str(args[0])+">=len(C)")+["C.append([(c[0], c[1][:]) for c in C["+str(-(1+args[0]))+"]])"]
+  if f==L.instruction_push_const:
+    return ["I.append("+str(args[0])+")"]
+  if f==L.instruction_negate:
+    return check("len(I)<1")+["I.append(I[-1]*-1)"]
+  if f==L.instruction_not:
+    return check("len(I)<1")+["I.append(1 if I[-1]==0 else 0)"]
+  binary_expressions={
+    L.instruction_add: "I[-1]+I[-2]",
+    L.instruction_equal: "1 if I[-1]==I[-2] else 0",
+    L.instruction_less: "1 if I[-1]<I[-2] else 0",
+    L.instruction_and: "1 if (I[-1]!=0 and I[-2]!=0) else 0",
+    L.instruction_or: "1 if (I[-1]!=0 or I[-2]!=0) else 0",
+    # This is the same chained comparison as in instruction_xor, so it has the same meaning.
+    L.instruction_xor: "1 if (I[-1]!=0 != I[-2]!=0) else 0"
+  }
+  if f in binary_expressions:
+    return check("len(I)<2")+["I.append("+binary_expressions[f]+")"]
+  if f==L.instruction_int_count:
+    return ["I.append(len(I))"]
+  if f==L.instruction_claim_set_count:
+    return ["I.append(len(C))"]
+  if f==L.instruction_claim_int_count:
+    return check("len(C)<1")+["I.append(len(C[-1][1]))"]
+  if f==L.instruction_claim_bool:
+    return check("len(C)<1")+["I.append(1 if C[-1][0] else 0)"]
+  if f==L.instruction_new_claim:
+    return ["C.append((True,[]))"]
+  if f==L.instruction_set_claim_bool:
+    return check("len(I)<1 or len(C)<1")+["C[-1]=(False if I[-1]==0 else True,C[-1][1])"]
+  if f==L.instruction_push_claim_int:
+    return check("len(I)<1 or len(C)<1")+["C[-1][1].append(I[-1])"]
+  if f==L.instruction_claim_int or f==L.instruction_set_claim_int or f==L.instruction_remove_claim_int:
+    index=args[0]
+    if f==L.instruction_claim_int:
+      lines=check("len(C)<1")
+    else:
+      lines=check("len(I)<1 or len(C)<1")
+    if index<0:
+      lines.append("if "+str(-index)+">len(C[-1][1]): "+exit_statement)
+    else:
+      lines.append("if "+str(index)+">=len(C[-1][1]): "+exit_statement)
+    if f==L.instruction_claim_int:
+      lines.append("I.append(C[-1][1]["+str(index)+"])")
+    elif f==L.instruction_set_claim_int:
+      lines.append("C[-1][1]["+str(index)+"]=I[-1]")
+    else:
+      lines.append("del C[-1][1]["+str(index)+"]")
+    return lines
+  if f==L.instruction_assert:
+    if check_depths:
+      return ["if len(I)<1 or I[-1]==0: "+exit_statement]
+    return ["if I[-1]==0: "+exit_statement]
+  # The only remaining instruction is exec, which does nothing in an inlined theory.
+  return []
+
+def get_control_lines(theory, control_map, position):
+  """Generates the python code for a control flow instruction, which sets "pc" to the position to continue from. Positions are looked up in the control map in the same way as in the interpreter, and lookups that would fail in the interpreter raise the same exception when they are reached.
+
+  Args:
+    theory (list): An inlined theory.
+    control_map (tuple): The control map of the theory, as returned by language.get_control_map.
+    position (int): The position of the control flow instruction.
+
+  Returns:
+    A list of lines of python code, without indentation.
+  """
+  f=language.instruction_functions[theory[position][0]]
+  L=language
+  block_end="raise ValueError("+repr(str(position)+" is not in list")+")"
+  if position in control_map[0]:
+    block_end="pc="+str(control_map[1][control_map[0].index(position)]+1)
+  if f==L.instruction_if or f==L.instruction_while:
+    return ["if len(I)<1: return", "if I[-1]!=0:", "  pc="+str(position+1), "else:", "  "+block_end]
+  if f==L.instruction_else:
+    return [block_end]
+  if f==L.instruction_for:
+    # instruction_for returns the top integer, so an integer of -1 is mistaken for an error by the interpreter.
+    return ["if len(I)<1: return", "v=I[-1]", "if v==-1: return", "if v>0:", "  pc="+str(position+1), "  F.append(v)", "else:", "  "+block_end]
+  start=control_map[0][control_map[1].index(position)]
+  start_function=language.instruction_functions[theory[start][0]]
+  if start_function==L.instruction_while:
+    return ["pc="+str(start)]
+  if start_function==L.instruction_for:
+    return ["F[-1]-=1", "if F[-1]<=0:", "  F.pop()", "  pc="+str(position+1), "else:", "  pc="+str(start+1)]
+  return ["pc="+str(position+1)]
+
+def get_block_lines(theory, control_map, start, end):
+  """Generates the python code for the basic block between two positions.
+
+  Args:
+    theory (list): An inlined theory.
+    control_map (tuple): The control map of the theory.
+    start (int): The position of the first instruction of the block.
+    end (int): The position just after the last instruction of the block.
+
+  Returns:
+    A list of lines of python code, without indentation, which ends by continuing the dispatch loop.
+  """
+  lines=[]
+  first_function=language.instruction_functions[theory[start][0]]
+  if first_function in language.forking_functions:
+    lines+=["if len(C)>0 and isinstance(C[-1],list):", "  yield from fork_branches(branch, "+str(start)+", I, C, F, touched, count, limit, pushdown)", "  return"]
+  if language.instruction_functions[theory[end-1][0]] in (language.instruction_if, language.instruction_else, language.instruction_while, language.instruction_for, language.instruction_end):
+    # Control flow instructions are always alone in their blocks.
+    lines+=get_control_lines(theory, control_map, start)
+    lines+=["count+=1", "if count>=limit: return", "continue"]
+    return lines
+  instruction_lines=[get_instruction_lines(theory[i]) for i in range(start, end)]
+  lines.append("if count+"+str(end-start)+"<limit:")
+  for instruction in instruction_lines:
+    lines+=["  "+line for line in instruction]
+  lines.append("  count+="+str(end-start))
+  lines.append("else:")
+  for instruction in instruction_lines:
+    lines+=["  "+line for line in instruction]
+    lines+=["  count+=1", "  if count>=limit: return"]
+  lines+=["pc="+str(end), "continue"]
+  return lines
+
+def get_dispatch_lines(blocks, low, high):
+  """Generates a binary tree of comparisons that runs the block starting at "pc", among the blocks with indeces from "low" up to but not including "high".
+
+  Args:
+    blocks (list): A list of tuples (start, lines), one for each block, in order of position.
+    low (int): The index of the first block to choose from.
+    high (int): The index just after the last block to choose from.
+
+  Returns:
+    A list of lines of python code, without indentation.
+  """
+  if high-low==1:
+    return blocks[low][1]
+  middle=(low+high)//2
+  lines=["if pc<"+str(blocks[middle][0])+":"]
+  lines+=["  "+line for line in get_dispatch_lines(blocks, low, middle)]
+  lines.append("else:")
+  lines+=["  "+line for line in get_dispatch_lines(blocks, middle, high)]
+  return lines
+
+def generate_source(theory):
+  """Generates the python source code of the branch function of a theory.
+
+  Args:
+    theory (list): An inlined theory.
+
+  Returns:
+    A string containing the definition of a generator function named "branch", which takes the arguments (pc, I, C, F, touched, count, limit, pushdown). "pc" is the position to start from, "I", "C", and "F" are the int-stack, the claim-stack, and the for-counts of the state, "touched" is the list of touched inputs, "count" is the number of steps executed so far, "limit" is the execution limit, and "pushdown" is the pushdown of the execution, as in language.add_fork_guards, or None.
+  """
+  control_map=language.get_control_map(theory)
+  starts=get_block_starts(theory)
+  blocks=[]
+  for i in range(len(starts)):
+    end=starts[i+1] if i+1<len(starts) else len(theory)
+    blocks.append((starts[i], get_block_lines(theory, control_map, starts[i], end)))
+  blocks.append((len(theory), ["if len(C)>0 and not isinstance(C[-1],list):", "  yield (touched,C[-1])", "return"]))
+  lines=["def branch(pc, I, C, F, touched, count, limit, pushdown):", "  while True:"]
+  lines+=["    "+line for line in get_dispatch_lines(blocks, 0, len(blocks))]
+  return "\n".join(lines)+"\n"
+
+def fork_branches(branch, pc, I, C, F, touched, count, limit, pushdown):
+  """Executes every branch of a fork over the claim set on the top of the claim-stack, as in language.iterate_theory_branch.
+
+  Args:
+    branch (function): The branch function of the theory.
+    pc (int): The position of the forking instruction.
+    I (list): The int-stack.
+    C (list): The claim-stack, with a claim set on the top.
+    F (list): The for-counts.
+    touched (list): The touched inputs.
+    count (int): The number of steps executed so far.
+    limit (int): The execution limit.
+    pushdown (list): The pushdown of the execution, or None.
+
+  Returns:
+    A generator that yields the outputs of every branch, in order.
+  """
+  claims=C[-1]
+  branch_indeces=range(len(claims))
+  if pushdown is not None and pc in pushdown[0] and count+pushdown[0][pc][2]-1<limit:
+    branch_indeces=language.get_guarded_claims(pushdown, pushdown[0][pc], claims)
+  keys={i: (claims[i][0], tuple(claims[i][1])) for i in branch_indeces}
+  occurrences={}
+  for key in keys.values():
+    occurrences[key]=occurrences.get(key, 0)+1
+  replays={}
+  depth=len(touched)
+  for i in branch_indeces:
+    key=keys[i]
+    if key in replays:
+      for output in replays[key]:
+        yield (output[0][:depth]+[i]+output[0][depth+1:], (output[1][0], output[1][1][:]))
+      continue
+    claim_sets_copy=[]
+    for claim_set in C[:-1]:
+      if isinstance(claim_set,list):
+        claim_sets_copy.append(language.copy_claim_set(claim_set))
+      else:
+        claim_sets_copy.append((claim_set[0], claim_set[1][:]))
+    branch_outputs=branch(pc, I[:], claim_sets_copy+[claims[i]], F[:], touched[:]+[i], count, limit, pushdown)
+    if occurrences[key]==1:
+      yield from branch_outputs
+    else:
+      replays[key]=[]
+      for output in branch_outputs:
+        replays[key].append((output[0], (output[1][0], output[1][1][:])))
+        yield output
+
+def use_cache_entry(cache, key):
+  """Looks a key up in one of the caches of this file, and marks it as the most recently used key if it is there.
+
+  Args:
+    cache (dict): COMPILED_THEORIES or FUSED_ROUTINES.
+    key (tuple): The key to look up.
+
+  Returns:
+    A tuple (found, value), where "found" is True if the key is in the cache, and "value" is the value stored under it, or None if it isn't in the cache.
+  """
+  try:
+    value=cache.pop(key)
+  except KeyError:
+    return (False, None)
+  # Dictionaries keep their insertion order, so adding the key again at the end keeps the least recently used key first.
+  cache[key]=value
+  return (True, value)
+
+def add_cache_entry(cache, key, value, max_size):
+  """Adds a key to one of the caches of this file, dropping the least recently used key if the cache is full.
+
+  Args:
+    cache (dict): COMPILED_THEORIES or FUSED_ROUTINES.
+    key (tuple): The key to add.
+    value: The value to store under the key.
+    max_size (int): The maximum number of keys in the cache.
+
+  Returns:
+    The value.
+  """
+  while key not in cache and len(cache)>=max_size:
+    cache.pop(next(iter(cache)), None)
+  cache[key]=value
+  return value
+
+def compile_theory(theory):
+  """Compiles an inlined theory into a branch function, or returns the cached branch function if the theory was compiled before.
+
+  Args:
+    theory (list): An inlined theory.
+
+  Returns:
+    A tuple (branch, fork_guards), where "branch" is the branch function described in generate_source, and "fork_guards" are the fork guards of the theory, as returned by language.get_fork_guards.
+  """
+  key=tuple(theory)
+  found, compiled=use_cache_entry(COMPILED_THEORIES, key)
+  if found:
+    return compiled
+  normal_theory=store.normalize_program(theory)
+  namespace={"fork_branches": fork_branches}
+  exec(compile(generate_source(normal_theory), "<compiled theory "+str(store.program_fingerprint(normal_theory))+">", "exec"), namespace)
+  return add_cache_entry(COMPILED_THEORIES, key, (namespace["branch"], language.get_fork_guards(normal_theory)), MAX_COMPILED_THEORIES)
+
+def iterate_compiled_theory(theory_index, theories, routines, input_set, execution_limit=100, max_outputs=-1):
+  """Runs a theory on the provided set of claims by compiling it, yielding each resulting claim as in language.iterate_theory.
+
+  Args:
+    theory_index (int): The index of the theory in "theories" to be executed.
+    theories (list): The list of theories that can be referenced by the executing theory.
+    routines (list): The list of routines that can be referenced by the executing theory.
+    input_set (list): A list of claims that will be fed to the executing theory as input.
+    execution_limit (int): Defaults to 100. If execution reaches this number of steps without returning, it will stop.
+    max_outputs (int): Defaults to -1. If this is not -1, execution stops once this many outputs have been yielded.
+
+  Returns:
+    An iterator over the outputs of the theory, in the same order as language.iterate_theory.
+  """
+  branch, fork_guards=compile_theory(language.inline_execs(theory_index, theories, routines))
+  pushdown=[fork_guards, None] if len(fork_guards)>0 else None
+  outputs=branch(0, [], [language.copy_claim_set(input_set)], [], [], 0, execution_limit, pushdown)
+  if max_outputs!=-1:
+    return itertools.islice(outputs, max_outputs)
+  return outputs
+
+def run_compiled_theory(theory_index, theories, routines, input_set, execution_limit=100):
+  """Runs a theory on the provided set of claims by compiling it, and returns the resulting claims. This takes the same arguments as language.run_theory, without its optional features, and returns the same result.
+
+  Args:
+    theory_index (int): The index of the theory in "theories" to be executed.
+    theories (list): The list of theories that can be referenced by the executing theory.
+    routines (list): The list of routines that can be referenced by the executing theory.
+    input_set (list): A list of claims that will be fed to the executing theory as input.
+    execution_limit (int): Defaults to 100. If execution reaches this number of steps without returning, it will stop.
+
+  Returns:
+    The result of the theory's execution, as in language.run_theory.
+  """
+  return list(iterate_compiled_theory(theory_index, theories, routines, input_set, execution_limit))
+
+def get_superinstruction_preconditions(body):
+  """Finds the conditions under which an inlined routine can be executed by a superinstruction, by following the effect of each of its instructions on the depths of the stacks.
+
+  Args:
+    body (list): The inlined implementation of the routine.
+
+  Returns:
+    None if the routine can't be executed by a superinstruction, because it contains control flow or an exec, or because it would always fork over a claim set. Otherwise, a tuple (int_depth, claim_depth, lone_claims), where "int_depth" and "claim_depth" are the depths the int-stack and the claim-stack need for no instruction to run out of elements, and "lone_claims" is a sorted list of the depths in the initial claim-stack, counting the top as 1, of the claim sets that the routine reads or changes as single claims, which must not be claim sets for the routine to execute without forking.
+  """
+  L=language
+  int_depth=0
+  height=0
+  # Each element is the depth of an element of the initial claim-stack, "claim" for a single claim created by the routine, or "set" for a claim set created by the routine.
+  claims=[]
+  claim_depth=0
+  lone_claims=set()
+  for instruction in body:
+    f=L.instruction_functions[instruction[0]]
+    args=instruction[1:]
+    needed_ints=0
+    needed_claims=0
+    if f in (L.instruction_if, L.instruction_else, L.instruction_while, L.instruction_for, L.instruction_end, L.instruction_exec):
+      return None
+    if f==L.instruction_forward_int or f==L.instruction_swap_int:
+      needed_ints=args[0]+2
+    elif f==L.instruction_duplicate_int or f==L.instruction_remove_int:
+      needed_ints=args[0]+1
+    elif f in (L.instruction_add, L.instruction_equal, L.instruction_less, L.instruction_and, L.instruction_or, L.instruction_xor):
+      needed_ints=2
+    elif f in (L.instruction_negate, L.instruction_not, L.instruction_assert, L.instruction_set_claim_bool, L.instruction_push_claim_int, L.instruction_set_claim_int, L.instruction_remove_claim_int):
+      needed_ints=1
+    if f==L.instruction_forward_claim_set or f==L.instruction_swap_claim_set:
+      needed_claims=args[0]+2
+    elif f==L.instruction_duplicate_claim_set or f==L.instruction_remove_claim_set:
+      needed_claims=args[0]+1
+    elif f in L.forking_functions:
+      needed_claims=1
+    int_depth=max(int_depth, needed_ints-height)
+    while len(claims)<needed_claims:
+      claim_depth+=1
+      claims.insert(0, claim_depth)
+    if f in L.forking_functions:
+      if claims[-1]=="set":
+        return None
+      if claims[-1]!="claim":
+        lone_claims.add(claims[-1])
+    if f==L.instruction_forward_claim_set:
+      claims.append(claims.pop(-(2+args[0])))
+    elif f==L.instruction_swap_claim_set:
+      claims[-(2+args[0])], claims[-1]=claims[-1], claims[-(2+args[0])]
+    elif f==L.instruction_duplicate_claim_set:
+      # Duplicating a single claim always raises an exception, so there is nothing to gain from fusing it.
+      if claims[-(1+args[0])]=="claim":
+        return None
+      claims.append("set")
+    elif f==L.instruction_remove_claim_set:
+      del claims[-(1+args[0])]
+    elif f==L.instruction_new_claim:
+      claims.append("claim")
+    if f==L.instruction_remove_int:
+      height-=1
+    elif f not in (L.instruction_forward_int, L.instruction_swap_int, L.instruction_assert, L.instruction_forward_claim_set, L.instruction_swap_claim_set, L.instruction_duplicate_claim_set, L.instruction_remove_claim_set, L.instruction_new_claim, L.instruction_set_claim_bool, L.instruction_push_claim_int, L.instruction_set_claim_int, L.instruction_remove_claim_int):
+      height+=1
+  return (int_depth, claim_depth, sorted(lone_claims))
+
+def generate_superinstruction_source(body, preconditions):
+  """Generates the python source code of the superinstruction of an inlined routine.
+
+  Args:
+    body (list): The inlined implementation of the routine.
+    preconditions (tuple): The preconditions of the routine, as returned by get_superinstruction_preconditions.
+
+  Returns:
+    A string containing the definition of a function named "fused", which takes the arguments (I, C), the int-stack and the claim-stack of a state. If the preconditions don't hold, it returns False without changing the stacks. Otherwise, it executes the routine without checking the depths of the stacks, and returns -1 if an instruction is undefined for the state, as the interpreter's instruction functions do, or True if the routine finishes.
+  """
+  int_depth, claim_depth, lone_claims=preconditions
+  lines=["def fused(I, C):"]
+  if int_depth>0 or claim_depth>0:
+    lines.append("  if len(I)<"+str(int_depth)+" or len(C)<"+str(claim_depth)+": return False")
+  if len(lone_claims)>0:
+    lines.append("  if "+" or ".join("isinstance(C["+str(-depth)+"],list)" for depth in lone_claims)+": return False")
+  for instruction in body:
+    lines+=["  "+line for line in get_instruction_lines(instruction, False, "return -1")]
+  lines.append("  return True")
+  return "\n".join(lines)+"\n"
+
+def compile_superinstruction(body):
+  """Compiles the superinstruction of an inlined routine, or returns the cached superinstruction if the routine was compiled before.
+
+  Args:
+    body (list): The inlined implementation of the routine.
+
+  Returns:
+    The "fused" function described in generate_superinstruction_source, or None if the routine can't be executed by a superinstruction.
+  """
+  key=tuple(body)
+  found, fused=use_cache_entry(FUSED_ROUTINES, key)
+  if found:
+    return fused
+  preconditions=get_superinstruction_preconditions(body)
+  if preconditions is None:
+    return add_cache_entry(FUSED_ROUTINES, key, None, MAX_FUSED_ROUTINES)
+  namespace={}
+  exec(compile(generate_superinstruction_source(body, preconditions), "<superinstruction "+str(store.program_fingerprint(store.normalize_program(body)))+">", "exec"), namespace)
+  return add_cache_entry(FUSED_ROUTINES, key, namespace["fused"], MAX_FUSED_ROUTINES)
+
+def get_routine_uses(theories, routines):
+  """Counts the number of times each routine appears in the inlined theories, including the copies that are inlined within other routines.
+
+  Args:
+    theories (list): The theories.
+    routines (list): The routines.
+
+  Returns:
+    A list with the number of uses of each routine.
+  """
+  uses=[0]*len(routines)
+  for i in range(len(theories)):
+    spans=[]
+    language.inline_execs(i, theories, routines, spans=spans)
+    for span in spans:
+      uses[span[2]]+=1
+  return uses
+
+def get_superinstructions(theories, routines, max_superinstructions=MAX_SUPERINSTRUCTIONS):
+  """Compiles superinstructions for the most used routines, to be passed to language.iterate_theory.
+
+  Args:
+    theories (list): The theories, which are used to rank the routines by the number of times they appear in the inlined theories.
+    routines (list): The routines.
+    max_superinstructions (int): Defaults to MAX_SUPERINSTRUCTIONS. The maximum number of routines to compile. If this is -1, every routine that can be executed by a superinstruction is compiled.
+
+  Returns:
+    A dictionary mapping the index of each chosen routine to a tuple (function, length), where "function" is its "fused" function, and "length" is the length of its inlined implementation.
+  """
+  uses=get_routine_uses(theories, routines)
+  superinstructions={}
+  for i in sorted(range(len(routines)), key=lambda i: -uses[i]):
+    if max_superinstructions!=-1 and len(superinstructions)>=max_superinstructions:
+      break
+    body=language.inline_execs(i, routines, routines, inline_theories=False)
+    if uses[i]==0 or len(body)<2:
+      continue
+    fused=compile_superinstruction(body)
+    if fused is not None:
+      superinstructions[i]=(fused, len(body))
+  return superinstructions
+
+def get_sample_state(body, preconditions):
+  """Creates a state that satisfies the preconditions of a routine's superinstruction, to time the routine on. Every integer is 1, and every claim is True and has enough integers for the routine's claim_int, set_claim_int, and remove_claim_int instructions.
+
+  Returns:
+    A tuple (int_stack, claim_stack).
+  """
+  length=1+max([abs(int(instruction[1])) for instruction in body if language.instruction_functions[instruction[0]] in (language.instruction_claim_int, language.instruction_set_claim_int, language.instruction_remove_claim_int)]+[0])
+  return ([1]*preconditions[0], [(True, [1]*length) for i in range(preconditions[1])])
+
+def measure_superinstructions(theories, routines, superinstructions, repeats=1000):
+  """Measures the speedup of each superinstruction, by timing the interpreter on the routine's inlined implementation with and without the superinstruction, starting from a sample state.
+
+  Args:
+    theories (list): The theories.
+    routines (list): The routines.
+    superinstructions (dict): The superinstructions, as returned by get_superinstructions.
+    repeats (int): Defaults to 1000. The number of times to execute each routine in each way.
+
+  Returns:
+    A list of dictionaries, one for each superinstruction in order of routine index, with the keys "routine", "length", "uses", "interpreted_seconds", "fused_seconds", and "speedup". The times are the total over all repeats. If the routine fails on the sample state, the times and the speedup are None.
+  """
+  uses=get_routine_uses(theories, routines)
+  measurements=[]
+  for i in sorted(superinstructions):
+    body=language.inline_execs(i, routines, routines, inline_theories=False)
+    sample=get_sample_state(body, get_superinstruction_preconditions(body))
+    measurement={"routine": i, "length": len(body), "uses": uses[i], "interpreted_seconds": None, "fused_seconds": None, "speedup": None}
+    if superinstructions[i][0](sample[0][:], [(claim[0], claim[1][:]) for claim in sample[1]])==True:
+      control_map=language.get_control_map(body)
+      times=[]
+      for context in (language.DEFAULT_EXECUTION_CONTEXT, language.add_superinstructions(language.DEFAULT_EXECUTION_CONTEXT, [[0, len(body), i]], superinstructions)):
+        states=[(0, sample[0][:], [(claim[0], claim[1][:]) for claim in sample[1]], []) for j in range(repeats)]
+        start=time.perf_counter()
+        for state in states:
+          for output in language.iterate_theory_branch(body, state, control_map, [], len(body)+1, 0, context):
+            pass
+        times.append(time.perf_counter()-start)
+      measurement["interpreted_seconds"]=times[0]
+      measurement["fused_seconds"]=times[1]
+      measurement["speedup"]=times[0]/times[1] if times[1]>0 else None
+    measurements.append(measurement)
+  return measurements
+
+def superinstruction_report_string(measurements):
+  """Describes the speedups measured by measure_superinstructions as a human readable string, with one line for each superinstruction."""
+  lines=[]
+  for measurement in measurements:
+    line="routine "+str(measurement["routine"])+": "+str(measurement["length"])+" instructions, "+str(measurement["uses"])+" uses, "
+    if measurement["speedup"] is None:
+      line+="not measured"
+    else:
+      line+="{:.2f}x faster ({:.6f}s interpreted, {:.6f}s fused)".format(measurement["speedup"], measurement["interpreted_seconds"], measurement["fused_seconds"])
+    lines.append(line)
+  return "\n".join(lines)
@@ -1,6 +1,8 @@
 import language
+import store
 from numpy.random import random
 from numpy.random import geometric
+from numpy.random import RandomState
 
 '''MUTATION_TYPE_DISTRIBUTION is a distribution that controls the selection of mutation types. The three types are insertion, deletion, and inlining (replacing a referenced theory or routine with its implementation), and the distribution should contain three numbers corresponding to the likelihood of each type. The three numbers must sum to 1.'''
 MUTATION_TYPE_DISTRIBUTION=[0.4,0.4,0.2]
@@ -8,6 +10,26 @@ MUTATION_TYPE_DISTRIBUTION=[0.4,0.4,0.2]
 '''INSERTION_TYPE_DISTRIBUTION is a distribution that controls the selection of insertion types in an insertion mutation. The three types of insertion are basic instruction insertion, theory insertion, and routine insertion, and the distribution should contain three numbers corresponding to the likelihood of each type. The three numbers must sum to 1.'''
 INSERTION_TYPE_DISTRIBUTION=[0.9, 0.05, 0.05]
 
+'''PROBE_SET_COUNT, PROBE_SET_SIZE, and PROBE_MAX_INT_COUNT control the default probe bank used for behavioral fingerprinting. The bank contains PROBE_SET_COUNT sets of PROBE_SET_SIZE claims each, and each claim has between 0 and PROBE_MAX_INT_COUNT integers.'''
+PROBE_SET_COUNT=8
+PROBE_SET_SIZE=4
+PROBE_MAX_INT_COUNT=4
+
+'''PROBE_BANK_SEED is the random seed used to generate the default probe bank, so that the bank is the same in every process.'''
+PROBE_BANK_SEED=0
+
+'''PROBE_BANKS caches the probe banks created by get_probe_bank, keyed by the arguments used to create them. It holds at most MAX_PROBE_BANKS banks, and the least recently used bank is dropped when a new one is added.'''
+PROBE_BANKS={}
+
+'''MAX_PROBE_BANKS is the maximum number of probe banks kept in PROBE_BANKS.'''
+MAX_PROBE_BANKS=8
+
+'''BEHAVIORS caches the behavior of each inlined theory, as computed by get_behavior, keyed by the normalized inlined theory, the probe bank key, and the execution limit. This lets the behaviors of existing theories be reused across conjecture rounds. It holds at most MAX_BEHAVIORS behaviors, and the least recently used behavior is dropped when a new one is added.'''
+BEHAVIORS={}
+
+'''MAX_BEHAVIORS is the maximum number of behaviors kept in BEHAVIORS.'''
+MAX_BEHAVIORS=10000
+
 def vary(theories, theory_index, routines, steps=1):
   """Generates a variation on a given theory.
 
@@ -125,6 +147,140 @@ def vary(theories, theory_index, routines, steps=1):
 
   return theory
 
+def vary_novel(theories, theory_index, routines, program_store, steps=1, max_attempts=100):
+  """Generates a variation on a given theory that is not already present in a store. Each variation produced by "vary" is interned in the store, so variations that duplicate an existing theory, or a theory that was tried and rejected earlier, are discarded with a single hash lookup.
+
+  Args:
+    theories (list): The list of theories that can be referenced by the specified theory. This is also used, along with "theory_index", to determine which theory will be varied.
+    theory_index (int): The index of the theory in "theories" that should be varied.
+    routines (list): The list of routines that can be referenced by the specified theory.
+    program_store (dict): A store, as created by store.new_store, containing every theory that has been seen so far. The returned theory will be interned in this store.
+    steps (int): Defaults to 1. The number of iterations of variation to perform for each attempt, as in "vary".
+    max_attempts (int): Defaults to 100. The maximum number of variations to try before giving up.
+
+  Returns:
+    A new theory that was not present in "program_store" before this call, or False if no such theory was found within "max_attempts" attempts.
+  """
+  for attempt in range(max_attempts):
+    theory=vary(theories, theory_index, routines, steps)
+    entry, is_new=store.intern_program(program_store, theory)
+    if is_new:
+      return theory
+  return False
+
+def get_probe_bank(seed=PROBE_BANK_SEED, set_count=PROBE_SET_COUNT, set_size=PROBE_SET_SIZE, max_int_count=PROBE_MAX_INT_COUNT):
+  """Returns a fixed bank of probe input sets, which are used to compare the behavior of theories. The bank is generated from its own random state, so it doesn't depend on or affect the global random state, and it is cached so that it is only generated once per process.
+
+  Args:
+    seed (int): Defaults to PROBE_BANK_SEED. The seed used to generate the bank.
+    set_count (int): Defaults to PROBE_SET_COUNT. The number of input sets in the bank.
+    set_size (int): Defaults to PROBE_SET_SIZE. The number of claims in each input set.
+    max_int_count (int): Defaults to PROBE_MAX_INT_COUNT. The maximum number of integers in each claim.
+
+  Returns:
+    A tuple (key, input_sets)
+      key (tuple): A tuple identifying the bank, which is used as part of the key when caching behaviors.
+      input_sets (list): A list of lists of claims.
+  """
+  key=(seed, set_count, set_size, max_int_count)
+  if key in PROBE_BANKS:
+    # Moving the bank to the end of the dictionary marks it as the most recently used.
+    PROBE_BANKS[key]=PROBE_BANKS.pop(key)
+  else:
+    if len(PROBE_BANKS)>=MAX_PROBE_BANKS:
+      del PROBE_BANKS[next(iter(PROBE_BANKS))]
+    random_state=RandomState(seed)
+    input_sets=[]
+    for i in range(set_count):
+      input_set=[]
+      for i2 in range(set_size):
+        int_count=int(random_state.randint(0, max_int_count+1))
+        input_set.append((bool(random_state.randint(0, 2)), [int(random_state.randint(-2, 4)) for i3 in range(int_count)]))
+      input_sets.append(input_set)
+    PROBE_BANKS[key]=(key, input_sets)
+  return PROBE_BANKS[key]
+
+def get_behavior(theory_index, theories, routines, probe_bank=None, execution_limit=100):
+  """Computes the behavior of a theory by running it on every input set in a probe bank. The outputs of each probe set are sorted, so the behavior doesn't depend on the order in which the outputs were produced.
+
+  Args:
+    theory_index (int): The index of the theory in "theories" to run.
+    theories (list): The list of theories that can be referenced by the theory. This is also used, along with "theory_index", to find the theory which will be run.
+    routines (list): The list of routines that can be referenced by the theory.
+    probe_bank (tuple): Defaults to None. A probe bank, as returned by get_probe_bank. If this is None, the default probe bank will be used.
+    execution_limit (int): Defaults to 100. The execution limit used for each run of the theory.
+
+  Returns:
+    A tuple with one element for each input set in the probe bank, which is a sorted tuple of the outputs produced from that set. Each output is a tuple (touched_inputs, claim_bool, claim_ints).
+  """
+  if probe_bank is None:
+    probe_bank=get_probe_bank()
+  inlined_theory=store.normalize_program(language.inline_execs(theory_index, theories, routines))
+  cache_key=(inlined_theory, probe_bank[0], execution_limit)
+  if cache_key in BEHAVIORS:
+    BEHAVIORS[cache_key]=BEHAVIORS.pop(cache_key)
+  else:
+    results=language.run_theory_batch(0, [list(inlined_theory)], [], probe_bank[1], execution_limit)
+    if len(BEHAVIORS)>=MAX_BEHAVIORS:
+      del BEHAVIORS[next(iter(BEHAVIORS))]
+    BEHAVIORS[cache_key]=tuple(tuple(sorted((tuple(output[0]), output[1][0], tuple(output[1][1])) for output in outputs)) for outputs in results)
+  return BEHAVIORS[cache_key]
+
+def behavior_fingerprint(theory_index, theories, routines, probe_bank=None, execution_limit=100):
+  """Computes a behavioral fingerprint for a theory, which is the hash of its behavior as computed by get_behavior. Theories that produce the same outputs on every probe set get the same fingerprint, even if their implementations differ, for example because one contains dead code.
+
+  Args:
+    theory_index (int): The index of the theory in "theories" to fingerprint.
+    theories (list): The list of theories that can be referenced by the theory. This is also used, along with "theory_index", to find the theory which will be fingerprinted.
+    routines (list): The list of routines that can be referenced by the theory.
+    probe_bank (tuple): Defaults to None. The probe bank to use, as in get_behavior.
+    execution_limit (int): Defaults to 100. The execution limit used for each run of the theory.
+
+  Returns:
+    An integer fingerprint of the theory's behavior.
+  """
+  return hash(get_behavior(theory_index, theories, routines, probe_bank, execution_limit))
+
+def new_behavior_index(theories, routines, probe_bank=None, execution_limit=100):
+  """Creates a behavior index, which maps the behavioral fingerprint of each theory to the indeces of the theories that have that fingerprint.
+
+  Args:
+    theories (list): The theories to index.
+    routines (list): The list of routines that can be referenced by the theories.
+    probe_bank (tuple): Defaults to None. The probe bank to use, as in behavior_fingerprint.
+    execution_limit (int): Defaults to 100. The execution limit to use, as in behavior_fingerprint.
+
+  Returns:
+    A dictionary mapping integer fingerprints to lists of theory indeces.
+  """
+  behavior_index={}
+  for i in range(len(theories)):
+    behavior_index.setdefault(behavior_fingerprint(i, theories, routines, probe_bank, execution_limit), []).append(i)
+  return behavior_index
+
+def find_behavioral_duplicate(behavior_index, theory, theories, routines, probe_bank=None, execution_limit=100):
+  """Checks whether a candidate theory behaves identically to a theory that is already in a behavior index. Different behaviors can have the same fingerprint, so the behaviors of the theories with the candidate's fingerprint are compared with the candidate's before one of them is reported as a duplicate.
+
+  Args:
+    behavior_index (dict): A behavior index, as created by new_behavior_index for "theories".
+    theory (list): The candidate theory. It may reference any of the theories in "theories".
+    theories (list): The list of theories that the candidate theory can reference.
+    routines (list): The list of routines that can be referenced by the candidate theory.
+    probe_bank (tuple): Defaults to None. The probe bank to use, as in behavior_fingerprint. This should be the same bank that was used to create "behavior_index".
+    execution_limit (int): Defaults to 100. The execution limit to use, as in behavior_fingerprint.
+
+  Returns:
+    A tuple (duplicate_index, fingerprint)
+      duplicate_index (int): The index of a theory with the same behavior as the candidate, or -1 if there is no such theory.
+      fingerprint (int): The fingerprint of the candidate, which can be used to add it to the index if it is accepted.
+  """
+  behavior=get_behavior(len(theories), theories+[theory], routines, probe_bank, execution_limit)
+  fingerprint=hash(behavior)
+  for i in behavior_index.get(fingerprint, []):
+    if get_behavior(i, theories, routines, probe_bank, execution_limit)==behavior:
+      return (i, fingerprint)
+  return (-1, fingerprint)
+
 def choose_from_distribution(d):
   """Given a list of non-negative numbers that sum to 1, this function randomly returns the index of one of the numbers. The probability of a given index being chosen is equal to the number in the list at that index.
 
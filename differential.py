@@ -0,0 +1,274 @@
+"""This file contains a harness for differential testing and benchmarking of theory execution engines. An engine is any function with the same signature as language.run_theory, which is the reference engine. The harness generates a random corpus of theories and claim sets, runs each case through the reference engine and a candidate engine, and checks that the results are exactly the same, including the order of the outputs, the touched inputs in each record, and which branches are cut off by the execution limit. The time each engine takes on each case is recorded, so one run reports both the correctness and the speed of the candidate engine.
+
+When the engines disagree, the case is minimized, by repeatedly removing instructions and claims while the engines still disagree, so that the reported reproducer is as small as possible.
+
+The harness can be used from the command line, with the candidate engine given as "module:function":
+  python differential.py my_engine:run_theory --count 1000 --seed 0
+
+A case is a tuple (theory_index, theories, routines, input_set, execution_limit), which are the arguments passed to the engines.
+"""
+
+import argparse
+import importlib
+import math
+import signal
+import sys
+import time
+import numpy.random
+import conjecture
+import examples
+import language
+
+'''SEED_THEORIES are the theories that random theories in the corpus are varied from, and SEED_ROUTINES are the routines that they can reference. Starting from working theories, rather than from empty ones, makes it more likely that the random theories fork and produce outputs.'''
+SEED_THEORIES=[[], examples.INCREMENT_THEORY, examples.REPEAT_INCREMENT_10_TIMES_THEORY, examples.SUM_THEORY]
+SEED_ROUTINES=[examples.INCREMENT_THEORY, examples.REPEAT_INCREMENT_THEORY]
+
+class CaseTimeout(Exception):
+  """Raised when the reference engine takes too long on a case while the corpus is being generated."""
+
+def call_with_timeout(function, args, timeout):
+  """Calls a function, raising CaseTimeout if it takes longer than a timeout. The timeout uses SIGALRM, so it is only enforced on platforms that support it, and only in the main thread.
+
+  Args:
+    function (function): The function to call.
+    args (tuple): The arguments to pass to the function.
+    timeout (float): The timeout, in seconds.
+
+  Returns:
+    The return value of the function.
+  """
+  if not hasattr(signal, "setitimer"):
+    return function(*args)
+  def handle_alarm(signum, frame):
+    raise CaseTimeout()
+  previous_handler=signal.signal(signal.SIGALRM, handle_alarm)
+  signal.setitimer(signal.ITIMER_REAL, timeout)
+  try:
+    return function(*args)
+  finally:
+    signal.setitimer(signal.ITIMER_REAL, 0)
+    signal.signal(signal.SIGALRM, previous_handler)
+
+def generate_corpus(count, seed=0, max_steps=12, max_claims=6, max_ints=4, execution_limit=50, case_timeout=1.0):
+  """Generates a random corpus of cases. Each theory is created by varying one of SEED_THEORIES with conjecture.vary, and each input set contains random claims, some of which are duplicated so that forks over equal claims are exercised. Cases on which the reference engine takes longer than "case_timeout" are discarded, since some random theories fork an exponential number of times.
+
+  Args:
+    count (int): The number of cases to generate.
+    seed (int): Defaults to 0. The random seed, so that the same corpus can be generated again.
+    max_steps (int): Defaults to 12. The maximum number of steps of variation applied to each theory.
+    max_claims (int): Defaults to 6. The maximum number of distinct claims in each input set.
+    max_ints (int): Defaults to 4. The maximum number of integers in each claim.
+    execution_limit (int): Defaults to 50. The execution limit of each case.
+    case_timeout (float): Defaults to 1.0. The time, in seconds, after which a case is discarded.
+
+  Returns:
+    A list of "count" cases.
+  """
+  numpy.random.seed(seed)
+  random_state=numpy.random.RandomState(seed)
+  corpus=[]
+  while len(corpus)<count:
+    theories=[theory[:] for theory in SEED_THEORIES]
+    theory_index=int(random_state.randint(0, len(theories)))
+    theories[theory_index]=conjecture.vary(theories, theory_index, SEED_ROUTINES, steps=int(random_state.randint(1, max_steps+1)))
+    input_set=[]
+    for i in range(int(random_state.randint(0, max_claims+1))):
+      input_set.append((bool(random_state.randint(0, 2)), [int(random_state.randint(-2, 4)) for i2 in range(int(random_state.randint(0, max_ints+1)))]))
+    if len(input_set)>0 and random_state.randint(0, 2)==1:
+      input_set+=[(claim[0], claim[1][:]) for claim in input_set[:int(random_state.randint(1, len(input_set)+1))]]
+    case=(theory_index, theories, [routine[:] for routine in SEED_ROUTINES], input_set, execution_limit)
+    try:
+      call_with_timeout(run_case, (language.run_theory, case), case_timeout)
+    except CaseTimeout:
+      continue
+    corpus.append(case)
+  return corpus
+
+def run_case(engine, case):
+  """Runs an engine on a case.
+
+  Args:
+    engine (function): The engine to run.
+    case (tuple): The case to run.
+
+  Returns:
+    A tuple ("ok", outputs) if the engine returned normally, or ("error", name) if it raised an exception, where "name" is the name of the exception's type.
+  """
+  try:
+    return ("ok", engine(case[0], case[1], case[2], case[3], case[4]))
+  except CaseTimeout:
+    raise
+  except Exception as e:
+    return ("error", type(e).__name__)
+
+def time_case(engine, case, minimum_seconds=0.001):
+  """Measures the time an engine takes on a case. Fast cases are repeated until at least "minimum_seconds" have passed, so that their times are not dominated by the resolution of the clock.
+
+  Args:
+    engine (function): The engine to time.
+    case (tuple): The case to run.
+    minimum_seconds (float): Defaults to 0.001. The minimum total time to measure.
+
+  Returns:
+    The average time of one run, in seconds.
+  """
+  runs=0
+  start=time.perf_counter()
+  while True:
+    run_case(engine, case)
+    runs+=1
+    elapsed=time.perf_counter()-start
+    if elapsed>=minimum_seconds:
+      return elapsed/runs
+
+def diverges(reference, candidate, case):
+  """Returns True if two engines produce different results on a case."""
+  return run_case(reference, case)!=run_case(candidate, case)
+
+def minimize_case(reference, candidate, case):
+  """Shrinks a case on which two engines disagree, while keeping the disagreement. The executed theory is first inlined, so that the reproducer doesn't depend on any other programs. Then instructions, claims, and integers in claims are removed one at a time, and each removal is kept if the engines still disagree, until no more removals are possible.
+
+  Args:
+    reference (function): The reference engine.
+    candidate (function): The candidate engine.
+    case (tuple): A case on which the engines disagree.
+
+  Returns:
+    A case on which the engines disagree, which is no larger than "case".
+  """
+  theory_index, theories, routines, input_set, execution_limit=case
+  inlined_case=(0, [language.inline_execs(theory_index, theories, routines)], [], input_set, execution_limit)
+  if diverges(reference, candidate, inlined_case):
+    case=inlined_case
+
+  changed=True
+  while changed:
+    changed=False
+    theory_index, theories, routines, input_set, execution_limit=case
+    theory=theories[theory_index]
+
+    # Try removing single instructions, and pairs of instructions (such as a block starter and its end).
+    for length in (1, 2):
+      for i in range(len(theory)):
+        # A single instruction has only one candidate, so the second position is only varied for pairs.
+        for i2 in (range(i+1, len(theory)) if length==2 else [i]):
+          smaller_theory=theory[:i]+theory[i+1:i2]+theory[i2+1:] if length==2 else theory[:i]+theory[i+1:]
+          if not language.is_program_valid(smaller_theory):
+            continue
+          smaller_theories=theories[:theory_index]+[smaller_theory]+theories[theory_index+1:]
+          smaller_case=(theory_index, smaller_theories, routines, input_set, execution_limit)
+          if diverges(reference, candidate, smaller_case):
+            case=smaller_case
+            changed=True
+            break
+        if changed:
+          break
+      if changed:
+        break
+    if changed:
+      continue
+
+    # Try removing claims, and then integers from claims.
+    for i in range(len(input_set)):
+      smaller_case=(theory_index, theories, routines, input_set[:i]+input_set[i+1:], execution_limit)
+      if diverges(reference, candidate, smaller_case):
+        case=smaller_case
+        changed=True
+        break
+    if changed:
+      continue
+    for i in range(len(input_set)):
+      for i2 in range(len(input_set[i][1])):
+        claim=(input_set[i][0], input_set[i][1][:i2]+input_set[i][1][i2+1:])
+        smaller_case=(theory_index, theories, routines, input_set[:i]+[claim]+input_set[i+1:], execution_limit)
+        if diverges(reference, candidate, smaller_case):
+          case=smaller_case
+          changed=True
+          break
+      if changed:
+        break
+  return case
+
+def case_string(case):
+  """Returns a human-readable description of a case, including the executed theory in the format of language.program_string."""
+  theory_index, theories, routines, input_set, execution_limit=case
+  return "theory "+str(theory_index)+":\n"+language.program_string(theories[theory_index])+"theories: "+str(theories)+"\nroutines: "+str(routines)+"\ninput set: "+str(input_set)+"\nexecution limit: "+str(execution_limit)+"\n"
+
+def compare_engines(candidate, reference=language.run_theory, corpus=None, count=1000, seed=0):
+  """Runs every case in a corpus through a reference engine and a candidate engine, checking that their results are the same and measuring the speedup of the candidate on each case. Stops at the first case on which the engines disagree.
+
+  Args:
+    candidate (function): The candidate engine.
+    reference (function): Defaults to language.run_theory. The reference engine.
+    corpus (list): Defaults to None. The cases to run. If this is None, a corpus is generated with generate_corpus, using "count" and "seed".
+    count (int): Defaults to 1000. The number of cases to generate, if "corpus" is None.
+    seed (int): Defaults to 0. The random seed used to generate the corpus, if "corpus" is None.
+
+  Returns:
+    A dictionary with the following keys:
+    -"cases" is the number of cases on which the engines agreed.
+    -"divergence" is None if the engines agreed on every case, and otherwise a dictionary with the keys "case" (the first case on which they disagreed), "minimized" (a minimized version of that case), "reference_result", and "candidate_result" (the results of the engines on the minimized case, as returned by run_case).
+    -"speedups" is a list containing the speedup of the candidate engine on each case on which the engines agreed (the reference engine's time divided by the candidate's time).
+    -"reference_seconds" and "candidate_seconds" are the total time taken by each engine on those cases.
+    -"geometric_mean_speedup" is the geometric mean of the speedups, or None if there are none.
+  """
+  if corpus is None:
+    corpus=generate_corpus(count, seed)
+  report={"cases": 0, "divergence": None, "speedups": [], "reference_seconds": 0.0, "candidate_seconds": 0.0, "geometric_mean_speedup": None}
+  for case in corpus:
+    if diverges(reference, candidate, case):
+      minimized=minimize_case(reference, candidate, case)
+      report["divergence"]={"case": case, "minimized": minimized, "reference_result": run_case(reference, minimized), "candidate_result": run_case(candidate, minimized)}
+      break
+    reference_seconds=time_case(reference, case)
+    candidate_seconds=time_case(candidate, case)
+    report["cases"]+=1
+    report["reference_seconds"]+=reference_seconds
+    report["candidate_seconds"]+=candidate_seconds
+    report["speedups"].append(reference_seconds/candidate_seconds if candidate_seconds>0 else math.inf)
+  if len(report["speedups"])>0:
+    report["geometric_mean_speedup"]=math.exp(sum(math.log(s) for s in report["speedups"])/len(report["speedups"]))
+  return report
+
+def report_string(report):
+  """Returns a human-readable description of a report returned by compare_engines."""
+  string=str(report["cases"])+" cases agreed\n"
+  if report["geometric_mean_speedup"] is not None:
+    string+="reference time: "+format(report["reference_seconds"], ".6f")+"s\n"
+    string+="candidate time: "+format(report["candidate_seconds"], ".6f")+"s\n"
+    string+="total speedup: "+format(report["reference_seconds"]/report["candidate_seconds"], ".3f")+"x\n"
+    string+="geometric mean speedup: "+format(report["geometric_mean_speedup"], ".3f")+"x\n"
+    string+="slowest case speedup: "+format(min(report["speedups"]), ".3f")+"x\n"
+  if report["divergence"] is not None:
+    divergence=report["divergence"]
+    string+="\nDIVERGENCE\nminimized case:\n"+case_string(divergence["minimized"])
+    string+="reference result: "+str(divergence["reference_result"])+"\n"
+    string+="candidate result: "+str(divergence["candidate_result"])+"\n"
+  return string
+
+def load_engine(name):
+  """Loads an engine given as "module:function"."""
+  module_name, function_name=name.split(":")
+  return getattr(importlib.import_module(module_name), function_name)
+
+def main(arguments):
+  """Runs the command line interface described at the top of this file.
+
+  Args:
+    arguments (list): The command line arguments, not including the program name.
+
+  Returns:
+    The exit status: 0 if the engines agreed on every case, and 1 otherwise.
+  """
+  parser=argparse.ArgumentParser(description="Differential testing and benchmarking of theory execution engines.")
+  parser.add_argument("candidate", help="the candidate engine, as module:function")
+  parser.add_argument("--reference", default="language:run_theory", help="the reference engine, as module:function")
+  parser.add_argument("--count", type=int, default=1000, help="the number of random cases")
+  parser.add_argument("--seed", type=int, default=0, help="the random seed used to generate the cases")
+  args=parser.parse_args(arguments)
+  report=compare_engines(load_engine(args.candidate), load_engine(args.reference), count=args.count, seed=args.seed)
+  print(report_string(report))
+  return 0 if report["divergence"] is None else 1
+
+if __name__=="__main__":
+  sys.exit(main(sys.argv[1:]))
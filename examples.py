@@ -0,0 +1,43 @@
+"""This file contains example programs, which are used by the demonstrations in tests.py, as workloads by benchmarks.py, and as seeds by differential.py."""
+
+'''INCREMENT_THEORY, REPEAT_INCREMENT_THEORY, REPEAT_INCREMENT_10_TIMES_THEORY, and SUM_THEORY are example theories. INCREMENT_THEORY increments the last integer of each claim, and SUM_THEORY sums the integers of each claim. REPEAT_INCREMENT_THEORY and REPEAT_INCREMENT_10_TIMES_THEORY expect INCREMENT_THEORY and REPEAT_INCREMENT_THEORY to be available as routines 0 and 1.'''
+INCREMENT_THEORY=[
+  (26,-1),
+  (13,1),
+  (14,),
+  (31,-1),
+  (30,),
+  (8,0),
+  (8,0),
+  (8,0)
+]
+
+REPEAT_INCREMENT_THEORY=[
+  (3,),
+  (33,0),
+  (4,)
+]
+
+REPEAT_INCREMENT_10_TIMES_THEORY=[
+  (13,10),
+  (33,1)
+]
+
+SUM_THEORY=[
+  (13,0),
+  (13,1),
+  (2,),
+  (8,0),
+
+  (26,-1),
+  (31,-1),
+  (14,),
+  (8,1),
+  (8,1),
+
+  (24,),
+  (4,),
+  
+  (8,0),
+  (30,)
+]
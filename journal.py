@@ -0,0 +1,267 @@
+"""This file contains functions for journaling a mind: persisting every change to the mind incrementally, so that a long run can be resumed after a crash.
+
+A journal is kept in a directory that contains checkpoints and logs. A checkpoint is a snapshot of the mind, saved with snapshots.save_snapshot, and each checkpoint has a log that records every change made to the mind after the checkpoint was taken. The checkpoint and log with sequence number n are stored in the files "checkpoint-n.snap" and "log-n.bin". To resume a mind, the latest checkpoint is loaded, and then the changes in its log are replayed.
+
+A log is a sequence of frames. Each frame consists of an 8-byte length and a 4-byte CRC-32 checksum, followed by a pickled list of events. If the process crashes while a frame is being written, the incomplete frame will fail its checksum and will be ignored when the log is read. Each event is a tuple whose first element is a string describing the kind of event, as described in minds.add_listener:
+-("claim", claim, record) records that a claim was added
+-("problem", problem) records that a problem was added
+-("add_theory", theory) records that a theory was added with minds.add_theory
+-("delete_routines", routines) records that routines were deleted with minds.delete_routines
+-("inline_and_delete_routines", routines) records that routines were inlined and deleted with minds.inline_and_delete_routines
+-("programs", theories, routines) records that the theories or routines changed in some other way, and holds a copy of all of them
+-("evict", claim_index) records that a claim was evicted
+
+Events are collected into batches, and the batches are written to the log by a background writer thread, so that writing the log does not slow down the code that modifies the mind.
+
+A journal is a dictionary with the following keys:
+-"directory" is the directory containing the journal's files
+-"sequence" is the sequence number of the current checkpoint and log
+-"batch" is the list of events that haven't been handed to the writer thread yet
+-"batch_size" is the number of events in each batch
+-"fsync" is a bool that is True if the log should be flushed to disk after each batch is written
+-"checkpoint_interval" is the number of events after which a new checkpoint is taken automatically, or -1 if checkpoints are only taken when "checkpoint" is called
+-"events_since_checkpoint" is the number of events recorded since the current checkpoint was taken
+-"queue" is the queue used to pass batches to the writer thread
+-"thread" is the writer thread
+-"errors" is a list of exceptions raised in the writer thread
+-"listener" is the listener attached to the mind
+"""
+
+import os
+import pickle
+import queue
+import struct
+import threading
+import zlib
+import minds
+import snapshots
+
+'''FRAME_HEADER is the struct format of the header of each frame in a log: the length of the frame's data, followed by its CRC-32 checksum.'''
+FRAME_HEADER=struct.Struct("<QI")
+
+def checkpoint_path(directory, sequence):
+  """Returns the path of the checkpoint with a given sequence number."""
+  return os.path.join(directory, "checkpoint-"+str(sequence)+".snap")
+
+def log_path(directory, sequence):
+  """Returns the path of the log with a given sequence number."""
+  return os.path.join(directory, "log-"+str(sequence)+".bin")
+
+def get_latest_sequence(directory):
+  """Finds the sequence number of the latest checkpoint in a journal directory.
+
+  Args:
+    directory (str): The journal directory.
+
+  Returns:
+    The largest sequence number of any checkpoint in the directory, or -1 if the directory contains no checkpoints.
+  """
+  latest=-1
+  if os.path.isdir(directory):
+    for name in os.listdir(directory):
+      if name.startswith("checkpoint-") and name.endswith(".snap"):
+        latest=max(latest, int(name[len("checkpoint-"):-len(".snap")]))
+  return latest
+
+def start_journal(mind, directory, batch_size=1000, fsync=True, checkpoint_interval=-1):
+  """Starts journaling a mind. A checkpoint of the mind's current state is taken immediately, and every later change to the mind is recorded in the log. The journal is stored in the mind's extensions, under "journal".
+
+  Args:
+    mind (list): The mind to journal.
+    directory (str): The directory in which to store the journal. It will be created if it doesn't exist. If it already contains a journal, the new checkpoint will be numbered after the latest existing one, which will be deleted once the new one is written.
+    batch_size (int): Defaults to 1000. The number of events to collect before handing them to the writer thread.
+    fsync (bool): Defaults to True. If this is True, the log is flushed to disk with os.fsync after each batch is written, so that a batch survives a crash of the whole machine once it is written. If this is False, it is left to the operating system to decide when to write the log to disk.
+    checkpoint_interval (int): Defaults to -1. If this is not -1, a new checkpoint is taken automatically after this many events have been recorded, so that resuming never has to replay more than this many events.
+
+  Returns:
+    The journal, as a dictionary.
+  """
+  os.makedirs(directory, exist_ok=True)
+  journal={
+    "directory": directory,
+    "sequence": get_latest_sequence(directory),
+    "batch": [],
+    "batch_size": batch_size,
+    "fsync": fsync,
+    "checkpoint_interval": checkpoint_interval,
+    "events_since_checkpoint": 0,
+    "queue": queue.Queue(),
+    "thread": None,
+    "errors": [],
+    "listener": None
+  }
+  mind[6]["journal"]=journal
+  write_checkpoint(mind, journal)
+
+  def listener(mind, event, data):
+    record_event(mind, (event,)+data if event!="problem" and event!="evict" else (event, data))
+  journal["listener"]=listener
+  minds.add_listener(mind, listener)
+  return journal
+
+def start_writer(journal):
+  """Starts a writer thread that appends batches from the journal's queue to the journal's current log. The thread stops when it receives None from the queue."""
+  def write_batches(path, batch_queue, fsync, errors):
+    with open(path, "ab") as f:
+      while True:
+        batch=batch_queue.get()
+        try:
+          if batch is None:
+            break
+          data=pickle.dumps(batch, protocol=pickle.HIGHEST_PROTOCOL)
+          f.write(FRAME_HEADER.pack(len(data), zlib.crc32(data)))
+          f.write(data)
+          f.flush()
+          if fsync:
+            os.fsync(f.fileno())
+        except Exception as e:
+          errors.append(e)
+        finally:
+          batch_queue.task_done()
+  journal["thread"]=threading.Thread(target=write_batches, args=(log_path(journal["directory"], journal["sequence"]), journal["queue"], journal["fsync"], journal["errors"]), daemon=True)
+  journal["thread"].start()
+
+def stop_writer(journal):
+  """Hands any remaining events to the writer thread, waits for the writer thread to write them, and stops it."""
+  if len(journal["batch"])>0:
+    journal["queue"].put(journal["batch"])
+    journal["batch"]=[]
+  journal["queue"].put(None)
+  journal["thread"].join()
+  journal["thread"]=None
+  if len(journal["errors"])>0:
+    raise journal["errors"][0]
+
+def write_checkpoint(mind, journal):
+  """Saves a new checkpoint of the mind, starts a new log for it, and deletes the previous checkpoint and log, which are no longer needed."""
+  if journal["thread"] is not None:
+    stop_writer(journal)
+  old_sequence=journal["sequence"]
+  journal["sequence"]+=1
+  snapshots.save_snapshot(mind, checkpoint_path(journal["directory"], journal["sequence"]))
+  journal["events_since_checkpoint"]=0
+  start_writer(journal)
+  # save_snapshot has synced the new checkpoint and its directory entry to disk, so a crash from here on can't leave the journal without a checkpoint.
+  for path in (checkpoint_path(journal["directory"], old_sequence), log_path(journal["directory"], old_sequence)):
+    if os.path.exists(path):
+      os.remove(path)
+  snapshots.sync_directory(journal["directory"])
+
+def record_event(mind, event):
+  """Records an event in the mind's journal. Events are handed to the writer thread in batches.
+
+  Args:
+    mind (list): The journaled mind.
+    event (tuple): The event to record, in the form described at the top of this file.
+  """
+  journal=mind[6]["journal"]
+  # Programs can be modified in place, so the log gets its own copy of them.
+  if event[0]=="programs":
+    event=(event[0], [program[:] for program in event[1]], [program[:] for program in event[2]])
+  elif event[0]=="add_theory":
+    event=(event[0], event[1][:])
+  journal["batch"].append(event)
+  if len(journal["batch"])>=journal["batch_size"]:
+    journal["queue"].put(journal["batch"])
+    journal["batch"]=[]
+  journal["events_since_checkpoint"]+=1
+  if journal["checkpoint_interval"]!=-1 and journal["events_since_checkpoint"]>=journal["checkpoint_interval"]:
+    write_checkpoint(mind, journal)
+
+def checkpoint(mind):
+  """Takes a new checkpoint of a journaled mind. The new checkpoint replaces the previous checkpoint and log, so resuming from it doesn't need to replay any events.
+
+  Args:
+    mind (list): The journaled mind.
+  """
+  write_checkpoint(mind, mind[6]["journal"])
+
+def flush_journal(mind):
+  """Hands any collected events to the writer thread, and waits until every event recorded so far has been written to the log.
+
+  Args:
+    mind (list): The journaled mind.
+  """
+  journal=mind[6]["journal"]
+  if len(journal["batch"])>0:
+    journal["queue"].put(journal["batch"])
+    journal["batch"]=[]
+  journal["queue"].join()
+  if len(journal["errors"])>0:
+    raise journal["errors"][0]
+
+def stop_journal(mind):
+  """Writes any remaining events to the log, stops the writer thread, and detaches the journal from the mind. The files in the journal directory are kept, so the mind can later be resumed from them.
+
+  Args:
+    mind (list): The journaled mind.
+  """
+  journal=mind[6].pop("journal")
+  minds.remove_listener(mind, journal["listener"])
+  stop_writer(journal)
+
+def read_log(path):
+  """Reads the events from a log. Reading stops at the first incomplete or corrupted frame, which can only be the result of a crash while that frame was being written.
+
+  Args:
+    path (str): The path of the log.
+
+  Returns:
+    A generator that yields each event in the log, in order.
+  """
+  if not os.path.exists(path):
+    return
+  with open(path, "rb") as f:
+    while True:
+      header=f.read(FRAME_HEADER.size)
+      if len(header)<FRAME_HEADER.size:
+        return
+      length, checksum=FRAME_HEADER.unpack(header)
+      data=f.read(length)
+      if len(data)<length or zlib.crc32(data)!=checksum:
+        return
+      for event in pickle.loads(data):
+        yield event
+
+def apply_event(mind, event):
+  """Applies an event from a log to a mind. Claims are added directly, without checking for duplicates or contradictions, because the problems that were found when the claim was first added are recorded as separate events.
+
+  Args:
+    mind (list): The mind to apply the event to.
+    event (tuple): The event to apply, in the form described at the top of this file.
+  """
+  if event[0]=="claim":
+    claim_index=len(mind[2])
+    mind[2].append(event[1])
+    mind[3].append(event[2])
+    mind[4][hash(tuple(event[1][1]))%len(mind[4])].append(claim_index)
+  elif event[0]=="problem":
+    mind[5].append(event[1])
+  elif event[0]=="add_theory":
+    mind[0].append(event[1])
+  elif event[0]=="delete_routines":
+    minds.delete_routines(mind, event[1])
+  elif event[0]=="inline_and_delete_routines":
+    minds.inline_and_delete_routines(mind, event[1])
+  elif event[0]=="programs":
+    mind[0]=event[1]
+    mind[1]=event[2]
+  elif event[0]=="evict":
+    minds.evict_claim(mind, event[1])
+
+def resume_mind(directory):
+  """Rebuilds a mind from a journal directory, by loading the latest checkpoint and replaying its log. The returned mind is not journaled; call start_journal on it to continue journaling.
+
+  Args:
+    directory (str): The journal directory.
+
+  Returns:
+    The rebuilt mind.
+  """
+  sequence=get_latest_sequence(directory)
+  if sequence==-1:
+    raise FileNotFoundError("no checkpoint found in "+directory)
+  mind=snapshots.load_snapshot(checkpoint_path(directory, sequence))
+  for event in read_log(log_path(directory, sequence)):
+    apply_event(mind, event)
+  return mind
@@ -5,6 +5,12 @@ The functions below that start with 'instruction_' are used as the basic  instru
 Most instructions, by default, don't return anything, and instead just modifying "state". Some special instructions like "if" or "for" return a boolean or integer that will be used to control the flow of execution. Certain instructions are only well-defined for a certain type of program state. In the case that an instruction recieves a program state for which it is undefined, it will return -1 to indicate a runtime error.
 """
 
+import bisect
+import io
+import itertools
+import sys
+import time
+
 def instruction_if(state, args):
   """Used to denote that a block will only be executed if a condition passes. Returns False if the top integer is 0, and True otherwise. Undefined when the int-stack is empty."""
   if len(state[0])<1:
@@ -334,6 +340,40 @@ forking_functions=[
   instruction_remove_claim_int
 ]
 
+'''A list of basic instructions that can make the int-stack or the claim-stack deeper. When an execution has a stack depth limit, these are the instructions it is checked after.'''
+stack_growing_functions=[
+  instruction_duplicate_int,
+  instruction_duplicate_claim_set,
+  instruction_push_const,
+  instruction_add,
+  instruction_equal,
+  instruction_less,
+  instruction_negate,
+  instruction_not,
+  instruction_and,
+  instruction_or,
+  instruction_xor,
+  instruction_int_count,
+  instruction_claim_set_count,
+  instruction_claim_int_count,
+  instruction_claim_bool,
+  instruction_claim_int,
+  instruction_new_claim
+]
+
+'''The execution context used for executions that don't need any optional features. See "new_execution_context".'''
+DEFAULT_EXECUTION_CONTEXT=[instruction_functions, None, None, None, None, None]
+
+'''The statuses of an execution, as returned by "run_theory_with_status". FINISHED means every branch ran to completion or failed, STEP_LIMIT means at least one branch was stopped by the execution limit, MEMORY_LIMIT means at least one branch was stopped by the memory limits of the execution, and TIMED_OUT and CANCELLED mean that the whole execution was stopped early because its deadline passed or it was cancelled.'''
+FINISHED="finished"
+STEP_LIMIT="step_limit"
+MEMORY_LIMIT="memory_limit"
+TIMED_OUT="timed_out"
+CANCELLED="cancelled"
+
+'''DEADLINE_CHECK_INTERVAL is the number of steps a branch executes between checks of its execution's deadline and cancellation token. The checks are also made before each branch of a fork is started.'''
+DEADLINE_CHECK_INTERVAL=16
+
 def get_instruction_function_name(instruction_index):
   """Returns the name of a basic instruction. The name returned is equal to the name used in the instructions declaration, but without the "instruction_" prefix.
 
@@ -354,29 +394,36 @@ def program_string(theory):
   Returns:
     A string containing human-readable a description of each instruction in the theory, in order, with a linebreak between each one. "get_instruction_function_name" is used to get the name for each instruction, and each name is followed up with the arguments passed to it. Tabs are included to denote blocks.
   """
-  string=""
-  indentation=0
+  string=io.StringIO()
+  write_program(theory, string)
+  return string.getvalue()
 
-  for i in range(len(theory)):
-    string+=str(i)+".\t"
+def write_program(theory, file=None, start=0, stop=None):
+  """Writes a human-readable display of a theory to a file, in the format of "program_string", one line at a time, so the display is never held in memory as a whole.
+
+  Args:
+    theory (tuple): The program to describe.
+    file: Defaults to None. A text file, or any object with a "write" method, to write to. If this is None, sys.stdout is used.
+    start (int): Defaults to 0. The position of the first instruction to write.
+    stop (int): Defaults to None. The position just after the last instruction to write. If this is None, the instructions up to the end of the theory are written. Instructions keep their positions and indentation when only a range of them is written.
+  """
+  if file is None:
+    file=sys.stdout
+  stop=len(theory) if stop is None else min(stop, len(theory))
+  indentation=0
+  for i in range(stop):
     instruction=theory[i]
     instruction_index=instruction[0]
     instruction_function=instruction_functions[instruction_index]
-    instruction_name=get_instruction_function_name(instruction_index)
 
     if instruction_function==instruction_end or instruction_function==instruction_else:
       indentation-=1
 
-    string+="  "*indentation
-    string+=instruction_name
-    for i2 in range(len(instruction)-1):
-      string+=" "+str(instruction[i2+1])
-    string+="\n"
+    if i>=start:
+      file.write(str(i)+".\t"+"  "*indentation+get_instruction_function_name(instruction_index)+"".join(" "+str(arg) for arg in instruction[1:])+"\n")
 
     if instruction_function==instruction_if or instruction_function==instruction_else or instruction_function==instruction_while or instruction_function==instruction_for:
       indentation+=1
-  
-  return string
 
 def inlined_program_string(theory_index, theories, routines):
   """Inlines a program (replaces each instance of the "exec" instruction with the implementation of the executede theory or routine) and returns the corresponding program string.
@@ -392,7 +439,7 @@ def inlined_program_string(theory_index, theories, routines):
   inlined_theory=inline_execs(theory_index, theories, routines)
   return program_string(inlined_theory)
 
-def inline_execs(theory_index, theories, routines, inline_theories=True):
+def inline_execs(theory_index, theories, routines, inline_theories=True, spans=None):
   """Replaces each instance of the "exec" instruction with teh implementation of the executed theory or routine.
 
   Args:
@@ -400,6 +447,7 @@ def inline_execs(theory_index, theories, routines, inline_theories=True):
     theories (list): The list of theories that can be referenced by a program. This will be used along with "theory_index" to determine which theory to use for inlining.
     routines (list): The list of routines that can be referenced by a program.
     inine_theories (bool): Defaults to True. If this is set to false, this function will only inline routines, and not theories.
+    spans (list): Defaults to None. If this is not None, a list [start, end, routine_index] is appended to it for each routine that is inlined, giving the positions in the returned program between which the routine's implementation was placed. The spans of routines that are inlined within other routines lie inside the spans of those routines.
 
   Returns:
     A version of the program in "theories" at index "theory_index", except that all references to other programs are replaced with their implementations, as they appear in "theories" and "routines"
@@ -412,21 +460,30 @@ def inline_execs(theory_index, theories, routines, inline_theories=True):
     if instruction_functions[theory[index][0]]==instruction_exec:
       exec_index=theory[index][1]
       if exec_index>=0:
-        theory=theory[:index]+routines[exec_index]+theory[index+1:]
+        implementation=routines[exec_index]
       elif inline_theories:
         exec_theory_index=-1-exec_index
-        if theory_index==exec_theory_index:
-          theory=theory[:index]+theory[index+1:]
-        else:
-          theory=theory[:index]+theories[exec_theory_index]+theory[index+1:]
+        implementation=[] if theory_index==exec_theory_index else theories[exec_theory_index]
+      else:
+        index+=1
+        continue
+      theory=theory[:index]+implementation+theory[index+1:]
+      if spans is not None:
+        for span in spans:
+          if span[0]>index:
+            span[0]+=len(implementation)-1
+          if span[1]>index:
+            span[1]+=len(implementation)-1
+        if exec_index>=0:
+          spans.append([index, index+len(implementation), exec_index])
     else:
       index+=1
     if index>=len(theory):
       break
   return theory
 
-def run_theory(theory_index, theories, routines, input_set, execution_limit=100):
-  """Runs a theory on the provided set of claims and returns the resulting claims.
+def run_theory(theory_index, theories, routines, input_set, execution_limit=100, profile=None, deadline=None, cancel_token=None, max_stack_depth=None, max_claim_ints=None):
+  """Runs a theory on the provided set of claims and returns the resulting claims. If the execution is stopped early by a deadline or a cancellation token, the claims produced so far are returned; use "run_theory_with_status" to find out whether this happened.
 
   Args:
     theory_index (int): The index of the theory in "theories" to be executed.
@@ -434,14 +491,107 @@ def run_theory(theory_index, theories, routines, input_set, execution_limit=100)
     routines (list): The list of routines that can be referenced by the executing theory.
     input_set (list): A list of claims that will be fed to the executing theory as input.
     execution_limit (int): Defaults to 100. If execution reaches this number of steps without returning, it will stop.
+    profile (dict): Defaults to None. If this is not None, the execution will be recorded in this profile, as created by "new_profile".
+    deadline (float): Defaults to None. If this is not None, execution stops once time.monotonic() reaches this value.
+    cancel_token: Defaults to None. If this is not None, it must be an object with an "is_set" method, such as a threading.Event, and execution stops once is_set() returns True.
+    max_stack_depth (int): Defaults to None. If this is not None, a branch that would make its int-stack or its claim-stack deeper than this fails, as in "new_execution_context".
+    max_claim_ints (int): Defaults to None. If this is not None, it is the total number of claim integers the execution may allocate, as in "new_execution_context".
 
   Returns:
     The result of the specified theory's execution, in the form of a list of pairs of claims and claim records.
   """
+  return list(iterate_theory(theory_index, theories, routines, input_set, execution_limit, profile=profile, deadline=deadline, cancel_token=cancel_token, max_stack_depth=max_stack_depth, max_claim_ints=max_claim_ints))
+
+def run_theory_with_status(theory_index, theories, routines, input_set, execution_limit=100, max_outputs=-1, profile=None, deadline=None, cancel_token=None, max_stack_depth=None, max_claim_ints=None):
+  """Runs a theory on the provided set of claims, as in "run_theory", and reports how the execution ended.
+
+  Args:
+    theory_index (int): The index of the theory in "theories" to be executed.
+    theories (list): The list of theories that can be referenced by the executing theory. This is also used, along with theory_index, to find the theory which will be executed
+    routines (list): The list of routines that can be referenced by the executing theory.
+    input_set (list): A list of claims that will be fed to the executing theory as input.
+    execution_limit (int): Defaults to 100. If execution reaches this number of steps without returning, it will stop.
+    max_outputs (int): Defaults to -1. If this is not -1, execution stops once this many outputs have been produced.
+    profile (dict): Defaults to None. If this is not None, the execution will be recorded in this profile, as created by "new_profile".
+    deadline (float): Defaults to None. If this is not None, execution stops once time.monotonic() reaches this value.
+    cancel_token: Defaults to None. If this is not None, it must be an object with an "is_set" method, such as a threading.Event, and execution stops once is_set() returns True.
+    max_stack_depth (int): Defaults to None. If this is not None, a branch that would make its int-stack or its claim-stack deeper than this fails, as in "new_execution_context".
+    max_claim_ints (int): Defaults to None. If this is not None, it is the total number of claim integers the execution may allocate, as in "new_execution_context".
+
+  Returns:
+    A tuple (outputs, status)
+      outputs (list): The claims produced before execution ended, in the form returned by "run_theory".
+      status (str): FINISHED, STEP_LIMIT, MEMORY_LIMIT, TIMED_OUT, or CANCELLED.
+  """
+  context=new_execution_context(profile, deadline, cancel_token, True, max_stack_depth, max_claim_ints)
+  outputs=list(iterate_theory(theory_index, theories, routines, input_set, execution_limit, max_outputs, context=context))
+  return (outputs, get_execution_status(context))
+
+def iterate_theory(theory_index, theories, routines, input_set, execution_limit=100, max_outputs=-1, profile=None, deadline=None, cancel_token=None, max_stack_depth=None, max_claim_ints=None, context=None, claim_index=None, superinstructions=None):
+  """Runs a theory on the provided set of claims, yielding each resulting claim as soon as the branch of execution that produced it finishes, rather than collecting them all first. The input set is copied before this function returns, so the caller can safely add the yielded claims to the list that was passed as "input_set" while iterating.
+
+  Args:
+    theory_index (int): The index of the theory in "theories" to be executed.
+    theories (list): The list of theories that can be referenced by the executing theory. This is also used, along with theory_index, to find the theory which will be executed
+    routines (list): The list of routines that can be referenced by the executing theory.
+    input_set (list): A list of claims that will be fed to the executing theory as input.
+    execution_limit (int): Defaults to 100. If execution reaches this number of steps without returning, it will stop.
+    max_outputs (int): Defaults to -1. If this is not -1, execution stops once this many outputs have been yielded, and the remaining branches are never executed.
+    profile (dict): Defaults to None. If this is not None, the execution will be recorded in this profile, as created by "new_profile".
+    deadline (float): Defaults to None. If this is not None, execution stops once time.monotonic() reaches this value.
+    cancel_token: Defaults to None. If this is not None, it must be an object with an "is_set" method, such as a threading.Event, and execution stops once is_set() returns True.
+    max_stack_depth (int): Defaults to None. If this is not None, a branch that would make its int-stack or its claim-stack deeper than this fails, as in "new_execution_context".
+    max_claim_ints (int): Defaults to None. If this is not None, it is the total number of claim integers the execution may allocate, as in "new_execution_context".
+    context (list): Defaults to None. The execution context to use, as created by "new_execution_context". If this is not None, "profile", "deadline", "cancel_token", "max_stack_depth", and "max_claim_ints" are ignored, and the status of the execution can be read from the context with "get_execution_status" once iteration ends.
+    claim_index (dict): Defaults to None. A claim index of "input_set", as created by "new_claim_index", which is used to find the claims that can pass fork guards. Claims that were added to the index after "input_set" was passed in are ignored. If this is None, an index is built the first time one is needed.
+    superinstructions (dict): Defaults to None. If this is not None, it maps the indeces of routines to superinstructions that execute them, as returned by codegen.get_superinstructions, and each inlined copy of those routines is executed by its superinstruction where possible. Superinstructions are not used when the execution is profiled, so that the profile counts every instruction, or when it has memory limits, which are checked for each instruction.
+
+  Returns:
+    An iterator over the result of the specified theory's execution, in the form of pairs of claims and claim records, in the same order as they would be returned by "run_theory".
+  """
+  if context is None:
+    context=new_execution_context(profile, deadline, cancel_token, False, max_stack_depth, max_claim_ints)
+  spans=None if superinstructions is None else []
+  theory=inline_execs(theory_index, theories, routines, spans=spans)
+  context=add_fork_guards(context, get_fork_guards(theory), claim_index)
+  if superinstructions is not None:
+    context=add_superinstructions(context, spans, superinstructions)
+  outputs=iterate_theory_branch(theory, (0, [], [copy_claim_set(input_set)], []), get_control_map(theory), [], execution_limit, 0, context)
+  if max_outputs!=-1:
+    return itertools.islice(outputs, max_outputs)
+  return outputs
+
+def run_theory_batch(theory_index, theories, routines, input_sets, execution_limit=100, profile=None):
+  """Runs a theory on each of several sets of claims. The theory is only inlined and compiled once, so this is cheaper than calling "run_theory" once for each set.
+
+  Args:
+    theory_index (int): The index of the theory in "theories" to be executed.
+    theories (list): The list of theories that can be referenced by the executing theory. This is also used, along with theory_index, to find the theory which will be executed
+    routines (list): The list of routines that can be referenced by the executing theory.
+    input_sets (list): A list of lists of claims. The theory will be executed once with each list of claims as its input.
+    execution_limit (int): Defaults to 100. If an execution reaches this number of steps without returning, it will stop.
+    profile (dict): Defaults to None. If this is not None, the executions will be recorded in this profile, as created by "new_profile".
+
+  Returns:
+    A list containing the result of each execution, in the same order as "input_sets". Each result is in the form returned by "run_theory".
+  """
+  theory=inline_execs(theory_index, theories, routines)
+  control_map=get_control_map(theory)
+  fork_guards=get_fork_guards(theory)
+  context=new_execution_context(profile)
+  return [run_theory_branch(theory, (0, [], [copy_claim_set(input_set)], []), control_map, [], execution_limit, 0, add_fork_guards(context, fork_guards)) for input_set in input_sets]
+
+def get_control_map(theory):
+  """Finds the positions of the control flow instructions (if, else, while, for, and end) in a theory, so that execution can jump between them.
+
+  Args:
+    theory (list): An inlined theory, which must not contain any "exec" instructions.
+
+  Returns:
+    A tuple of two lists of integers. Each integer in the first list describes the start of a block, and the corresponding integer in the second list describes the end of that block.
+  """
   control_map=([],[])
   control_stack=[]
-  
-  theory=inline_execs(theory_index, theories, routines)
 
   for i in range(len(theory)):
     instruction_function=instruction_functions[theory[i][0]]
@@ -450,10 +600,18 @@ def run_theory(theory_index, theories, routines, input_set, execution_limit=100)
       control_map[0].append(control_stack.pop())
     if instruction_function==instruction_if or instruction_function==instruction_else or instruction_function==instruction_while or instruction_function==instruction_for:
       control_stack.append(i)
-  return run_theory_branch(theory, (0, [], [copy_claim_set(input_set)], []), control_map, [], execution_limit, 0)
+  return control_map
 
-def run_theory_branch(theory, state, control_map, touched_inputs, execution_limit, execution_count):
-  """Executes a branch of execution of a theory, and returns the resulting claims. May recursively branch into multiple strands of execution if necessary.
+def run_theory_branch(theory, state, control_map, touched_inputs, execution_limit, execution_count, context=None):
+  """Executes a branch of execution of a theory, and returns the resulting claims. May recursively branch into multiple strands of execution if necessary. This collects the outputs of "iterate_theory_branch" into a list; the arguments are the same.
+
+  Returns:
+    A list of claims produced by this branch. The list will be empty if execution failed for any reason.
+  """
+  return list(iterate_theory_branch(theory, state, control_map, touched_inputs, execution_limit, execution_count, context))
+
+def iterate_theory_branch(theory, state, control_map, touched_inputs, execution_limit, execution_count, context=None):
+  """Executes a branch of execution of a theory, yielding each resulting claim as soon as the strand of execution that produced it finishes. May recursively branch into multiple strands of execution if necessary. Strands are only executed as their outputs are requested, so closing the generator stops the remaining strands.
 
   Args:
     theory (list): The theory to execute.
@@ -464,39 +622,101 @@ def run_theory_branch(theory, state, control_map, touched_inputs, execution_limi
       for_counts (list): A list of integers that is used as a stack to track the current number of iterations left on for loops that execution is currently within.
     control_map (tuple): A tuple of two lists of integers that describe the positions of control flow instructions (if, else, while, for, and end) in the theory being executed. Each integer in the first list describes the start of a block, and the corresponding integer in the second list describes the end of that block. This is used to jump from some instructions to others during execution.
     touched_inputs (list): A list of the indeces of inputs that have been "touched" by this branch so far. An input is considered "touched" when it has been selected from initial set of inputs so that it be directly interacted with by the instructions in the theory.
-    execution_limit (int): If the execution reaches this number of steps without returning, it will stop and return an empty list.
+    execution_limit (int): If the execution reaches this number of steps without returning, it will stop without yielding anything.
     execution_count (int): The number of steps since execution began. Each branch will increment this number each step and pass this value to each of it's child branches, so that they can properly keep track of the number of steps.
+    context (list): Defaults to None. The execution context shared by every branch of the execution, as created by "new_execution_context". If this is None, a default context is used.
   Returns:
-    A list of claims produced by this branch. The list will be empty if execution failed for any reason.
+    A generator that yields pairs of claim records and claims produced by this branch. Nothing will be yielded if execution failed for any reason.
   """
+  if context is None:
+    context=DEFAULT_EXECUTION_CONTEXT
+  handlers=context[0]
+  profile=context[1]
+  limits=context[2]
+  pushdown=context[3]
+  fused=context[4]
+  memory=context[5]
+  # The deadline and cancellation token are checked whenever execution_count reaches step_threshold, so that executions without them pay nothing extra for the checks.
+  step_threshold=execution_limit if limits is None else min(execution_limit, execution_count+DEADLINE_CHECK_INTERVAL)
   while True:
     pointer=state[0]
     if pointer>=len(theory):
-      if not isinstance(state[2][-1],list):
-        return [(touched_inputs,state[2][-1])]
-      return []
+      if profile is not None:
+        profile["branch_depths"][len(touched_inputs)]=profile["branch_depths"].get(len(touched_inputs), 0)+1
+      if len(state[2])>0 and not isinstance(state[2][-1],list):
+        yield (touched_inputs,state[2][-1])
+      return
+    if fused is not None and pointer in fused and execution_count+fused[pointer][1]<execution_limit:
+      # A superinstruction runs a whole inlined routine at once. It returns False without changing the state if the stacks aren't deep enough for it, or if a claim set would be forked over within it, in which case the routine is executed one instruction at a time instead. It is only run if it can't reach the execution limit, so branches are still cut off at the same instruction.
+      fused_output=fused[pointer][0](state[1], state[2])
+      if fused_output==-1:
+        return
+      if fused_output:
+        state=(pointer+fused[pointer][1], state[1], state[2], state[3])
+        execution_count+=fused[pointer][1]
+        if execution_count>=step_threshold:
+          if check_execution_limits(limits):
+            return
+          step_threshold=min(execution_limit, execution_count+DEADLINE_CHECK_INTERVAL)
+        continue
     instruction=theory[pointer]
     instruction_function=instruction_functions[instruction[0]]
 
-    if instruction_function in forking_functions and isinstance(state[2][-1],list):
-      full_output_list=[]
-      for i in range(len(state[2][-1])):
+    if instruction_function in forking_functions and len(state[2])>0 and isinstance(state[2][-1],list):
+      if profile is not None:
+        profile["fork_fanouts"][len(state[2][-1])]=profile["fork_fanouts"].get(len(state[2][-1]), 0)+1
+      # Branches over equal claims only differ in the index they add to touched_inputs, so each distinct claim is only executed once. The outputs of a claim that appears again later in the set are kept, and replayed for each later copy with that copy's index substituted in, which keeps the outputs in the same order as executing every branch would.
+      branch_indeces=range(len(state[2][-1]))
+      if pushdown is not None and pointer in pushdown[0] and execution_count+pushdown[0][pointer][2]-1<execution_limit:
+        # The instructions after the fork are a guard that makes every branch over a claim that fails it end without outputs, so those branches are skipped. This is only done when the guard would finish before the execution limit, so that the status of the execution is the same.
+        branch_indeces=get_guarded_claims(pushdown, pushdown[0][pointer], state[2][-1])
+      keys={i: (state[2][-1][i][0], tuple(state[2][-1][i][1])) for i in branch_indeces}
+      occurrences={}
+      for key in keys.values():
+        occurrences[key]=occurrences.get(key, 0)+1
+      replays={}
+      depth=len(touched_inputs)
+      # Each branch copies the claim sets below the one being forked over, so with a claim integer limit, every branch is charged for their integers.
+      copied_ints=0
+      if memory is not None and memory[1] is not None:
+        for claim_set in state[2][:-1]:
+          copied_ints+=sum(len(claim[1]) for claim in claim_set) if isinstance(claim_set,list) else len(claim_set[1])
+      for i in branch_indeces:
+        if limits is not None and check_execution_limits(limits):
+          return
+        key=keys[i]
+        if key in replays:
+          for output in replays[key]:
+            yield (output[0][:depth]+[i]+output[0][depth+1:], (output[1][0], output[1][1][:]))
+          continue
+        if copied_ints>0 and not charge_claim_ints(limits, memory, copied_ints):
+          return
         lone_claim=state[2][-1][i]
+        # The set being forked over is replaced by a single claim in each branch, so only the sets below it need to be copied.
         claim_sets_copy=[]
-        for claim_set in state[2]:
+        for claim_set in state[2][:-1]:
           if isinstance(claim_set,list):
             claim_sets_copy.append(copy_claim_set(claim_set))
           else:
             claim_sets_copy.append((claim_set[0], claim_set[1][:]))
-        split_state=(pointer, state[1][:], claim_sets_copy[:-1]+[lone_claim], state[3][:])
-        output_list=run_theory_branch(theory, split_state, control_map, touched_inputs[:]+[i], execution_limit, execution_count)
-        full_output_list+=output_list
-      return full_output_list
+        split_state=(pointer, state[1][:], claim_sets_copy+[lone_claim], state[3][:])
+        branch_outputs=iterate_theory_branch(theory, split_state, control_map, touched_inputs[:]+[i], execution_limit, execution_count, context)
+        if occurrences[key]==1:
+          yield from branch_outputs
+        else:
+          replays[key]=[]
+          for output in branch_outputs:
+            replays[key].append((output[0], (output[1][0], output[1][1][:])))
+            yield output
+      return
     
-    instruction_output=instruction_function((state[1],state[2]), instruction[1:])
+    instruction_output=handlers[instruction[0]]((state[1],state[2]), instruction[1:])
 
     if instruction_output==-1:
-      return []
+      if profile is not None:
+        profile["error_exits"][instruction[0]]+=1
+        profile["branch_depths"][len(touched_inputs)]=profile["branch_depths"].get(len(touched_inputs), 0)+1
+      return
     
     new_pointer=state[0]
     if instruction_function==instruction_if or instruction_function==instruction_while:
@@ -532,8 +752,357 @@ def run_theory_branch(theory, state, control_map, touched_inputs, execution_limi
     state=(new_pointer, state[1], state[2], state[3])
     
     execution_count+=1
-    if execution_count>=execution_limit:
-      return []
+    if execution_count>=step_threshold:
+      if execution_count>=execution_limit:
+        if profile is not None:
+          profile["limit_cutoffs"]+=1
+          profile["branch_depths"][len(touched_inputs)]=profile["branch_depths"].get(len(touched_inputs), 0)+1
+        if limits is not None and limits[2]==FINISHED:
+          limits[2]=STEP_LIMIT
+        return
+      if check_execution_limits(limits):
+        return
+      step_threshold=min(execution_limit, execution_count+DEADLINE_CHECK_INTERVAL)
+
+def new_execution_context(profile=None, deadline=None, cancel_token=None, track_status=False, max_stack_depth=None, max_claim_ints=None):
+  """Creates an execution context, which holds the optional settings and results of one execution of a theory, and is shared by all of the execution's branches. An execution context is a list of the form [handlers, profile, limits, pushdown, fused, memory]
+  -handlers is the list of functions used to execute each basic instruction, in the same order as "instruction_functions".
+  -profile is None, or the profile that the execution is recorded in.
+  -limits is None, or a list of the form [deadline, cancel_token, status], where "status" is the status of the execution so far.
+  -pushdown is None, or a list of the form [fork_guards, claim_index], which is added by "add_fork_guards".
+  -fused is None, or a dictionary mapping positions in the theory to superinstructions, which is added by "add_superinstructions".
+  -memory is None, or a list of the form [max_stack_depth, max_claim_ints, claim_ints], where "claim_ints" is the number of claim integers the execution has allocated so far.
+
+  Args:
+    profile (dict): Defaults to None. If this is not None, the execution will be recorded in this profile, as created by "new_profile".
+    deadline (float): Defaults to None. If this is not None, execution stops once time.monotonic() reaches this value.
+    cancel_token: Defaults to None. If this is not None, it must be an object with an "is_set" method, such as a threading.Event, and execution stops once is_set() returns True.
+    track_status (bool): Defaults to False. If this is True, the context records the status of the execution even if it has no deadline or cancellation token.
+    max_stack_depth (int): Defaults to None. If this is not None, a branch that would make its int-stack or its claim-stack deeper than this fails, and the status of the execution becomes MEMORY_LIMIT.
+    max_claim_ints (int): Defaults to None. If this is not None, it is the total number of integers that the execution's claims may allocate, counted across all of its branches. This counts the integers pushed to claims, and the integers copied by duplicating a claim set or by forking, but not the integers of the input set. A branch that would exceed it fails, and the status of the execution becomes MEMORY_LIMIT.
+
+  Returns:
+    The new execution context.
+  """
+  limits=None
+  memory=None
+  if max_stack_depth is not None or max_claim_ints is not None:
+    memory=[max_stack_depth, max_claim_ints, 0]
+  if deadline is not None or cancel_token is not None or track_status or memory is not None:
+    limits=[deadline, cancel_token, FINISHED]
+  if profile is None and limits is None:
+    return DEFAULT_EXECUTION_CONTEXT
+  handlers=get_profiled_handlers(profile) if profile is not None else instruction_functions
+  if memory is not None:
+    handlers=get_memory_limited_handlers(handlers, limits, memory)
+  return [handlers, profile, limits, None, None, memory]
+
+def get_fork_guards(theory):
+  """Finds the fork guards in a theory. A fork guard is a short sequence of instructions, starting with a forking instruction, which ends every branch over a claim that fails a simple test on the claim without producing any outputs. The recognized guards are:
+  -claim_bool, assert: the claim's boolean is True
+  -claim_bool, not, assert: the claim's boolean is False
+  -claim_int_count, push_const k, equal, assert: the claim has k integers
+  -claim_int i, push_const k, equal, assert: the claim's integer at index i is k
+  Tests that branch with "if" instead of "assert" are not guards, because the branches over claims that fail the test still continue after the block.
+
+  Args:
+    theory (list): An inlined theory.
+
+  Returns:
+    A dictionary mapping the position of the forking instruction of each guard to a tuple (kind, value, steps). "kind" is "bool", "length", or "int", "value" is the boolean, the number of integers, or a tuple (index, integer) that the claim must have, and "steps" is the number of instructions in the guard.
+  """
+  opcodes=[instruction_functions[instruction[0]] for instruction in theory]+[None, None, None]
+  fork_guards={}
+  for i in range(len(theory)):
+    if opcodes[i]==instruction_claim_bool:
+      if opcodes[i+1]==instruction_assert:
+        fork_guards[i]=("bool", True, 2)
+      elif opcodes[i+1]==instruction_not and opcodes[i+2]==instruction_assert:
+        fork_guards[i]=("bool", False, 3)
+    elif (opcodes[i]==instruction_claim_int_count or opcodes[i]==instruction_claim_int) and opcodes[i+1]==instruction_push_const and opcodes[i+2]==instruction_equal and opcodes[i+3]==instruction_assert:
+      if opcodes[i]==instruction_claim_int_count:
+        fork_guards[i]=("length", theory[i+1][1], 4)
+      else:
+        fork_guards[i]=("int", (theory[i][1], theory[i+1][1]), 4)
+  return fork_guards
+
+def add_fork_guards(context, fork_guards, claim_index=None):
+  """Returns an execution context that skips the branches of forks that can't pass the given fork guards. Every claim set that a theory forks over is a copy of its input set, so a single claim index of the input set can be used at every fork.
+
+  Args:
+    context (list): The execution context to extend. It is not modified.
+    fork_guards (dict): The fork guards of the theory being executed, as returned by "get_fork_guards".
+    claim_index (dict): Defaults to None. A claim index of the input set, as created by "new_claim_index". If this is None, an index is built the first time one is needed.
+
+  Returns:
+    The new execution context, or "context" itself if there are no fork guards.
+  """
+  if len(fork_guards)==0:
+    return context
+  return context[:3]+[[fork_guards, claim_index]]+context[4:]
+
+def add_superinstructions(context, spans, superinstructions):
+  """Returns an execution context that executes inlined routines with superinstructions. Where the spans of routines are nested, the outermost routine that has a superinstruction is used.
+
+  Args:
+    context (list): The execution context to extend. It is not modified.
+    spans (list): The spans of the routines in the theory being executed, as found by "inline_execs".
+    superinstructions (dict): Maps the indeces of routines to superinstructions, as returned by codegen.get_superinstructions. A superinstruction is a tuple (function, length), where "function" takes the int-stack and the claim-stack, and "length" is the number of instructions it executes.
+
+  Returns:
+    The new execution context, or "context" itself if no superinstructions apply, or the execution is profiled or has memory limits.
+  """
+  if context[1] is not None or context[5] is not None:
+    return context
+  fused={}
+  end=0
+  for span in sorted(spans, key=lambda span: (span[0], -span[1])):
+    if span[0]>=end and span[2] in superinstructions and superinstructions[span[2]][1]==span[1]-span[0]:
+      fused[span[0]]=superinstructions[span[2]]
+      end=span[1]
+  if len(fused)==0:
+    return context
+  return context[:4]+[fused]+context[5:]
+
+def new_claim_index(claims=[]):
+  """Creates a claim index, which maps properties of claims to the indeces of the claims that have them, in increasing order. A claim index is a dictionary with the following keys:
+  -"bool" maps True and False to the claims with that boolean
+  -"length" maps each number of integers to the claims with that many integers
+  -"first_int" maps each integer to the claims whose first integer is that integer
+
+  Args:
+    claims (list): Defaults to an empty list. The claims to index. Claims that are None, which are the tombstones of evicted claims in a mind, are skipped.
+
+  Returns:
+    The new claim index.
+  """
+  claim_index={"bool": {True: [], False: []}, "length": {}, "first_int": {}}
+  for i in range(len(claims)):
+    if claims[i] is not None:
+      add_to_claim_index(claim_index, claims[i], i)
+  return claim_index
+
+def add_to_claim_index(claim_index, claim, i):
+  """Adds a claim to a claim index. Claims must be added in order of increasing index.
+
+  Args:
+    claim_index (dict): The claim index.
+    claim (tuple): The claim.
+    i (int): The index of the claim.
+  """
+  claim_index["bool"][True if claim[0] else False].append(i)
+  claim_index["length"].setdefault(len(claim[1]), []).append(i)
+  if len(claim[1])>0:
+    claim_index["first_int"].setdefault(claim[1][0], []).append(i)
+
+def get_guarded_claims(pushdown, fork_guard, claims):
+  """Finds the claims in a claim set that can pass a fork guard.
+
+  Args:
+    pushdown (list): The pushdown of the execution context, as described in "new_execution_context". Its claim index is built from "claims" if it doesn't have one yet.
+    fork_guard (tuple): The fork guard, as returned by "get_fork_guards".
+    claims (list): The claim set being forked over, which is a copy of the input set.
+
+  Returns:
+    A list of the indeces of the claims that can pass the guard, in increasing order.
+  """
+  kind, value, steps=fork_guard
+  if kind=="int" and value[0]!=0:
+    index=value[0]
+    return [i for i in range(len(claims)) if -len(claims[i][1])<=index<len(claims[i][1]) and claims[i][1][index]==value[1]]
+  if pushdown[1] is None:
+    pushdown[1]=new_claim_index(claims)
+  if kind=="bool":
+    candidates=pushdown[1]["bool"][value]
+  elif kind=="length":
+    candidates=pushdown[1]["length"].get(value, [])
+  else:
+    candidates=pushdown[1]["first_int"].get(value[1], [])
+  # The index may have grown since the input set was copied, so claims past the end of the set are left out.
+  return candidates[:bisect.bisect_left(candidates, len(claims))]
+
+def check_execution_limits(limits):
+  """Checks whether an execution should stop early because its deadline has passed or it has been cancelled, and records the reason in its status.
+
+  Args:
+    limits (list): The limits of an execution context, as described in "new_execution_context".
+
+  Returns:
+    True if the execution should stop, and False otherwise.
+  """
+  if limits[2]==TIMED_OUT or limits[2]==CANCELLED:
+    return True
+  if limits[1] is not None and limits[1].is_set():
+    limits[2]=CANCELLED
+    return True
+  if limits[0] is not None and time.monotonic()>=limits[0]:
+    limits[2]=TIMED_OUT
+    return True
+  return False
+
+def get_execution_status(context):
+  """Returns the status of an execution: FINISHED, STEP_LIMIT, MEMORY_LIMIT, TIMED_OUT, or CANCELLED. The context must have been created with a deadline, a cancellation token, memory limits, or "track_status" set to True.
+
+  Args:
+    context (list): The execution context of the execution.
+
+  Returns:
+    The status, as a string.
+  """
+  return context[2][2]
+
+def new_profile():
+  """Creates an empty profile. A profile records what happens while theories are executed, and can be shared by any number of executions, so that it describes a whole run of a mind. Profiling has no cost for executions that aren't given a profile.
+
+  A profile is a dictionary with the following keys:
+  -"opcode_counts" is a list containing the number of times each basic instruction was executed, in the same order as "instruction_functions".
+  -"opcode_seconds" is a list containing the total time, in seconds, spent executing each basic instruction.
+  -"error_exits" is a list containing the number of branches that ended because each basic instruction was undefined for the program state (returned -1).
+  -"fork_fanouts" is a dictionary that maps each number of branches that a fork was split into to the number of forks that were split into that many branches.
+  -"branch_depths" is a dictionary that maps each branch depth (the number of forks that led to a branch) to the number of branches with that depth that ended, whether they finished, failed, or were cut off.
+  -"limit_cutoffs" is the number of branches that were stopped because they reached the execution limit.
+
+  Returns:
+    The new profile.
+  """
+  return {
+    "opcode_counts": [0 for f in instruction_functions],
+    "opcode_seconds": [0.0 for f in instruction_functions],
+    "error_exits": [0 for f in instruction_functions],
+    "fork_fanouts": {},
+    "branch_depths": {},
+    "limit_cutoffs": 0
+  }
+
+def get_profiled_handlers(profile):
+  """Creates a list of instruction handlers that each execute a basic instruction, while recording the number of times it was executed and the time it took in a profile.
+
+  Args:
+    profile (dict): The profile to record executions in.
+
+  Returns:
+    A list of functions, in the same order as "instruction_functions".
+  """
+  counts=profile["opcode_counts"]
+  seconds=profile["opcode_seconds"]
+  def profiled_handler(opcode):
+    instruction_function=instruction_functions[opcode]
+    def handler(state, args):
+      start=time.perf_counter()
+      output=instruction_function(state, args)
+      seconds[opcode]+=time.perf_counter()-start
+      counts[opcode]+=1
+      return output
+    return handler
+  return [profiled_handler(opcode) for opcode in range(len(instruction_functions))]
+
+def charge_claim_ints(limits, memory, count):
+  """Counts newly allocated claim integers against the memory limits of an execution, and records MEMORY_LIMIT as its status if they exceed them.
+
+  Args:
+    limits (list): The limits of an execution context, as described in "new_execution_context".
+    memory (list): The memory limits of the same execution context.
+    count (int): The number of claim integers being allocated.
+
+  Returns:
+    True if the integers can be allocated, and False if the branch allocating them should fail.
+  """
+  memory[2]+=count
+  if memory[1] is not None and memory[2]>memory[1]:
+    exceed_memory_limit(limits)
+    return False
+  return True
+
+def exceed_memory_limit(limits):
+  """Records that a branch of an execution was stopped by its memory limits. This replaces the statuses FINISHED and STEP_LIMIT, but not TIMED_OUT or CANCELLED, which stop the whole execution."""
+  if limits[2]==FINISHED or limits[2]==STEP_LIMIT:
+    limits[2]=MEMORY_LIMIT
+
+def get_memory_limited_handlers(handlers, limits, memory):
+  """Creates a list of instruction handlers that each execute a basic instruction with another handler, after checking that the instruction won't exceed the memory limits of an execution. An instruction that would make a stack deeper than the stack depth limit, or allocate more claim integers than the execution has left, fails without being executed, so the memory it would have used is never allocated.
+
+  Args:
+    handlers (list): The handlers to execute each instruction with once it has been checked, in the same order as "instruction_functions".
+    limits (list): The limits of an execution context, as described in "new_execution_context".
+    memory (list): The memory limits of the same execution context.
+
+  Returns:
+    A list of functions, in the same order as "instruction_functions".
+  """
+  max_stack_depth=memory[0]
+  def limited_handler(opcode):
+    instruction_function=instruction_functions[opcode]
+    handler=handlers[opcode]
+    if instruction_function==instruction_duplicate_claim_set:
+      def duplicate_handler(state, args):
+        if max_stack_depth is not None and len(state[1])>=max_stack_depth:
+          exceed_memory_limit(limits)
+          return -1
+        if args[0]<len(state[1]) and isinstance(state[1][-(1+args[0])], list):
+          if not charge_claim_ints(limits, memory, sum(len(claim[1]) for claim in state[1][-(1+args[0])])):
+            return -1
+        return handler(state, args)
+      return duplicate_handler
+    if instruction_function==instruction_push_claim_int:
+      def push_handler(state, args):
+        if len(state[0])>=1 and len(state[1])>=1 and not charge_claim_ints(limits, memory, 1):
+          return -1
+        return handler(state, args)
+      return push_handler
+    if instruction_function in stack_growing_functions and max_stack_depth is not None:
+      stack=1 if instruction_function==instruction_new_claim else 0
+      def depth_handler(state, args):
+        if len(state[stack])>=max_stack_depth:
+          exceed_memory_limit(limits)
+          return -1
+        return handler(state, args)
+      return depth_handler
+    return handler
+  return [limited_handler(opcode) for opcode in range(len(instruction_functions))]
+
+def merge_profiles(profile, other_profile):
+  """Adds the records in one profile to another, for example to combine the profiles of several worker processes.
+
+  Args:
+    profile (dict): The profile to add records to.
+    other_profile (dict): The profile whose records will be added. It is not modified.
+  """
+  for key in ["opcode_counts", "opcode_seconds", "error_exits"]:
+    for i in range(len(instruction_functions)):
+      profile[key][i]+=other_profile[key][i]
+  for key in ["fork_fanouts", "branch_depths"]:
+    for value, count in other_profile[key].items():
+      profile[key][value]=profile[key].get(value, 0)+count
+  profile["limit_cutoffs"]+=other_profile["limit_cutoffs"]
+
+def profile_string(profile):
+  """Returns a human-readable description of a profile.
+
+  Args:
+    profile (dict): The profile to describe.
+
+  Returns:
+    A string with one line for each basic instruction that was executed, in order of decreasing total time, followed by the fork fan-out and branch depth histograms, and the number of branches that were cut off by the execution limit.
+  """
+  string="INSTRUCTIONS:\n"
+  opcodes=sorted(range(len(instruction_functions)), key=lambda opcode: -profile["opcode_seconds"][opcode])
+  for opcode in opcodes:
+    count=profile["opcode_counts"][opcode]
+    if count==0 and profile["error_exits"][opcode]==0:
+      continue
+    seconds=profile["opcode_seconds"][opcode]
+    string+=get_instruction_function_name(opcode)+":\tcount "+str(count)+"\ttime "+format(seconds, ".6f")+"s"
+    if count>0:
+      string+="\tmean "+format(seconds/count*1e6, ".3f")+"us"
+    string+="\terror exits "+str(profile["error_exits"][opcode])+"\n"
+  string+="\nFORK FAN-OUTS:\n"
+  for fanout in sorted(profile["fork_fanouts"]):
+    string+=str(fanout)+":\t"+str(profile["fork_fanouts"][fanout])+"\n"
+  string+="\nBRANCH DEPTHS:\n"
+  for depth in sorted(profile["branch_depths"]):
+    string+=str(depth)+":\t"+str(profile["branch_depths"][depth])+"\n"
+  string+="\nEXECUTION LIMIT CUTOFFS: "+str(profile["limit_cutoffs"])+"\n"
+  return string
 
 def copy_claim_set(claims):
   """Returns a set copy of a set of claims.
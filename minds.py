@@ -1,18 +1,34 @@
 """This file contains functions relating to minds. The primary elements of a mind are theories, claims, and problems, but minds also contain some supplementary elements.
 
-A mind is a list of length 6, [theories, routines, claims, claim_records, claim_hash_table, problems]
+A mind is a list of length 7, [theories, routines, claims, claim_records, claim_hash_table, problems, extensions]
 -theories is a list of theories
 -routine is a list of routines
 -claims is a list of claims
 -claim_records is a list of claim records
 -claim_hash_table is a list of lists of ints, which is used as a hashtable for quickly searching for claims with identical lists.
 -problems is a list of problems
+-extensions is a dictionary of optional supplementary structures that are attached to the mind, such as the "listeners" list used by add_listener. Extensions are not part of the mind's content, so they are not saved in snapshots.
 """
 
+import array
+import bisect
+import heapq
+import io
+import itertools
+import json
+import os
+import sys
+import time
+import numpy
 import language
+import codegen
 import extract
 import conjecture
-from numpy.random import random
+from numpy.random import random, choice
+
+'''DURATION_BUCKETS and SIZE_BUCKETS are the default upper bounds of the buckets of histograms in a metrics registry, for histograms of durations in seconds and of sizes, respectively.'''
+DURATION_BUCKETS=[0.0001, 0.001, 0.01, 0.1, 1.0, 10.0, 100.0]
+SIZE_BUCKETS=[0, 1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024]
 
 def new_mind(theories=[], routines=[], claims=[],hash_table_size=1000):
   """Creates a new mind, which is empty by default, but can optionally be started with a set of theories, routines, or claims.
@@ -27,15 +43,16 @@ def new_mind(theories=[], routines=[], claims=[],hash_table_size=1000):
     The new mind, as a list.
   """
   return[
-    theories,
-    routines,
-    claims,
+    list(theories),
+    list(routines),
+    list(claims),
     [(-1,[]) for claim in claims],
     [[] for i in range(hash_table_size)],
-    []
+    [],
+    {}
   ]
 
-def mind_string(mind, show_theories=True, show_routines=True, show_claims=True, show_problems=True):
+def mind_string(mind, show_theories=True, show_routines=True, show_claims=True, show_problems=True, **options):
   """Creates a human-readable string that describes a mind. Takes several flags to customize what information is shown.
 
   Args:
@@ -44,41 +61,299 @@ def mind_string(mind, show_theories=True, show_routines=True, show_claims=True,
     show_routines (bool): Defaults to True. If this is True, the string will contain a description of all the routines in the mind.
     show_claims (bool): Defaults to True.  If this is True, the string will contain a description of all the claims in the mind.
     show_problems (bool): Defaults to True.  If this is True, the string will contain a description of all the problems in the mind.
+    **options: Passed to write_mind, to choose which theories, routines, claims, and problems are shown.
 
   Returns:
+    The string, in the format written by write_mind. For large minds, write_mind should be used instead, since it doesn't hold the whole description in memory.
+  """
+  string=io.StringIO()
+  write_mind(mind, string, show_theories, show_routines, show_claims, show_problems, **options)
+  return string.getvalue()
+
+def get_section_range(length, index_range):
+  """Finds the indeces of a list of the given length that lie within a range given to write_mind.
+
+  Args:
+    length (int): The length of the list.
+    index_range (tuple): A tuple (start, stop) whose elements may be negative or None, as in a slice, or None for the whole list.
+
+  Returns:
+    A range of indeces into the list.
+  """
+  if index_range is None:
+    return range(length)
+  return range(*slice(*index_range).indices(length))
+
+def write_mind(mind, file=None, show_theories=True, show_routines=True, show_claims=True, show_problems=True, theory_range=None, routine_range=None, claim_range=None, problem_range=None, claim_filter=None, problem_filter=None, limit=-1, max_trace_depth=-1):
+  """Writes a human-readable description of a mind to a file, in the format of mind_string. Each theory, routine, claim, and problem is written as soon as it is described, so the memory used doesn't depend on the size of the mind.
+
+  Example:
+    # Writes the claims produced by theory 3, and the last 100 problems.
+    minds.write_mind(mind, show_theories=False, show_routines=False, claim_filter=lambda i, claim, record: record[0]==3, problem_range=(-100, None))
+
+  Args:
+    mind (list): The mind to describe.
+    file: Defaults to None. A text file, or any object with a "write" method, to write to. If this is None, sys.stdout is used.
+    show_theories (bool): Defaults to True. If this is True, theories are written.
+    show_routines (bool): Defaults to True. If this is True, routines are written.
+    show_claims (bool): Defaults to True. If this is True, claims are written, along with their records.
+    show_problems (bool): Defaults to True. If this is True, problems are written.
+    theory_range (tuple): Defaults to None. A tuple (start, stop) that selects the theories to write, with the same meaning as a slice, so negative positions count from the end and None stands for the start or the end of the list. If this is None, every theory is written.
+    routine_range (tuple): Defaults to None. Selects the routines to write, as "theory_range" does for theories.
+    claim_range (tuple): Defaults to None. Selects the claims to write, as "theory_range" does for theories.
+    problem_range (tuple): Defaults to None. Selects the problems to write, as "theory_range" does for theories.
+    claim_filter (function): Defaults to None. If this is not None, only the claims for which claim_filter(index, claim, record) returns True are written.
+    problem_filter (function): Defaults to None. If this is not None, only the problems for which problem_filter(index, problem) returns True are written.
+    limit (int): Defaults to -1. If this is not -1, at most this many theories, routines, claims, and problems are written in each section.
+    max_trace_depth (int): Defaults to -1. If this is not -1, the parts of problem traces deeper than this are abbreviated, as in write_trace.
   """
-  string=""
+  if file is None:
+    file=sys.stdout
   if show_theories:
-    string+="THEORIES:\n"
-    for i in range(len(mind[0])):
-      string+=str(i)+":\n"+language.program_string(mind[0][i])+"\n"
+    file.write("THEORIES:\n")
+    for i in itertools.islice(get_section_range(len(mind[0]), theory_range), None if limit==-1 else limit):
+      file.write(str(i)+":\n")
+      language.write_program(mind[0][i], file)
+      file.write("\n")
   if show_routines:
-    string+="\nROUTINES:\n"
-    for i in range(len(mind[1])):
-      string+=str(i)+":\n"+language.program_string(mind[1][i])+"\n"
+    file.write("\nROUTINES:\n")
+    for i in itertools.islice(get_section_range(len(mind[1]), routine_range), None if limit==-1 else limit):
+      file.write(str(i)+":\n")
+      language.write_program(mind[1][i], file)
+      file.write("\n")
   if show_claims:
-    string+="\nCLAIMS:\n"
-    for i in range(len(mind[2])):
-      string+=str(i)+":\n"+str(mind[2][i])+"\nfrom:"+str(mind[3][i])+"\n\n"
+    file.write("\nCLAIMS:\n")
+    claim_indeces=get_section_range(len(mind[2]), claim_range)
+    if claim_filter is not None:
+      claim_indeces=(i for i in claim_indeces if claim_filter(i, mind[2][i], mind[3][i]))
+    for i in itertools.islice(claim_indeces, None if limit==-1 else limit):
+      file.write(str(i)+":\n"+str(mind[2][i])+"\nfrom:"+str(mind[3][i])+"\n\n")
   if show_problems:
-    string+="\nPROBLEMS:\n"
-    for i in range(len(mind[5])):
-      string+=str(i)+":\n"+str(mind[5][i])+"\n\n"
+    file.write("\nPROBLEMS:\n")
+    problem_indeces=get_section_range(len(mind[5]), problem_range)
+    if problem_filter is not None:
+      problem_indeces=(i for i in problem_indeces if problem_filter(i, mind[5][i]))
+    for i in itertools.islice(problem_indeces, None if limit==-1 else limit):
+      file.write(str(i)+":\n")
+      write_trace(mind[5][i], file, max_trace_depth+1 if max_trace_depth!=-1 else -1)
+      file.write("\n\n")
+
+def write_trace(trace, file=None, max_depth=-1):
+  """Writes a claim trace, or a problem, to a file in the same format as str(trace), without building the string in memory and without recursion, so arbitrarily deep traces can be written.
 
-  return string
+  Args:
+    trace: A claim trace, as returned by get_claim_trace, or a problem, which is a tuple of two claim traces.
+    file: Defaults to None. A text file, or any object with a "write" method, to write to. If this is None, sys.stdout is used.
+    max_depth (int): Defaults to -1. If this is not -1, each tuple nested more than this many levels deep is written as "(...)".
+  """
+  if file is None:
+    file=sys.stdout
+  # Each entry is [subtrace, depth, position], where "position" is the index of the next element of the subtrace to write, or -1 if the subtrace hasn't been started.
+  stack=[[trace, 0, -1]]
+  while len(stack)>0:
+    entry=stack[-1]
+    subtrace=entry[0]
+    if not isinstance(subtrace, tuple):
+      file.write(repr(subtrace))
+      stack.pop()
+    elif entry[2]==-1:
+      if max_depth!=-1 and entry[1]>max_depth:
+        file.write("(...)")
+        stack.pop()
+      else:
+        file.write("(")
+        entry[2]=0
+    elif entry[2]==len(subtrace):
+      file.write(",)" if len(subtrace)==1 else ")")
+      stack.pop()
+    else:
+      if entry[2]>0:
+        file.write(", ")
+      entry[2]+=1
+      stack.append([subtrace[entry[2]-1], entry[1]+1, -1])
 
-def generate_claims(mind):
+'''RECENT_HALF_LIFE is the number of claims after which the chance of a claim being sampled by the "recent" sampling method halves, as a multiple of the batch size.'''
+RECENT_HALF_LIFE=4
+
+def sample_uniform(mind, indeces, batch_size):
+  """The "uniform" sampling method, which samples claims uniformly without replacement.
+
+  Args:
+    mind (list): The mind.
+    indeces (list): The indeces of the claims to sample from, in increasing order.
+    batch_size (int): The number of claims to sample, which is less than len(indeces).
+
+  Returns:
+    A list of the indeces of the sampled claims, in increasing order.
+  """
+  return sorted(indeces[i] for i in choice(len(indeces), batch_size, replace=False))
+
+def sample_reservoir(mind, indeces, batch_size):
+  """The "reservoir" sampling method, which samples claims uniformly without replacement in a single pass over the claims, using reservoir sampling. Takes the same arguments, and returns the same result, as sample_uniform."""
+  reservoir=list(indeces[:batch_size])
+  for i in range(batch_size, len(indeces)):
+    slot=int(random()*(i+1))
+    if slot<batch_size:
+      reservoir[slot]=indeces[i]
+  return sorted(reservoir)
+
+def sample_recent(mind, indeces, batch_size):
+  """The "recent" sampling method, which samples claims without replacement, weighted toward the claims added most recently. The weight of a claim halves for every RECENT_HALF_LIFE*batch_size claims added after it. Takes the same arguments, and returns the same result, as sample_uniform."""
+  ages=len(indeces)-1-numpy.arange(len(indeces))
+  weights=numpy.exp2(-ages/(RECENT_HALF_LIFE*batch_size))
+  return sorted(indeces[i] for i in choice(len(indeces), batch_size, replace=False, p=weights/weights.sum()))
+
+def sample_stratified(mind, indeces, batch_size):
+  """The "stratified" sampling method, which groups the claims by the theory that produced them, with the claims that weren't produced by a theory in a group of their own, and samples the same number of claims uniformly from each group, so that claims from rarely used theories are as well represented as any others. Groups that are too small are taken whole, and their unused share is divided among the other groups. Takes the same arguments, and returns the same result, as sample_uniform."""
+  strata={}
+  for i in indeces:
+    strata.setdefault(mind[3][i][0], []).append(i)
+  sample=[]
+  remaining=batch_size
+  strata_left=sorted(strata.values(), key=len)
+  while len(strata_left)>0:
+    stratum=strata_left.pop(0)
+    share=remaining//(len(strata_left)+1)
+    if len(stratum)<=share:
+      sample+=stratum
+      remaining-=len(stratum)
+    else:
+      # The groups are sorted by size, so the rest of the batch is shared among the remaining groups, which are all bigger than their share.
+      strata_left.insert(0, stratum)
+      extra=remaining-share*len(strata_left)
+      for j in range(len(strata_left)):
+        sample+=sample_uniform(mind, strata_left[j], share+(1 if j<extra else 0))
+      break
+  return sorted(sample)
+
+'''SAMPLING_METHODS maps the name of each method of sampling claims for a minibatch to its function.'''
+SAMPLING_METHODS={
+  "uniform": sample_uniform,
+  "reservoir": sample_reservoir,
+  "recent": sample_recent,
+  "stratified": sample_stratified
+}
+
+def get_input_set(mind, batch_size=-1, sampling="uniform"):
+  """Chooses the claims to use as the input set of a theory in generate_claims: the claims that haven't been evicted, or a sample of them.
+
+  Args:
+    mind (list): The mind.
+    batch_size (int): Defaults to -1. If this is not -1, and the mind has more claims than this that haven't been evicted, a sample of this many claims is used.
+    sampling: Defaults to "uniform". The name of one of the SAMPLING_METHODS, or a function with the same form as them, used to choose the sample.
+
+  Returns:
+    A tuple (claims, input_indeces). If all of the mind's claims are used, "claims" is mind[2] itself and "input_indeces" is None. Otherwise, "claims" is a new list of claims, and input_indeces[i] is the index in the mind of claims[i], so the touched inputs of outputs produced from "claims" can be mapped back to the mind's claims.
+  """
+  claims, live_indeces=get_live_claims(mind)
+  if batch_size==-1 or len(claims)<=batch_size:
+    return (claims, live_indeces)
+  sampling_function=SAMPLING_METHODS[sampling] if isinstance(sampling, str) else sampling
+  input_indeces=sampling_function(mind, live_indeces if live_indeces is not None else range(len(claims)), batch_size)
+  return ([mind[2][i] for i in input_indeces], input_indeces)
+
+def generate_claims(mind, max_outputs=-1, deadline=None, cancel_token=None, batch_size=-1, sampling="uniform", max_stack_depth=None, max_claim_ints=None):
   """Randomly chooses a theory from the mind, and then use it with the population of claims in the mind to generate new claims.
 
   Args:
-    mind (list): The mind to use to generate claims. A theory will be randomly chosen from the minds list of theories, and then executed with all of the claims in the mind as the input set. The resulting claims will then be added to the mind's list of claims.
+    mind (list): The mind to use to generate claims. A theory will be randomly chosen from the minds list of theories, and then executed with all of the claims in the mind as the input set. The resulting claims will then be added to the mind's list of claims as they are produced.
+    max_outputs (int): Defaults to -1. If this is not -1, execution of the theory stops once this many claims have been produced.
+    deadline (float): Defaults to None. If this is not None, execution of the theory stops once time.monotonic() reaches this value. The claims produced before then are still added.
+    cancel_token: Defaults to None. If this is not None, it must be an object with an "is_set" method, such as a threading.Event, and execution of the theory stops once is_set() returns True.
+    batch_size (int): Defaults to -1. If this is not -1, the theory is executed on a minibatch of at most this many claims, sampled from the mind's claims, instead of on all of them, so the cost of each call doesn't grow with the mind. The records of the new claims still refer to the mind's claims.
+    sampling: Defaults to "uniform". The method used to sample the minibatch, as in get_input_set.
+    max_stack_depth (int): Defaults to None. If this is not None, branches of the theory's execution that would make a stack deeper than this fail, as in language.new_execution_context.
+    max_claim_ints (int): Defaults to None. If this is not None, it is the number of claim integers the theory's execution can allocate, as in language.new_execution_context.
+
+  Returns:
+    The status of the theory's execution, as in language.run_theory_with_status, or None if it wasn't tracked. The status is only tracked when there is a deadline, a cancellation token, or a memory limit, or the mind has a metrics registry, since tracking it makes the interpreter check the execution's limits as it runs.
+  """
+  generation=new_generation(mind, deadline, cancel_token, batch_size, sampling, max_stack_depth, max_claim_ints)
+  for output in iterate_generation(generation, mind[0], mind[1], max_outputs):
+    add_generated_claim(mind, generation, output)
+  return finish_generation(mind, generation)
+
+def new_generation(mind, deadline=None, cancel_token=None, batch_size=-1, sampling="uniform", max_stack_depth=None, max_claim_ints=None):
+  """Prepares a run of a theory for generate_claims, by choosing the theory and its input set, and gathering the mind's extensions that the run uses. The run is split into new_generation, iterate_generation, add_generated_claim, and finish_generation so that the theory can be run somewhere else, such as in an executor, while the mind is only read and changed by the caller.
+
+  A generation is a dictionary with the following keys:
+  -"start" is the time.perf_counter() time at which the generation was created
+  -"theory_index" is the index of the chosen theory
+  -"claims" and "input_indeces" are the input set, as returned by get_input_set
+  -"options" is a tuple (profile, deadline, cancel_token, track_status, max_stack_depth, max_claim_ints) of the arguments used to create the execution context, as in language.new_execution_context
+  -"claim_index" is the mind's claim index if it can be used with the input set, and None otherwise
+  -"superinstructions" is the mind's table of superinstructions, or None if it has none
+  -"context" is None until iterate_generation creates the execution context
+
+  Args:
+    mind (list): The mind to generate claims for.
+    deadline (float): Defaults to None. As in generate_claims.
+    cancel_token: Defaults to None. As in generate_claims.
+    batch_size (int): Defaults to -1. As in generate_claims.
+    sampling: Defaults to "uniform". As in generate_claims.
+    max_stack_depth (int): Defaults to None. As in generate_claims.
+    max_claim_ints (int): Defaults to None. As in generate_claims.
+
+  Returns:
+    The generation, as a dictionary.
+  """
+  start=time.perf_counter()
+  theory_index=int(random()*len(mind[0]))
+  claims, input_indeces=get_input_set(mind, batch_size, sampling)
+  return {
+    "start": start,
+    "theory_index": theory_index,
+    "claims": claims,
+    "input_indeces": input_indeces,
+    "options": (mind[6].get("profile"), deadline, cancel_token, "metrics" in mind[6], max_stack_depth, max_claim_ints),
+    # The claim index refers to positions in mind[2], so it can only be used when the input set is all of the mind's claims.
+    "claim_index": mind[6].get("claim_index") if input_indeces is None else None,
+    "superinstructions": mind[6]["superinstructions"]["table"] if "superinstructions" in mind[6] else None,
+    "context": None
+  }
+
+def iterate_generation(generation, theories, routines, max_outputs=-1):
+  """Runs the theory of a generation, as created by new_generation, and creates the generation's execution context.
+
+  Args:
+    generation (dict): The generation.
+    theories (list): The mind's theories.
+    routines (list): The mind's routines.
+    max_outputs (int): Defaults to -1. As in generate_claims.
+
+  Returns:
+    An iterator over the outputs of the theory, as in language.iterate_theory. Their touched inputs are indeces in the generation's input set.
+  """
+  generation["context"]=language.new_execution_context(*generation["options"])
+  return language.iterate_theory(generation["theory_index"], theories, routines, generation["claims"], max_outputs=max_outputs, context=generation["context"], claim_index=generation["claim_index"], superinstructions=generation["superinstructions"])
+
+def add_generated_claim(mind, generation, output):
+  """Adds an output of a generation's theory to the mind, with a record that refers to the mind's claims.
+
+  Args:
+    mind (list): The mind that the generation was created for.
+    generation (dict): The generation.
+    output (tuple): An output yielded by iterate_generation.
   """
-  chosen_theory_index=int(random()*len(mind[0]))
-  outputs=language.run_theory(chosen_theory_index, mind[0], mind[1], mind[2])
-  for output in outputs:
-    touched_claim_indeces=output[0]
-    claim=output[1]
-    add_claim(mind, claim, (chosen_theory_index, touched_claim_indeces))
+  touched_claim_indeces=output[0] if generation["input_indeces"] is None else [generation["input_indeces"][i] for i in output[0]]
+  add_claim(mind, output[1], (generation["theory_index"], touched_claim_indeces))
+
+def finish_generation(mind, generation):
+  """Records the metrics of a generation once its theory has finished running.
+
+  Args:
+    mind (list): The mind that the generation was created for.
+    generation (dict): The generation. Its theory must have been run with iterate_generation.
+
+  Returns:
+    The status of the theory's execution, as in generate_claims, or None if it wasn't tracked.
+  """
+  status=language.get_execution_status(generation["context"]) if generation["context"][2] is not None else None
+  if "metrics" in mind[6]:
+    observe_histogram(mind[6]["metrics"], "generate_claims_seconds", time.perf_counter()-generation["start"], DURATION_BUCKETS)
+    if status!=language.FINISHED:
+      increment_counter(mind[6]["metrics"], "generate_claims_"+status+"_total")
+  return status
 
 def add_claim(mind, claim, record):
   """Adds a claim to the mind's population of claims. This function will not add a claim if the claim and it's record are identical to a claim/record pair already present in the mind. This function also checks if the new claim contradicts any other claims in the mind, and creates a problem if so.
@@ -88,6 +363,8 @@ def add_claim(mind, claim, record):
     claim (tuple): The claim to add to the mind.
     record (tuple): The record of the claim that will be added to the mind.
   """
+  if "metrics" in mind[6]:
+    increment_counter(mind[6]["metrics"], "claims_received_total")
   claim_index=len(mind[2])
   h=hash(tuple(claim[1]))%len(mind[4])
   problem_indeces=[]
@@ -109,11 +386,886 @@ def add_claim(mind, claim, record):
     # If the claim is unique, add it to the mind.
     mind[2].append(claim)
     mind[3].append(record)
+    # Record the claim in the hash table.
+    mind[4][h].append(claim_index)
+    if "claim_index" in mind[6]:
+      language.add_to_claim_index(mind[6]["claim_index"], claim, claim_index)
+    if "genealogy" in mind[6]:
+      add_to_genealogy(mind[6]["genealogy"], claim_index, record)
+    if "listeners" in mind[6]:
+      notify_listeners(mind, "claim", (claim, record))
+    if "metrics" in mind[6]:
+      increment_counter(mind[6]["metrics"], "claims_added_total")
+      observe_histogram(mind[6]["metrics"], "claim_record_inputs", len(record[1]), SIZE_BUCKETS)
+    if "capacity" in mind[6]:
+      capacity=mind[6]["capacity"]
+      capacity["uses"].append(0)
+      capacity["in_problems"].append(0)
+      capacity["live_count"]+=1
+      for input_index in record[1]:
+        capacity["uses"][input_index]+=1
     # Add a problem for each claim that was found that contradicted the new one.
     for old_claim_index in problem_indeces:
       add_problem(mind, (claim_index, old_claim_index))
-    # Record the claim in the hash table.
-    mind[4][h].append(claim_index)
+    if "capacity" in mind[6]:
+      enforce_claim_capacity(mind)
+  elif "metrics" in mind[6]:
+    increment_counter(mind[6]["metrics"], "duplicate_claims_total")
+
+def enable_exec_index(mind):
+  """Attaches an exec index, as created by new_exec_index, to a mind, stored in the mind's extensions under "exec_index". The index is kept up to date as programs change, and is used by delete_routines and inline_and_delete_underused_routines so that they only visit the exec instructions they affect. Without an attached index, those functions build a temporary one.
+
+  Args:
+    mind (list): The mind to index.
+
+  Returns:
+    The exec index.
+  """
+  if "exec_index" not in mind[6]:
+    mind[6]["exec_index"]=new_exec_index(mind)
+  return mind[6]["exec_index"]
+
+def disable_exec_index(mind):
+  """Detaches the exec index from a mind.
+
+  Args:
+    mind (list): The mind to stop indexing.
+
+  Returns:
+    The exec index that was attached, or None if the mind had no exec index.
+  """
+  return mind[6].pop("exec_index", None)
+
+def new_exec_index(mind):
+  """Creates an exec index of a mind's programs, which records where each routine and theory is executed from. An exec site is a tuple (list_index, program_index, position), where list_index is 0 for a theory and 1 for a routine, so the exec instruction at the site is mind[list_index][program_index][position]. An exec index is a dictionary with the following keys:
+  -"callers" maps the argument of each exec instruction, which is the index of a routine, or -1 minus the index of a theory, to the set of sites of the exec instructions with that argument
+  -"sites" maps each program, as a tuple (list_index, program_index), to a sorted list of the positions of its exec instructions
+
+  Args:
+    mind (list): The mind to index.
+
+  Returns:
+    The new exec index.
+  """
+  exec_index={"callers": {}, "sites": {}}
+  for list_index in range(2):
+    for program_index in range(len(mind[list_index])):
+      add_exec_sites(exec_index, mind, list_index, program_index)
+  return exec_index
+
+def add_exec_sites(exec_index, mind, list_index, program_index, start=0, stop=None):
+  """Adds the exec instructions of a program, between two positions, to an exec index.
+
+  Args:
+    exec_index (dict): The exec index.
+    mind (list): The mind that contains the program.
+    list_index (int): 0 if the program is a theory, or 1 if it is a routine.
+    program_index (int): The index of the program.
+    start (int): Defaults to 0. The position of the first instruction to index.
+    stop (int): Defaults to None. The position just after the last instruction to index. If this is None, the instructions up to the end of the program are indexed.
+  """
+  exec_instruction=language.instruction_functions.index(language.instruction_exec)
+  program=mind[list_index][program_index]
+  positions=exec_index["sites"].setdefault((list_index, program_index), [])
+  new_positions=[]
+  for position in range(start, len(program) if stop is None else stop):
+    if program[position][0]==exec_instruction:
+      new_positions.append(position)
+      exec_index["callers"].setdefault(program[position][1], set()).add((list_index, program_index, position))
+  insertion_point=bisect.bisect_left(positions, start)
+  positions[insertion_point:insertion_point]=new_positions
+
+def get_exec_index(mind):
+  """Returns the mind's exec index if it has one, and otherwise a new exec index of the mind."""
+  if "exec_index" in mind[6]:
+    return mind[6]["exec_index"]
+  return new_exec_index(mind)
+
+def get_routine_uses(mind):
+  """Counts the exec instructions that execute each of the mind's routines, using the mind's exec index if it has one.
+
+  Args:
+    mind (list): The mind.
+
+  Returns:
+    A list with the number of uses of each routine.
+  """
+  callers=get_exec_index(mind)["callers"]
+  return [len(callers.get(i, ())) for i in range(len(mind[1]))]
+
+def inline_routine(mind, exec_index, routine_index):
+  """Replaces each exec instruction that executes a routine, outside of the routine itself, with the routine's implementation, and updates an exec index to match. Only the sites of the routine and the later exec instructions of the programs it is inlined into are visited.
+
+  Args:
+    mind (list): The mind.
+    exec_index (dict): An exec index of the mind.
+    routine_index (int): The index of the routine to inline.
+  """
+  implementation=mind[1][routine_index]
+  callers=exec_index["callers"]
+  # Sites are inlined from the end of each program backwards, so the positions of the sites that are still to be inlined don't change.
+  for site in sorted(callers.get(routine_index, ()), reverse=True):
+    if site[0]==1 and site[1]==routine_index:
+      continue
+    list_index, program_index, position=site
+    program=mind[list_index][program_index]
+    mind[list_index][program_index]=program[:position]+implementation+program[position+1:]
+    callers[routine_index].discard(site)
+    positions=exec_index["sites"][(list_index, program_index)]
+    later=bisect.bisect_right(positions, position)
+    # The sites after the inlined one move, and are removed from "callers" before any are added back, since a moved site can take the place of another.
+    for i in range(later, len(positions)):
+      callers[program[positions[i]][1]].discard((list_index, program_index, positions[i]))
+    for i in range(later, len(positions)):
+      callers[program[positions[i]][1]].add((list_index, program_index, positions[i]+len(implementation)-1))
+      positions[i]+=len(implementation)-1
+    del positions[later-1]
+    add_exec_sites(exec_index, mind, list_index, program_index, position, position+len(implementation))
+
+def delete_routine(mind, exec_index, routine_index):
+  """Removes a routine from the mind, renumbers the exec instructions of the later routines, and updates an exec index to match. Exec instructions that still execute the deleted routine are left unchanged, so they execute the routine after it, as in delete_routines. Only the exec instructions of the later routines and the exec instructions that execute them are visited.
+
+  Args:
+    mind (list): The mind.
+    exec_index (dict): An exec index of the mind.
+    routine_index (int): The index of the routine to delete.
+  """
+  exec_instruction=language.instruction_functions.index(language.instruction_exec)
+  callers=exec_index["callers"]
+  sites=exec_index["sites"]
+  routine_count=len(mind[1])
+  for position in sites.pop((1, routine_index), []):
+    callers[mind[1][routine_index][position][1]].discard((1, routine_index, position))
+  del mind[1][routine_index]
+  # The routines after the deleted one move back by one place.
+  for program_index in range(routine_index+1, routine_count):
+    positions=sites.pop((1, program_index), [])
+    for position in positions:
+      argument=mind[1][program_index-1][position][1]
+      callers[argument].discard((1, program_index, position))
+      callers[argument].add((1, program_index-1, position))
+    sites[(1, program_index-1)]=positions
+  # The exec instructions that execute the routines after the deleted one are renumbered.
+  for argument in range(routine_index+1, routine_count):
+    moved_sites=callers.pop(argument, set())
+    for site in moved_sites:
+      mind[site[0]][site[1]][site[2]]=(exec_instruction, argument-1)
+    if len(moved_sites)>0:
+      callers.setdefault(argument-1, set()).update(moved_sites)
+
+def enable_claim_index(mind):
+  """Attaches a claim index, as created by language.new_claim_index, to a mind, stored in the mind's extensions under "claim_index". The index is kept up to date as claims are added, and is used by generate_claims so that forks guarded by a test on the claim, such as "claim_int_count, push_const k, equal, assert", only branch over the claims that can pass the test, without scanning the whole population first.
+
+  Args:
+    mind (list): The mind to index.
+
+  Returns:
+    The claim index.
+  """
+  if "claim_index" not in mind[6]:
+    mind[6]["claim_index"]=language.new_claim_index(mind[2])
+  return mind[6]["claim_index"]
+
+def disable_claim_index(mind):
+  """Detaches the claim index from a mind.
+
+  Args:
+    mind (list): The mind to stop indexing.
+
+  Returns:
+    The claim index that was attached, or None if the mind had no claim index.
+  """
+  return mind[6].pop("claim_index", None)
+
+def enable_genealogy(mind):
+  """Attaches a genealogy to a mind, stored in the mind's extensions under "genealogy". A genealogy is a reverse index of the mind's claim records, which are kept as links from each claim to its inputs, and also records which theories each problem involves. It is kept up to date by add_claim and add_problem, and is used by get_descendants, get_theory_problems, and get_problem_theories.
+
+  Links are kept in arrays of 64-bit integers, as linked lists: "first_child" holds, for each claim, the position in the "child" and "next" arrays of its first link, or -1, and each link holds the claim that used the claim as an input in "child", and the position of the claim's next link in "next". A genealogy is a dictionary with these three arrays and the following keys:
+  -"problem_claims" holds the pair of contradictory claims of each problem, or -1 and -1 for problems that were added before the genealogy was attached
+  -"theory_problems" maps each theory to an array of the indeces of the problems that involve it, in increasing order. A problem involves every theory that produced one of its two claims, or any of their ancestors.
+
+  Args:
+    mind (list): The mind to attach a genealogy to.
+
+  Returns:
+    The genealogy.
+  """
+  if "genealogy" not in mind[6]:
+    genealogy={"first_child": array.array("q"), "child": array.array("q"), "next": array.array("q"), "problem_claims": array.array("q"), "theory_problems": {}}
+    mind[6]["genealogy"]=genealogy
+    for i in range(len(mind[3])):
+      add_to_genealogy(genealogy, i, mind[3][i])
+    for i in range(len(mind[5])):
+      # The claims of these problems weren't recorded, so their theories are read from their traces instead.
+      genealogy["problem_claims"].extend((-1, -1))
+      for theory_index in get_trace_theories(*mind[5][i]):
+        genealogy["theory_problems"].setdefault(theory_index, array.array("q")).append(i)
+  return mind[6]["genealogy"]
+
+def disable_genealogy(mind):
+  """Detaches the genealogy from a mind.
+
+  Args:
+    mind (list): The mind.
+
+  Returns:
+    The genealogy that was attached, or None if the mind had no genealogy.
+  """
+  return mind[6].pop("genealogy", None)
+
+def add_to_genealogy(genealogy, claim_index, record):
+  """Adds the links from a new claim's inputs to the claim to a genealogy. Claims must be added in order.
+
+  Args:
+    genealogy (dict): The genealogy.
+    claim_index (int): The index of the new claim.
+    record (tuple): The claim's record.
+  """
+  genealogy["first_child"].append(-1)
+  for input_index in record[1]:
+    genealogy["child"].append(claim_index)
+    genealogy["next"].append(genealogy["first_child"][input_index])
+    genealogy["first_child"][input_index]=len(genealogy["child"])-1
+
+def add_problem_to_genealogy(mind, problem_index, claims):
+  """Records a new problem in the mind's genealogy.
+
+  Args:
+    mind (list): The mind, which must have a genealogy.
+    problem_index (int): The index of the new problem.
+    claims (tuple): The two contradictory claims of the problem.
+  """
+  genealogy=mind[6]["genealogy"]
+  genealogy["problem_claims"].extend(claims)
+  for theory_index in get_claim_theories(mind, claims[0], claims[1]):
+    genealogy["theory_problems"].setdefault(theory_index, array.array("q")).append(problem_index)
+
+def get_descendants(mind, claim, max_depth=-1):
+  """Finds the claims that depend on a claim, which are the claims that used it as an input, the claims that used those as inputs, and so on.
+
+  Args:
+    mind (list): The mind, which must have a genealogy.
+    claim (int): The index of the claim.
+    max_depth (int): Defaults to -1. If this is not -1, only the descendants that are at most this many generations after the claim are found.
+
+  Returns:
+    A sorted list of the indeces of the descendants, not including the claim itself.
+  """
+  genealogy=mind[6]["genealogy"]
+  first_child=genealogy["first_child"]
+  child=genealogy["child"]
+  next_link=genealogy["next"]
+  found=set()
+  generation=[claim]
+  depth=0
+  while len(generation)>0 and (max_depth==-1 or depth<max_depth):
+    next_generation=[]
+    for parent in generation:
+      link=first_child[parent]
+      while link!=-1:
+        if child[link] not in found:
+          found.add(child[link])
+          next_generation.append(child[link])
+        link=next_link[link]
+    generation=next_generation
+    depth+=1
+  return sorted(found)
+
+def get_ancestors(mind, *claims, max_depth=-1):
+  """Finds the claims that one or more claims were derived from, by following their records back. This doesn't need a genealogy.
+
+  Args:
+    mind (list): The mind.
+    *claims (int): The indeces of the claims.
+    max_depth (int): Defaults to -1. If this is not -1, only the ancestors that are at most this many generations before the claims are found.
+
+  Returns:
+    A sorted list of the indeces of the ancestors, not including the claims themselves unless one is an ancestor of another.
+  """
+  found=set()
+  generation=list(claims)
+  depth=0
+  while len(generation)>0 and (max_depth==-1 or depth<max_depth):
+    next_generation=[]
+    for descendant in generation:
+      for input_index in mind[3][descendant][1]:
+        if input_index not in found:
+          found.add(input_index)
+          next_generation.append(input_index)
+    generation=next_generation
+    depth+=1
+  return sorted(found)
+
+def get_claim_theories(mind, *claims):
+  """Finds the theories that produced one or more claims or any of their ancestors.
+
+  Args:
+    mind (list): The mind.
+    *claims (int): The indeces of the claims.
+
+  Returns:
+    A sorted list of the indeces of the theories.
+  """
+  theories=set(mind[3][i][0] for i in list(claims)+get_ancestors(mind, *claims))
+  theories.discard(-1)
+  return sorted(theories)
+
+def get_trace_theories(*traces):
+  """Finds the theories that appear in one or more claim traces, without recursion.
+
+  Args:
+    *traces: The claim traces, as returned by get_claim_trace. The two traces of a problem can be passed as get_trace_theories(*problem).
+
+  Returns:
+    A sorted list of the indeces of the theories.
+  """
+  theories=set()
+  stack=list(traces)
+  while len(stack)>0:
+    trace=stack.pop()
+    if isinstance(trace, tuple):
+      theories.add(trace[0])
+      stack.extend(trace[1:])
+  return sorted(theories)
+
+def get_theory_problems(mind, theory_index):
+  """Finds the problems that involve a theory, as described in enable_genealogy.
+
+  Args:
+    mind (list): The mind, which must have a genealogy.
+    theory_index (int): The index of the theory.
+
+  Returns:
+    A list of the indeces of the problems, in increasing order.
+  """
+  return list(mind[6]["genealogy"]["theory_problems"].get(theory_index, ()))
+
+def get_problem_theories(mind, problem_index):
+  """Finds the theories that a problem involves, as described in enable_genealogy.
+
+  Args:
+    mind (list): The mind, which must have a genealogy.
+    problem_index (int): The index of the problem.
+
+  Returns:
+    A sorted list of the indeces of the theories.
+  """
+  claims=mind[6]["genealogy"]["problem_claims"][2*problem_index:2*problem_index+2]
+  if claims[0]==-1:
+    return get_trace_theories(*mind[5][problem_index])
+  return get_claim_theories(mind, claims[0], claims[1])
+
+def set_claim_capacity(mind, max_claims, policy="oldest"):
+  """Limits the number of claims in a mind. Whenever a new claim takes the mind over its capacity, claims are evicted, as chosen by an eviction policy, until the mind is back within it. The claim that was just added is never evicted. If the mind is already over its capacity, claims are evicted straight away.
+
+  An evicted claim stays in the mind as a tombstone: its entry in mind[2] is replaced with None, and it is removed from the hash table, so it is no longer used as an input by generate_claims or checked for contradictions, but its record is kept, so the traces of the claims derived from it, and of existing problems, still resolve. Claim indeces never change.
+
+  The capacity is stored in the mind's extensions under "capacity", as a dictionary with the following keys:
+  -"max_claims" is the capacity
+  -"policy" is the eviction policy
+  -"live_count" is the number of claims that haven't been evicted
+  -"uses" is an array with the number of times each claim has been used as an input by a claim added to the mind
+  -"in_problems" is a bytearray holding 1 for each claim that is one of the two contradictory claims of a problem added while the capacity was set, and 0 otherwise
+  -"state" is a dictionary in which the eviction policy can keep its own state
+
+  Args:
+    mind (list): The mind to limit.
+    max_claims (int): The maximum number of claims that haven't been evicted. Must be at least 1.
+    policy: Defaults to "oldest". The name of one of the EVICTION_POLICIES, or a function with the same form as them.
+
+  Returns:
+    The capacity.
+  """
+  if max_claims<1:
+    raise ValueError("the claim capacity must be at least 1")
+  uses=array.array("q", bytes(8*len(mind[3])))
+  for record in mind[3]:
+    for input_index in record[1]:
+      uses[input_index]+=1
+  mind[6]["capacity"]={
+    "max_claims": max_claims,
+    "policy": EVICTION_POLICIES[policy] if isinstance(policy, str) else policy,
+    "live_count": sum(1 for claim in mind[2] if claim is not None),
+    "uses": uses,
+    "in_problems": bytearray(len(mind[2])),
+    "state": {}
+  }
+  enforce_claim_capacity(mind)
+  return mind[6]["capacity"]
+
+def remove_claim_capacity(mind):
+  """Removes the capacity limit from a mind. Claims that were already evicted stay evicted.
+
+  Args:
+    mind (list): The mind.
+
+  Returns:
+    The capacity that was set, or None if the mind had no capacity.
+  """
+  return mind[6].pop("capacity", None)
+
+def enforce_claim_capacity(mind):
+  """Evicts claims from a mind with a capacity, as chosen by its eviction policy, until the mind is within its capacity."""
+  capacity=mind[6]["capacity"]
+  while capacity["live_count"]>capacity["max_claims"]:
+    evict_claim(mind, capacity["policy"](mind, capacity))
+
+def evict_claim(mind, claim_index):
+  """Evicts a claim from a mind, leaving a tombstone as described in set_claim_capacity.
+
+  Args:
+    mind (list): The mind.
+    claim_index (int): The index of the claim to evict.
+  """
+  claim=mind[2][claim_index]
+  if claim is None:
+    return
+  bucket=mind[4][hash(tuple(claim[1]))%len(mind[4])]
+  # The claims a mind is created with aren't in its hash table.
+  if claim_index in bucket:
+    bucket.remove(claim_index)
+  mind[2][claim_index]=None
+  if "capacity" in mind[6]:
+    mind[6]["capacity"]["live_count"]-=1
+  if "listeners" in mind[6]:
+    notify_listeners(mind, "evict", claim_index)
+  if "metrics" in mind[6]:
+    increment_counter(mind[6]["metrics"], "claims_evicted_total")
+
+def get_live_claims(mind):
+  """Returns the claims of a mind that haven't been evicted, to be used as an input set.
+
+  Args:
+    mind (list): The mind.
+
+  Returns:
+    A tuple (claims, live_indeces). If no claims have been evicted, "claims" is mind[2] itself and "live_indeces" is None. Otherwise, "claims" is a new list of the claims that haven't been evicted, and live_indeces[i] is the index in the mind of claims[i].
+  """
+  if None not in mind[2]:
+    return (mind[2], None)
+  live_indeces=[i for i in range(len(mind[2])) if mind[2][i] is not None]
+  return ([mind[2][i] for i in live_indeces], live_indeces)
+
+def evict_oldest(mind, capacity):
+  """The "oldest" eviction policy, which evicts the claim that was added first.
+
+  Args:
+    mind (list): The mind.
+    capacity (dict): The mind's capacity.
+
+  Returns:
+    The index of the claim to evict.
+  """
+  position=capacity["state"].get("oldest", 0)
+  while mind[2][position] is None:
+    position+=1
+  capacity["state"]["oldest"]=position
+  return position
+
+def evict_least_used(mind, capacity):
+  """The "least_used" eviction policy, which evicts the claim that has been used as an input the fewest times, and the oldest of those if there is a tie. Claims are kept in a heap ordered by their number of uses; since uses only increase, entries are brought up to date when they reach the top of the heap.
+
+  Args:
+    mind (list): The mind.
+    capacity (dict): The mind's capacity.
+
+  Returns:
+    The index of the claim to evict.
+  """
+  state=capacity["state"]
+  heap=state.setdefault("heap", [])
+  # The claims added since the last eviction are added to the heap, except for the newest one.
+  for i in range(state.get("next", 0), len(mind[2])-1):
+    if mind[2][i] is not None:
+      heapq.heappush(heap, (capacity["uses"][i], i))
+  state["next"]=len(mind[2])-1
+  while True:
+    uses, i=heap[0]
+    if mind[2][i] is None:
+      heapq.heappop(heap)
+    elif uses!=capacity["uses"][i]:
+      heapq.heapreplace(heap, (capacity["uses"][i], i))
+    else:
+      heapq.heappop(heap)
+      return i
+
+def evict_keep_problems(mind, capacity):
+  """The "keep_problems" eviction policy, which evicts the oldest claim that isn't one of the contradictory claims of a problem, or the oldest claim if they all are.
+
+  Args:
+    mind (list): The mind.
+    capacity (dict): The mind's capacity.
+
+  Returns:
+    The index of the claim to evict.
+  """
+  position=capacity["state"].get("oldest_unproblematic", 0)
+  while position<len(mind[2])-1 and (mind[2][position] is None or capacity["in_problems"][position]):
+    position+=1
+  capacity["state"]["oldest_unproblematic"]=position
+  if position==len(mind[2])-1:
+    return evict_oldest(mind, capacity)
+  return position
+
+'''EVICTION_POLICIES maps the name of each built-in eviction policy to its function. An eviction policy is a function that takes a mind and its capacity, and returns the index of a claim that hasn't been evicted, other than the newest claim, to evict next.'''
+EVICTION_POLICIES={
+  "oldest": evict_oldest,
+  "least_used": evict_least_used,
+  "keep_problems": evict_keep_problems
+}
+
+def enable_superinstructions(mind, max_superinstructions=codegen.MAX_SUPERINSTRUCTIONS):
+  """Compiles superinstructions for the mind's most used routines, as in codegen.get_superinstructions, and stores them in the mind's extensions under "superinstructions", so that generate_claims executes those routines without dispatching each of their instructions. The superinstructions are compiled again by programs_changed whenever the mind's routines change, such as when extract_new_routines extracts new routines.
+
+  The extension is a dictionary with the keys "routines", a copy of the routines the superinstructions were compiled for, "max_superinstructions", and "table", the superinstructions.
+
+  Args:
+    mind (list): The mind to compile superinstructions for.
+    max_superinstructions (int): Defaults to codegen.MAX_SUPERINSTRUCTIONS. The maximum number of routines to compile.
+
+  Returns:
+    The extension.
+  """
+  mind[6]["superinstructions"]={"routines": None, "max_superinstructions": max_superinstructions, "table": {}}
+  update_superinstructions(mind)
+  return mind[6]["superinstructions"]
+
+def update_superinstructions(mind):
+  """Compiles the mind's superinstructions again if its routines have changed since they were last compiled. Routines are ranked by their uses in the theories at the time they are compiled, so adding theories doesn't cause a recompilation.
+
+  Args:
+    mind (list): A mind with superinstructions enabled.
+
+  Returns:
+    True if the superinstructions were compiled again, and False otherwise.
+  """
+  extension=mind[6]["superinstructions"]
+  routines=tuple(tuple(routine) for routine in mind[1])
+  if routines==extension["routines"]:
+    return False
+  extension["routines"]=routines
+  extension["table"]=codegen.get_superinstructions(mind[0], mind[1], extension["max_superinstructions"])
+  return True
+
+def disable_superinstructions(mind):
+  """Stops using superinstructions for the mind's routines.
+
+  Args:
+    mind (list): The mind.
+
+  Returns:
+    The extension that was attached, or None if superinstructions weren't enabled.
+  """
+  return mind[6].pop("superinstructions", None)
+
+def superinstruction_report(mind, repeats=1000):
+  """Measures the speedup of each of the mind's superinstructions, as in codegen.measure_superinstructions.
+
+  Args:
+    mind (list): A mind with superinstructions enabled.
+    repeats (int): Defaults to 1000. The number of times to execute each routine.
+
+  Returns:
+    A human readable string with one line for each superinstruction, as returned by codegen.superinstruction_report_string.
+  """
+  return codegen.superinstruction_report_string(codegen.measure_superinstructions(mind[0], mind[1], mind[6]["superinstructions"]["table"], repeats))
+
+def enable_profiling(mind):
+  """Starts recording every execution of a theory by the mind in a profile, stored in the mind's extensions under "profile". The profile accumulates records until profiling is disabled, so it describes the whole run of the mind.
+
+  Args:
+    mind (list): The mind to profile.
+
+  Returns:
+    The profile, as created by language.new_profile. Use language.profile_string to describe it.
+  """
+  if "profile" not in mind[6]:
+    mind[6]["profile"]=language.new_profile()
+  return mind[6]["profile"]
+
+def disable_profiling(mind):
+  """Stops profiling the mind.
+
+  Args:
+    mind (list): The mind to stop profiling.
+
+  Returns:
+    The profile that was being recorded, or None if the mind wasn't being profiled.
+  """
+  return mind[6].pop("profile", None)
+
+def enable_metrics(mind):
+  """Attaches a metrics registry to a mind, stored in the mind's extensions under "metrics". While the registry is attached, the functions in this file record counters and histograms describing the mind's activity in it. Use metrics_snapshot to read the metrics.
+
+  A metrics registry is a dictionary with the following keys:
+  -"counters" maps the name of each counter to its value. Counters only ever increase.
+  -"gauges" maps the name of each gauge to its value. Gauges can be set to any value.
+  -"histograms" maps the name of each histogram to a list of the form [bounds, counts, sum, count], where "bounds" is a list of the upper bounds of the histogram's buckets, "counts" is a list containing the number of observations in each bucket plus a final count for observations above the last bound, and "sum" and "count" are the sum and number of all observations.
+  -"start_time" is the time at which the registry was created, as returned by time.time.
+  -"last_snapshot" is None, or a tuple (time, counters) containing the time and a copy of the counters at the last call to metrics_snapshot, which is used to compute rates.
+
+  The counters recorded by this file are "claims_received_total", "claims_added_total", "duplicate_claims_total", "problems_added_total", "claims_evicted_total", "generate_claims_step_limit_total", "generate_claims_memory_limit_total", "generate_claims_timed_out_total", and "generate_claims_cancelled_total" (which count the calls to generate_claims that ended with each status other than language.FINISHED). The histograms are "claim_record_inputs", "problem_trace_size", "generate_claims_seconds", "extract_new_routines_seconds", and "conjecture_seconds".
+
+  Args:
+    mind (list): The mind to attach the registry to.
+
+  Returns:
+    The registry.
+  """
+  if "metrics" not in mind[6]:
+    mind[6]["metrics"]={"counters": {}, "gauges": {}, "histograms": {}, "start_time": time.time(), "last_snapshot": None}
+  return mind[6]["metrics"]
+
+def disable_metrics(mind):
+  """Detaches the metrics registry from a mind.
+
+  Args:
+    mind (list): The mind to detach the registry from.
+
+  Returns:
+    The registry that was attached, or None if there wasn't one.
+  """
+  return mind[6].pop("metrics", None)
+
+def increment_counter(metrics, name, amount=1):
+  """Increases a counter in a metrics registry, creating it if necessary.
+
+  Args:
+    metrics (dict): The metrics registry.
+    name (str): The name of the counter.
+    amount (int): Defaults to 1. The amount to increase the counter by.
+  """
+  counters=metrics["counters"]
+  counters[name]=counters.get(name, 0)+amount
+
+def set_gauge(metrics, name, value):
+  """Sets a gauge in a metrics registry, creating it if necessary.
+
+  Args:
+    metrics (dict): The metrics registry.
+    name (str): The name of the gauge.
+    value (float): The new value of the gauge.
+  """
+  metrics["gauges"][name]=value
+
+def observe_histogram(metrics, name, value, bounds=SIZE_BUCKETS):
+  """Records an observation in a histogram in a metrics registry, creating the histogram if necessary.
+
+  Args:
+    metrics (dict): The metrics registry.
+    name (str): The name of the histogram.
+    value (float): The observed value.
+    bounds (list): Defaults to SIZE_BUCKETS. The upper bounds of the histogram's buckets, in increasing order. This is only used when the histogram is created.
+  """
+  histogram=metrics["histograms"].get(name)
+  if histogram is None:
+    histogram=[bounds, [0 for i in range(len(bounds)+1)], 0, 0]
+    metrics["histograms"][name]=histogram
+  bucket=0
+  while bucket<len(histogram[0]) and value>histogram[0][bucket]:
+    bucket+=1
+  histogram[1][bucket]+=1
+  histogram[2]+=value
+  histogram[3]+=1
+
+def get_trace_size(trace):
+  """Returns the number of claims in a claim trace, counting each appearance of a claim separately.
+
+  Args:
+    trace: A claim trace, as returned by get_claim_trace.
+
+  Returns:
+    The number of claims in the trace.
+  """
+  if isinstance(trace, tuple):
+    return 1+sum(get_trace_size(subtrace) for subtrace in trace[1:])
+  return 1
+
+def metrics_snapshot(mind):
+  """Reads the current metrics of a mind. Gauges describing the size of the mind and the state of its hash table are updated first. Rates are computed over the time since the previous snapshot, or since the registry was created if this is the first snapshot.
+
+  Args:
+    mind (list): The mind to read the metrics of. It must have a metrics registry attached with enable_metrics.
+
+  Returns:
+    A dictionary with the keys "time", "counters", "gauges", "histograms", and "rates". "histograms" maps each histogram's name to a dictionary with the keys "bounds", "counts", "sum", "count", and "mean". "rates" maps the name of each counter, with "_total" replaced by "_per_second", to its rate of increase.
+  """
+  metrics=mind[6]["metrics"]
+  now=time.time()
+
+  set_gauge(metrics, "theories", len(mind[0]))
+  set_gauge(metrics, "routines", len(mind[1]))
+  set_gauge(metrics, "claims", len(mind[2]))
+  set_gauge(metrics, "problems", len(mind[5]))
+  occupied=0
+  longest_chain=0
+  for bucket in mind[4]:
+    if len(bucket)>0:
+      occupied+=1
+      longest_chain=max(longest_chain, len(bucket))
+  set_gauge(metrics, "hash_table_size", len(mind[4]))
+  set_gauge(metrics, "hash_table_occupancy", occupied/len(mind[4]))
+  set_gauge(metrics, "hash_table_longest_chain", longest_chain)
+  received=metrics["counters"].get("claims_received_total", 0)
+  set_gauge(metrics, "duplicate_claim_ratio", metrics["counters"].get("duplicate_claims_total", 0)/received if received>0 else 0.0)
+
+  if metrics["last_snapshot"] is None:
+    last_time, last_counters=metrics["start_time"], {}
+  else:
+    last_time, last_counters=metrics["last_snapshot"]
+  elapsed=now-last_time
+  rates={}
+  for name, value in metrics["counters"].items():
+    rate_name=name[:-len("_total")]+"_per_second" if name.endswith("_total") else name+"_per_second"
+    rates[rate_name]=(value-last_counters.get(name, 0))/elapsed if elapsed>0 else 0.0
+  metrics["last_snapshot"]=(now, dict(metrics["counters"]))
+
+  histograms={}
+  for name, histogram in metrics["histograms"].items():
+    histograms[name]={"bounds": list(histogram[0]), "counts": list(histogram[1]), "sum": histogram[2], "count": histogram[3], "mean": histogram[2]/histogram[3] if histogram[3]>0 else 0.0}
+
+  return {"time": now, "counters": dict(metrics["counters"]), "gauges": dict(metrics["gauges"]), "histograms": histograms, "rates": rates}
+
+def write_metrics_json_line(mind, f, labels={}):
+  """Takes a metrics snapshot of a mind and writes it to a file as a single line of JSON, so that a file of snapshots can be read one line at a time.
+
+  Args:
+    mind (list): The mind to read the metrics of.
+    f (file): The file to write to, which should be opened for appending.
+    labels (dict): Defaults to an empty dictionary. Labels identifying the mind, such as its name, which are included in the line under "labels".
+  """
+  snapshot=metrics_snapshot(mind)
+  snapshot["labels"]=dict(labels)
+  f.write(json.dumps(snapshot)+"\n")
+  f.flush()
+
+def write_metrics_prometheus(mind, path, labels={}, prefix="ctp_mind_"):
+  """Takes a metrics snapshot of a mind and writes it to a file in the Prometheus text exposition format, so that it can be collected by a local scraper, such as the textfile collector of the Prometheus node exporter. The file is written to a temporary path and then moved into place, so the scraper never reads a half-written file.
+
+  Args:
+    mind (list): The mind to read the metrics of.
+    path (str): The path of the file to write.
+    labels (dict): Defaults to an empty dictionary. Labels identifying the mind, such as its name, which are attached to every metric.
+    prefix (str): Defaults to "ctp_mind_". A prefix added to the name of every metric.
+  """
+  snapshot=metrics_snapshot(mind)
+
+  def label_string(extra_labels={}):
+    all_labels=dict(labels)
+    all_labels.update(extra_labels)
+    if len(all_labels)==0:
+      return ""
+    return "{"+",".join(key+'="'+str(value).replace("\\", "\\\\").replace('"', '\\"')+'"' for key, value in sorted(all_labels.items()))+"}"
+
+  lines=[]
+  for name, value in sorted(snapshot["counters"].items()):
+    lines.append("# TYPE "+prefix+name+" counter")
+    lines.append(prefix+name+label_string()+" "+repr(value))
+  for name, value in sorted(list(snapshot["gauges"].items())+list(snapshot["rates"].items())):
+    lines.append("# TYPE "+prefix+name+" gauge")
+    lines.append(prefix+name+label_string()+" "+repr(value))
+  for name, histogram in sorted(snapshot["histograms"].items()):
+    lines.append("# TYPE "+prefix+name+" histogram")
+    cumulative=0
+    for i in range(len(histogram["bounds"])):
+      cumulative+=histogram["counts"][i]
+      lines.append(prefix+name+"_bucket"+label_string({"le": repr(float(histogram["bounds"][i]))})+" "+str(cumulative))
+    lines.append(prefix+name+"_bucket"+label_string({"le": "+Inf"})+" "+str(histogram["count"]))
+    lines.append(prefix+name+"_sum"+label_string()+" "+repr(histogram["sum"]))
+    lines.append(prefix+name+"_count"+label_string()+" "+str(histogram["count"]))
+
+  temporary_path=path+".tmp"
+  with open(temporary_path, "w") as f:
+    f.write("\n".join(lines)+"\n")
+  os.replace(temporary_path, path)
+
+def add_theory(mind, theory):
+  """Adds a theory to the mind's population of theories.
+
+  Args:
+    mind (list): The mind to add the theory to.
+    theory (list): The theory to add.
+
+  Returns:
+    The index of the new theory in the mind's list of theories.
+  """
+  mind[0].append(theory)
+  if "exec_index" in mind[6]:
+    add_exec_sites(mind[6]["exec_index"], mind, 0, len(mind[0])-1)
+  programs_changed(mind, True, ("add_theory", (theory,)))
+  return len(mind[0])-1
+
+def programs_changed(mind, exec_index_updated=False, change=None):
+  """Notifies the mind's listeners that its theories or routines have changed. This is called by each function in this file that modifies theories or routines, and should be called by any other code that modifies them directly.
+
+  Args:
+    mind (list): The mind whose theories or routines have changed.
+    exec_index_updated (bool): Defaults to False. True if the caller has already updated the mind's exec index for the change. Otherwise, the exec index is rebuilt, if the mind has one.
+    change (tuple): Defaults to None. A tuple (event, data) describing the change, as one of the events described in add_listener, which listeners are notified of instead of a "programs" event. This lets listeners like the journal record the change itself rather than a copy of every program.
+  """
+  if "exec_index" in mind[6] and not exec_index_updated:
+    mind[6]["exec_index"]=new_exec_index(mind)
+  if "superinstructions" in mind[6]:
+    update_superinstructions(mind)
+  if "listeners" in mind[6]:
+    if change is not None:
+      notify_listeners(mind, change[0], change[1])
+    else:
+      notify_listeners(mind, "programs", (mind[0], mind[1]))
+
+def add_listener(mind, listener):
+  """Attaches a listener to a mind. The listener will be called whenever a claim or problem is added to the mind, or its theories or routines change.
+
+  Args:
+    mind (list): The mind to attach the listener to.
+    listener (function): A function that takes three arguments, (mind, event, data). "event" is a string describing the change, and "data" depends on the event:
+      "claim": data is a tuple (claim, record) containing the claim that was added and its record.
+      "problem": data is the problem that was added.
+      "programs": data is a tuple (theories, routines) containing the mind's new theories and routines. This is sent for changes that aren't described by one of the events below.
+      "add_theory": data is a tuple (theory,) containing a theory that was added by add_theory.
+      "delete_routines": data is a tuple (routines,) containing the indeces of the routines that were deleted by delete_routines.
+      "inline_and_delete_routines": data is a tuple (routines,) containing the indeces of the routines that were inlined and deleted by inline_and_delete_routines.
+      "evict": data is the index of a claim that was evicted, as described in set_claim_capacity.
+  """
+  mind[6].setdefault("listeners", []).append(listener)
+
+def remove_listener(mind, listener):
+  """Detaches a listener that was attached with add_listener.
+
+  Args:
+    mind (list): The mind to detach the listener from.
+    listener (function): The listener to detach.
+  """
+  mind[6]["listeners"].remove(listener)
+  if len(mind[6]["listeners"])==0:
+    del mind[6]["listeners"]
+
+def notify_listeners(mind, event, data):
+  """Calls each of the mind's listeners with an event.
+
+  Args:
+    mind (list): The mind whose listeners will be called.
+    event (str): The kind of event, as described in add_listener.
+    data: The data associated with the event, as described in add_listener.
+  """
+  for listener in mind[6]["listeners"]:
+    listener(mind, event, data)
+
+def conjecture_theory(mind, steps=1):
+  """Conjectures a new theory by randomly choosing a theory from the mind and varying it with conjecture.vary. The new theory is not added to the mind.
+
+  Args:
+    mind (list): The mind to conjecture a theory for. It must contain at least one theory.
+    steps (int): Defaults to 1. The number of steps of variation, as in conjecture.vary.
+
+  Returns:
+    The new theory.
+  """
+  start=time.perf_counter()
+  theory=conjecture.vary(mind[0], int(random()*len(mind[0])), mind[1], steps)
+  if "metrics" in mind[6]:
+    observe_histogram(mind[6]["metrics"], "conjecture_seconds", time.perf_counter()-start, DURATION_BUCKETS)
+  return theory
 
 def extract_new_routines(mind, max_to_extract=-1):
   """Iteratively extracts new routines from the theories and routines present in the mind.
@@ -122,6 +1274,7 @@ def extract_new_routines(mind, max_to_extract=-1):
     mind (list): The mind from which to extract routines.
     max_to_extract (int): Defaults to -1. This value is the maximum number of routines to extract before stopping this function. This function is not guaranteed to extract this number of routines, because it may not be possible to extract the given number of routines. If this value is -1, the function will continue until it is no longer possible to extract a routine.
   """
+  start=time.perf_counter()
   extracted=0
   while max_to_extract==-1 or extracted<max_to_extract:
     output=extract.extract_new_routine(mind[0], mind[1], language.instruction_functions.index(language.instruction_exec), language.is_program_valid)
@@ -130,6 +1283,10 @@ def extract_new_routines(mind, max_to_extract=-1):
     mind[0]=output[0]
     mind[1]=output[1]
     extracted+=1
+  if extracted>0:
+    programs_changed(mind)
+  if "metrics" in mind[6]:
+    observe_histogram(mind[6]["metrics"], "extract_new_routines_seconds", time.perf_counter()-start, DURATION_BUCKETS)
 
 def replace_routine_instances(mind):
   """Applies extract.extract_routine_instances to the mind's theories. This will find all chunks of code that are identical to the implementation of a routine, and replace such chunks with the routine.
@@ -138,6 +1295,7 @@ def replace_routine_instances(mind):
     mind (list): The mind in which to find and replace the implementations of routines within theories.
   """
   mind[0]=extract.extract_routine_instances(mind[0], mind[1], language.instruction_functions.index(language.instruction_exec))
+  programs_changed(mind)
 
 def inline_and_delete_all_routines(mind):
   """Erases all routines in the mind, and replaces each reference to a routine with the implementation of that routine.
@@ -147,6 +1305,7 @@ def inline_and_delete_all_routines(mind):
   """
   mind[0]=[language.inline_execs(i, mind[0], mind[1], inline_theories=False) for i in range(len(mind[0]))]
   mind[1]=[]
+  programs_changed(mind)
 
 def inline_and_delete_underused_routines(mind):
   """This function counts the number of uses for each routine, and gets rid of the routines which are used less than twice. When a routine is removed, each reference to the routine will be replaced with the routine's implementation.
@@ -154,59 +1313,36 @@ def inline_and_delete_underused_routines(mind):
   Args:
     mind (list): The mind in which to search for and delete routines which are only used once.
   """
+  exec_index=get_exec_index(mind)
+  inline_and_delete_routines(mind, [i for i in range(len(mind[1])) if len(exec_index["callers"].get(i, ()))<2], exec_index)
 
-  # Find each reference to each theory in other theories and routines.
-  theory_uses=[[] for i in range(len(mind[1]))]
-  for i in range(len(mind[0])):
-    theory=mind[0][i]
-    for i2 in range(len(theory[1])):
-      instruction=theory[1][i2]
-      if language.instruction_functions[instruction[0]]==language.instruction_exec and instruction[1]>=0:
-          theory_uses[instruction[1]]+=(i,i2)
-
-  # Find each reference to each routine in other routines and theories.
-  routine_uses=[[] for i in range(len(mind[1]))]
-  for i in range(len(mind[1])):
-    routine=mind[1][i]
-    for i2 in range(len(routine[1])):
-      instruction=routine[1][i2]
-      if language.instruction_functions[instruction[0]]==language.instruction_exec and instruction[1]>=0:
-          routine_uses[instruction[1]]+=(i,i2)
-
-  # Find underused routines, and replace refernces to them with their implementation.
-  underused_routines=[]
-  for i in range(len(mind[1])):
-    uses=len(theory_uses[i])+len(routine_uses[i])
-    if uses<2:
-      underused_routines.append(i)
-      routine_to_inline=mind[1][i]
-      for i2 in range(len(theory_uses)):
-        theory_use=theory_uses[i2]
-        theory=mind[0][theory_use[0]]
-        mind[0][theory_use]=theory[:theory_use[1]]+routine_to_inline+theory[theory_use[1]+1:]
-      for i2 in range(len(routine_uses)):
-        routine_use=routine_uses[i2]
-        routine=mind[1][routine_use[0]]
-        mind[1][routine_use]=routine[:routine_use[1]]+routine_to_inline+routine[routine_use[1]+1:]
-  
-  delete_routines(mind, underused_routines[i])
+def inline_and_delete_routines(mind, routines, exec_index=None):
+  """Replaces each reference to some set of routines with the routine's implementation, and then removes the routines from the mind's population of routines.
+
+  Args:
+    mind (list): The mind in which to inline and delete routines.
+    routines (list): A list of integers containing the indeces of the routines that will be inlined and deleted, in increasing order.
+    exec_index (dict): Defaults to None. The exec index to use and update, as returned by get_exec_index. If this is None, get_exec_index is used.
+  """
+  if exec_index is None:
+    exec_index=get_exec_index(mind)
+  for i in routines:
+    inline_routine(mind, exec_index, i)
+  for i in range(len(routines)):
+    delete_routine(mind, exec_index, routines[i]-i)
+  programs_changed(mind, True, ("inline_and_delete_routines", (list(routines),)))
 
 def delete_routines(mind, routines):
   """Removes some set of routines from the mind's population of routines. This function updates all references to routines that are affected by the change.
 
   Args:
     mind (list): The mind in which to delete routines.
-    routines (list): A list of integers containing the indeces of the routines that will be deleted.
+    routines (list): A list of integers containing the indeces of the routines that will be deleted, in increasing order.
   """
-  exec_instruction=language.instruction_functions.index(language.instruction_exec)
+  exec_index=get_exec_index(mind)
   for i in range(len(routines)):
-    routine_index=routines[i]-i
-    mind[1]=mind[1][:routine_index]+mind[1][routine_index+1:]
-    for program in mind[0]+mind[1]:
-      for i2 in range(len(program)):
-        instruction=program[i2]
-        if instruction[0]==exec_instruction and instruction[1]>routine_index:
-          program[i2]=(exec_instruction, instruction[1]-1)
+    delete_routine(mind, exec_index, routines[i]-i)
+  programs_changed(mind, True, ("delete_routines", (list(routines),)))
 
 def add_problem(mind, claims):
   """Adds a problem to the mind's population of problems. A problem consists of a pair of traces that describe the way two contradictory claims were created.
@@ -215,7 +1351,18 @@ def add_problem(mind, claims):
     mind (list): The mind to add the problem to.
     claims (tuple): A tuple of length 2 containing the two contradictory claims.
   """
-  mind[5].append((get_claim_trace(mind,claims[0]), get_claim_trace(mind,claims[1])))
+  problem=(get_claim_trace(mind,claims[0]), get_claim_trace(mind,claims[1]))
+  mind[5].append(problem)
+  if "genealogy" in mind[6]:
+    add_problem_to_genealogy(mind, len(mind[5])-1, claims)
+  if "capacity" in mind[6]:
+    mind[6]["capacity"]["in_problems"][claims[0]]=1
+    mind[6]["capacity"]["in_problems"][claims[1]]=1
+  if "listeners" in mind[6]:
+    notify_listeners(mind, "problem", problem)
+  if "metrics" in mind[6]:
+    increment_counter(mind[6]["metrics"], "problems_added_total")
+    observe_histogram(mind[6]["metrics"], "problem_trace_size", get_trace_size(problem[0])+get_trace_size(problem[1]), SIZE_BUCKETS)
 
 def get_claim_trace(mind, claim):
   """This function recursively traces backwards to determine the lineage of a claim. It returns a claim trace, a nested tuple describing how 
@@ -0,0 +1,314 @@
+"""This file contains a pipelined conjecture-and-criticism engine, which repeatedly conjectures new theories for a mind, criticizes them, and admits the ones that survive. The work is split into four stages, each running in its own thread:
+-"generate" conjectures candidate theories with conjecture.vary_novel, so candidates that were already seen are never passed on
+-"filter" discards candidates that are invalid, or that behave identically on the probe bank to a theory that was already seen, using conjecture.behavior_fingerprint
+-"evaluate" runs each candidate on the mind's current claims in a pool of worker processes, and counts the problems that its outputs would create
+-"admit" adds each candidate that creates no more than "max_problems" problems to the mind, along with its outputs, and rejects the rest
+
+The stages are connected by bounded queues, so a fast stage waits for a slow one instead of piling up work, and the throughput of the engine is limited by the slowest stage rather than by the sum of all of them. The evaluate stage keeps several candidates in flight at once, so every worker stays busy.
+
+The admit stage is the only one that modifies the mind, and it does so while holding the pipeline's lock. The other stages take copies of the mind's programs and claims while holding the lock, so the mind must not be modified by other code while the pipeline is running. Every stage also holds the lock while it reads or modifies the program store, which several stages share.
+
+The worker processes are started with the "forkserver" method where it is available, and with "spawn" otherwise, so they never inherit a copy of the stage threads' locks, which a fork could copy while another thread holds them. Every candidate is interned in the pipeline's program store, along with an outcome of ("admitted", problem_count), ("rejected", problem_count), or ("filtered", reason). A candidate that raises an exception while it is fingerprinted or evaluated gets the outcome ("filtered", "error") or ("rejected", "error"), and the pipeline carries on with the next candidate; only exceptions raised by the stages themselves stop the pipeline.
+
+A pipeline is a dictionary with the following keys:
+-"mind" is the mind that theories are conjectured for
+-"store" is the program store
+-"behaviors" is the set of behavioral fingerprints of every theory that was seen
+-"queues" is a list of the three queues between the stages
+-"lock" is the lock held while the mind or the program store is read or modified
+-"stop" is a threading.Event that is set to make every stage stop early
+-"threads" is a list of the stage threads
+-"executor" is the pool used by the evaluate stage
+-"stats" maps the name of each stage to a dictionary with the keys "items" (the number of items the stage processed) and "seconds" (the time the stage spent working, not including time spent waiting on its queues; for the evaluate stage, this is the total time spent in the workers divided by the number of workers)
+-"admitted" is a list of the indeces of the theories that were admitted
+-"errors" is a list of exceptions raised in the stages
+"""
+
+import concurrent.futures
+import multiprocessing
+import os
+import queue
+import threading
+import time
+import conjecture
+import language
+import minds
+import store
+from numpy.random import random
+
+'''QUEUE_POLL_SECONDS is how long a stage waits on a full or empty queue before checking whether the pipeline has been stopped.'''
+QUEUE_POLL_SECONDS=0.05
+
+'''STAGE_NAMES lists the names of the stages, in order.'''
+STAGE_NAMES=["generate", "filter", "evaluate", "admit"]
+
+'''WORKER_START_METHOD is the multiprocessing start method used for the worker processes of the evaluate stage.'''
+WORKER_START_METHOD="forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+
+def evaluate_candidate(theory, theories, routines, claims, execution_limit, max_outputs, max_stack_depth=None, max_claim_ints=None):
+  """Runs a candidate theory on a set of claims, and counts the problems that its outputs would create if they were added to a mind containing the claims. This is the work done in the worker processes by the evaluate stage.
+
+  Args:
+    theory (list): The candidate theory.
+    theories (list): The theories that the candidate can reference.
+    routines (list): The routines that the candidate can reference.
+    claims (list): The claims to run the candidate on.
+    execution_limit (int): The execution limit, as in language.run_theory.
+    max_outputs (int): The maximum number of outputs to produce, or -1 for no maximum.
+    max_stack_depth (int): Defaults to None. The stack depth limit of the candidate's execution, as in language.new_execution_context.
+    max_claim_ints (int): Defaults to None. The claim integer limit of the candidate's execution, as in language.new_execution_context.
+
+  Returns:
+    A tuple (outputs, problem_count), where "outputs" is the list of outputs of the candidate, as returned by language.run_theory.
+  """
+  outputs=list(language.iterate_theory(len(theories), theories+[theory], routines, claims, execution_limit, max_outputs, max_stack_depth=max_stack_depth, max_claim_ints=max_claim_ints))
+  bool_counts={}
+  for claim in claims:
+    bool_counts.setdefault(tuple(claim[1]), [0, 0])[1 if claim[0] else 0]+=1
+  problem_count=0
+  seen_outputs=set()
+  for touched_claim_indeces, claim in outputs:
+    key=(claim[0], tuple(claim[1]), tuple(touched_claim_indeces))
+    if key in seen_outputs:
+      continue
+    seen_outputs.add(key)
+    counts=bool_counts.setdefault(key[1], [0, 0])
+    problem_count+=counts[0 if claim[0] else 1]
+    counts[1 if claim[0] else 0]+=1
+  return (outputs, problem_count)
+
+def timed_evaluation(*args):
+  """Calls evaluate_candidate, and returns a tuple (result, seconds) of its result and the time it took."""
+  start=time.perf_counter()
+  result=evaluate_candidate(*args)
+  return (result, time.perf_counter()-start)
+
+def put_item(pipeline, item_queue, item):
+  """Puts an item on a queue, waiting while the queue is full. Returns False without putting the item if the pipeline is stopped while waiting, and True otherwise."""
+  while not pipeline["stop"].is_set():
+    try:
+      item_queue.put(item, timeout=QUEUE_POLL_SECONDS)
+      return True
+    except queue.Full:
+      pass
+  return False
+
+def get_item(pipeline, item_queue):
+  """Gets an item from a queue, waiting while the queue is empty. Returns None if the pipeline is stopped while waiting."""
+  while not pipeline["stop"].is_set():
+    try:
+      return item_queue.get(timeout=QUEUE_POLL_SECONDS)
+    except queue.Empty:
+      pass
+  return None
+
+def copy_programs(pipeline):
+  """Returns a tuple (theories, routines) of copies of the mind's programs, taken while holding the pipeline's lock."""
+  with pipeline["lock"]:
+    return ([theory[:] for theory in pipeline["mind"][0]], [routine[:] for routine in pipeline["mind"][1]])
+
+def run_stage(pipeline, name, work):
+  """The body of a stage's thread. Calls "work" until it returns False, and then passes None down the pipeline to tell the next stage that no more items are coming. If "work" raises an exception, the exception is recorded and the whole pipeline is stopped.
+
+  Args:
+    pipeline (dict): The pipeline.
+    name (str): The name of the stage.
+    work (function): A function that processes one item and returns True, or returns False when the stage is finished.
+  """
+  stage_index=STAGE_NAMES.index(name)
+  try:
+    while work():
+      pass
+  except Exception as e:
+    pipeline["errors"].append(e)
+    pipeline["stop"].set()
+  if stage_index<len(pipeline["queues"]):
+    put_item(pipeline, pipeline["queues"][stage_index], None)
+
+def timed(pipeline, name, start):
+  """Adds the time since "start" to a stage's working time, and counts one item for the stage."""
+  stats=pipeline["stats"][name]
+  stats["seconds"]+=time.perf_counter()-start
+  stats["items"]+=1
+
+def start_pipeline(mind, candidate_count, program_store=None, workers=None, queue_size=16, steps=1, max_problems=0, execution_limit=100, max_outputs=-1, max_stack_depth=None, max_claim_ints=None):
+  """Starts a pipeline that conjectures candidate theories for a mind, and admits the ones that survive criticism. Returns immediately; call wait_for_pipeline to wait until it is finished.
+
+  Args:
+    mind (list): The mind to conjecture theories for. It must contain at least one theory.
+    candidate_count (int): The number of candidates to generate.
+    program_store (dict): Defaults to None. The store used to remember every candidate that was seen. If this is None, a new store containing the mind's theories is created.
+    workers (int): Defaults to None. The number of worker processes used by the evaluate stage. If this is None, it is the number of CPUs.
+    queue_size (int): Defaults to 16. The maximum number of items in each queue between stages.
+    steps (int): Defaults to 1. The number of steps of variation used to generate each candidate, as in conjecture.vary.
+    max_problems (int): Defaults to 0. The maximum number of problems that a candidate can create and still be admitted.
+    execution_limit (int): Defaults to 100. The execution limit used to evaluate candidates.
+    max_outputs (int): Defaults to -1. If this is not -1, the evaluation of each candidate stops once it has produced this many outputs.
+    max_stack_depth (int): Defaults to None. If this is not None, it limits the depth of the stacks of each candidate's evaluation, as in language.new_execution_context, so a candidate that grows its stacks without bound can't exhaust the memory of a worker.
+    max_claim_ints (int): Defaults to None. If this is not None, it limits the number of claim integers each candidate's evaluation can allocate, as in language.new_execution_context.
+
+  Returns:
+    The pipeline, as a dictionary.
+  """
+  workers=workers if workers is not None else (os.cpu_count() or 1)
+  pipeline={
+    "mind": mind,
+    "store": program_store if program_store is not None else store.new_store(mind[0]),
+    "behaviors": set(conjecture.behavior_fingerprint(i, mind[0], mind[1]) for i in range(len(mind[0]))),
+    "queues": [queue.Queue(queue_size) for i in range(3)],
+    "lock": threading.Lock(),
+    "stop": threading.Event(),
+    "threads": [],
+    "executor": concurrent.futures.ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context(WORKER_START_METHOD)),
+    "stats": {name: {"items": 0, "seconds": 0.0} for name in STAGE_NAMES},
+    "admitted": [],
+    "errors": []
+  }
+  generated=[0]
+  in_flight={}
+  evaluate_done=[False]
+
+  def generate():
+    if generated[0]>=candidate_count:
+      return False
+    start=time.perf_counter()
+    theories, routines=copy_programs(pipeline)
+    with pipeline["lock"]:
+      theory=conjecture.vary_novel(theories, int(random()*len(theories)), routines, pipeline["store"], steps)
+    generated[0]+=1
+    timed(pipeline, "generate", start)
+    if theory==False:
+      return True
+    return put_item(pipeline, pipeline["queues"][0], theory)
+
+  def filter_candidates():
+    theory=get_item(pipeline, pipeline["queues"][0])
+    if theory is None:
+      return False
+    start=time.perf_counter()
+    theories, routines=copy_programs(pipeline)
+    reason=None
+    with pipeline["lock"]:
+      valid=store.get_program_verdict(pipeline["store"], theory)
+    if not valid:
+      reason="invalid"
+    else:
+      try:
+        fingerprint=conjecture.behavior_fingerprint(len(theories), theories+[theory], routines)
+      except Exception:
+        # A valid candidate can still raise on some inputs, which only rules out that candidate.
+        fingerprint=None
+      if fingerprint is None:
+        reason="error"
+      elif fingerprint in pipeline["behaviors"]:
+        reason="duplicate behavior"
+      else:
+        pipeline["behaviors"].add(fingerprint)
+    timed(pipeline, "filter", start)
+    if reason is not None:
+      with pipeline["lock"]:
+        store.record_outcome(pipeline["store"], theory, ("filtered", reason))
+      return True
+    return put_item(pipeline, pipeline["queues"][1], theory)
+
+  def evaluate():
+    # Keep up to two candidates per worker in flight, and pass on results as they complete.
+    while not evaluate_done[0] and len(in_flight)<2*workers:
+      if len(in_flight)==0:
+        theory=get_item(pipeline, pipeline["queues"][1])
+      else:
+        try:
+          theory=pipeline["queues"][1].get_nowait()
+        except queue.Empty:
+          break
+      if theory is None:
+        evaluate_done[0]=True
+        break
+      with pipeline["lock"]:
+        theories=[program[:] for program in mind[0]]
+        routines=[program[:] for program in mind[1]]
+        claims, live_indeces=minds.get_live_claims(mind)
+        claims=claims[:]
+      future=pipeline["executor"].submit(timed_evaluation, theory, theories, routines, claims, execution_limit, max_outputs, max_stack_depth, max_claim_ints)
+      in_flight[future]=(theory, live_indeces)
+    if len(in_flight)==0:
+      return False
+    done, pending=concurrent.futures.wait(list(in_flight), timeout=QUEUE_POLL_SECONDS, return_when=concurrent.futures.FIRST_COMPLETED)
+    for future in done:
+      theory, live_indeces=in_flight.pop(future)
+      stats=pipeline["stats"]["evaluate"]
+      stats["items"]+=1
+      try:
+        (outputs, problem_count), seconds=future.result()
+      except Exception:
+        with pipeline["lock"]:
+          store.record_outcome(pipeline["store"], theory, ("rejected", "error"))
+        continue
+      stats["seconds"]+=seconds/workers
+      if not put_item(pipeline, pipeline["queues"][2], (theory, live_indeces, outputs, problem_count)):
+        return False
+    return True
+
+  def admit():
+    item=get_item(pipeline, pipeline["queues"][2])
+    if item is None:
+      return False
+    start=time.perf_counter()
+    theory, live_indeces, outputs, problem_count=item
+    if problem_count<=max_problems:
+      with pipeline["lock"]:
+        theory_index=minds.add_theory(mind, theory)
+        for touched_claim_indeces, claim in outputs:
+          if live_indeces is not None:
+            touched_claim_indeces=[live_indeces[i] for i in touched_claim_indeces]
+          minds.add_claim(mind, claim, (theory_index, touched_claim_indeces))
+        store.record_outcome(pipeline["store"], theory, ("admitted", problem_count))
+      pipeline["admitted"].append(theory_index)
+    else:
+      with pipeline["lock"]:
+        store.record_outcome(pipeline["store"], theory, ("rejected", problem_count))
+    timed(pipeline, "admit", start)
+    return True
+
+  for name, work in zip(STAGE_NAMES, [generate, filter_candidates, evaluate, admit]):
+    thread=threading.Thread(target=run_stage, args=(pipeline, name, work), daemon=True)
+    pipeline["threads"].append(thread)
+    thread.start()
+  return pipeline
+
+def stop_pipeline(pipeline):
+  """Tells every stage of a pipeline to stop as soon as possible. Candidates that are still in the pipeline are dropped. Call wait_for_pipeline afterwards to wait for the stages to stop."""
+  pipeline["stop"].set()
+
+def wait_for_pipeline(pipeline):
+  """Waits until every stage of a pipeline has finished, and shuts down its worker processes.
+
+  Args:
+    pipeline (dict): The pipeline.
+
+  Returns:
+    The pipeline's "stats", with an extra key "slowest_stage" giving the name of the stage that spent the most time working, which is the stage that limits the pipeline's throughput.
+  """
+  for thread in pipeline["threads"]:
+    thread.join()
+  pipeline["executor"].shutdown(cancel_futures=True)
+  if len(pipeline["errors"])>0:
+    raise pipeline["errors"][0]
+  stats=dict(pipeline["stats"])
+  stats["slowest_stage"]=max(STAGE_NAMES, key=lambda name: pipeline["stats"][name]["seconds"])
+  return stats
+
+def run_pipeline(mind, candidate_count, **options):
+  """Runs a pipeline until it has processed "candidate_count" candidates, as in start_pipeline and wait_for_pipeline.
+
+  Args:
+    mind (list): The mind to conjecture theories for.
+    candidate_count (int): The number of candidates to generate.
+    **options: Passed to start_pipeline.
+
+  Returns:
+    A tuple (admitted, stats), where "admitted" is a list of the indeces of the admitted theories, and "stats" is as returned by wait_for_pipeline.
+  """
+  pipeline=start_pipeline(mind, candidate_count, **options)
+  stats=wait_for_pipeline(pipeline)
+  return (pipeline["admitted"], stats)
@@ -0,0 +1,231 @@
+"""This file contains functions for querying whether a mind can derive a particular claim, without running many rounds of minds.generate_claims and adding everything they produce to the mind. A query searches the claims that the mind's theories can derive lazily, and stops as soon as it finds the target claim:
+-Theories that can't create a claim that isn't one of their inputs are never run. A theory can only create a new claim if it contains an instruction that changes or creates claims, since every other output is a copy of one of its inputs.
+-The remaining theories are run in order of how close the claims they have produced so far came to the target.
+-If a batch size is given, each theory is run on the claims that are most similar to the target, instead of on every claim.
+-Outputs are checked against the target as soon as the branch that produced them finishes, so a run stops at the first match.
+
+The claims derived by a query are kept in an overlay on top of the mind, rather than being added to it, so a query never modifies the mind. The search is run in rounds: in each round, every theory is run once on the claims known at the start of its run, and the derived claims become inputs for the next round. The search ends when a round derives no new claims, since every run after that would repeat one that was already made.
+
+A query is a dictionary that holds the overlay and the memoized results of a search, so that several searches on the same mind can share their work. It has the following keys:
+-"sizes" is the number of theories, routines, and claims the mind had when the query was created. A query can only be used while the mind is unchanged, and find_derivation starts a new query if these have changed.
+-"claims" is the list of claims derived by the query. The claim at index i in this list is referred to by the index base+i, where "base" is the number of claims in the mind, so indeces below "base" refer to the mind's claims.
+-"records" is the list of the records of the derived claims, in the same form as the records in a mind, except that touched inputs are indeces as described above.
+-"seen" maps each known claim, as a tuple (bool, tuple of ints), to the index of its first derivation.
+-"productive" is a list of booleans, which are True for the theories that can create new claims.
+-"scores" is a list of the highest similarity to "target" of any claim produced by each theory, or None for theories that haven't produced any claims.
+-"target" is the target that the scores were computed for, as a tuple (bool, tuple of ints).
+-"runs" is the set of runs that were finished, as tuples (theory_index, input_indeces). A run that was stopped early, by finding the target or by the budget running out, isn't included, so it is made again if a later search needs it.
+-"traces" maps the indeces of derived claims to their claim traces, once they have been built.
+
+Example:
+  trace=query.find_contradiction(mind, (True, [1, 2]), max_runs=50)
+  if trace is not None:
+    minds.write_trace(trace)
+"""
+
+import time
+import language
+import minds
+
+'''CLAIM_WRITING_FUNCTIONS lists the basic instructions that create a claim or change the contents of one. A theory without any of these can only output copies of its inputs.'''
+CLAIM_WRITING_FUNCTIONS=[
+  language.instruction_new_claim,
+  language.instruction_set_claim_bool,
+  language.instruction_set_claim_int,
+  language.instruction_push_claim_int,
+  language.instruction_remove_claim_int
+]
+
+def new_query(mind):
+  """Creates a new query of a mind, with no derived claims.
+
+  Args:
+    mind (list): The mind to query.
+
+  Returns:
+    The new query, as a dictionary.
+  """
+  query={
+    "sizes": (len(mind[0]), len(mind[1]), len(mind[2])),
+    "claims": [],
+    "records": [],
+    "seen": {},
+    "productive": [is_theory_productive(i, mind[0], mind[1]) for i in range(len(mind[0]))],
+    "scores": None,
+    "target": None,
+    "runs": set(),
+    "traces": {}
+  }
+  claims, live_indeces=minds.get_live_claims(mind)
+  for i in (live_indeces if live_indeces is not None else range(len(claims))):
+    query["seen"].setdefault((mind[2][i][0], tuple(mind[2][i][1])), i)
+  return query
+
+def is_theory_productive(theory_index, theories, routines):
+  """Checks whether a theory can create a claim that isn't one of its inputs.
+
+  Args:
+    theory_index (int): The index of the theory.
+    theories (list): The theories that the theory can reference.
+    routines (list): The routines that the theory can reference.
+
+  Returns:
+    True if the inlined theory contains any of the CLAIM_WRITING_FUNCTIONS, and False otherwise.
+  """
+  theory=language.inline_execs(theory_index, theories, routines)
+  return any(language.instruction_functions[instruction[0]] in CLAIM_WRITING_FUNCTIONS for instruction in theory)
+
+def get_similarity(claim, target):
+  """Estimates how close a claim is to a target claim. This is the number of integers in the target that also appear in the claim, counting repeated integers as often as they appear in both, minus the difference between their numbers of integers.
+
+  Args:
+    claim (tuple): The claim.
+    target (tuple): The target claim.
+
+  Returns:
+    The similarity, as an integer. It is highest, at len(target[1]), when the claim's integers are the target's.
+  """
+  counts={}
+  for value in target[1]:
+    counts[value]=counts.get(value, 0)+1
+  shared=0
+  for value in claim[1]:
+    if counts.get(value, 0)>0:
+      counts[value]-=1
+      shared+=1
+  return shared-abs(len(claim[1])-len(target[1]))
+
+def get_query_claim(mind, query, index):
+  """Returns the claim at an index of a query, which refers to the mind's claims below the number of claims in the mind, and to the query's derived claims above it."""
+  base=query["sizes"][2]
+  return mind[2][index] if index<base else query["claims"][index-base]
+
+def get_known_indices(mind, query):
+  """Returns a list of the indeces of every claim known to a query: the claims of the mind that haven't been evicted, followed by the claims the query has derived."""
+  claims, live_indeces=minds.get_live_claims(mind)
+  known=list(live_indeces if live_indeces is not None else range(len(claims)))
+  base=query["sizes"][2]
+  return known+list(range(base, base+len(query["claims"])))
+
+def score_theories(mind, query, target):
+  """Computes the scores of the theories of a query for a target, from the claims that each theory produced in the mind, and the claims it has derived in the query."""
+  scores=[None]*len(mind[0])
+  claims, live_indeces=minds.get_live_claims(mind)
+  for i in (live_indeces if live_indeces is not None else range(len(claims))):
+    theory_index=mind[3][i][0]
+    if 0<=theory_index<len(scores):
+      similarity=get_similarity(mind[2][i], target)
+      if scores[theory_index] is None or similarity>scores[theory_index]:
+        scores[theory_index]=similarity
+  for i in range(len(query["claims"])):
+    theory_index=query["records"][i][0]
+    similarity=get_similarity(query["claims"][i], target)
+    if scores[theory_index] is None or similarity>scores[theory_index]:
+      scores[theory_index]=similarity
+  query["scores"]=scores
+  query["target"]=(target[0], tuple(target[1]))
+
+def get_query_trace(mind, query, index):
+  """Returns the claim trace of a claim known to a query, in the same form as minds.get_claim_trace. The traces of derived claims are memoized in the query."""
+  if index<query["sizes"][2]:
+    return minds.get_claim_trace(mind, index)
+  if index not in query["traces"]:
+    record=query["records"][index-query["sizes"][2]]
+    query["traces"][index]=tuple([record[0]]+[get_query_trace(mind, query, subclaim) for subclaim in record[1]])
+  return query["traces"][index]
+
+def find_derivation(mind, target, query=None, max_runs=100, max_outputs=-1, max_rounds=-1, batch_size=-1, execution_limit=100, deadline=None, max_stack_depth=None, max_claim_ints=None):
+  """Searches for a way for a mind's theories to derive a target claim, starting from the mind's claims, and stops at the first one found.
+
+  Args:
+    mind (list): The mind to query. It is not modified.
+    target (tuple): The claim to derive.
+    query (dict): Defaults to None. A query of the mind, as created by new_query, whose derived claims and memoized runs are reused and extended. If this is None, or the mind has changed since the query was created, a new query is used.
+    max_runs (int): Defaults to 100. The maximum number of times a theory is run. If this is -1, there is no maximum.
+    max_outputs (int): Defaults to -1. If this is not -1, the search stops once this many outputs have been checked.
+    max_rounds (int): Defaults to -1. If this is not -1, the search stops after this many rounds, so only claims with derivations at most this deep are found.
+    batch_size (int): Defaults to -1. If this is not -1, each theory is run on at most this many of the known claims, choosing the ones most similar to the target.
+    execution_limit (int): Defaults to 100. The execution limit of each run, as in language.run_theory.
+    deadline (float): Defaults to None. If this is not None, the search stops once time.monotonic() reaches this value.
+    max_stack_depth (int): Defaults to None. The stack depth limit of each run, as in language.new_execution_context.
+    max_claim_ints (int): Defaults to None. The claim integer limit of each run, as in language.new_execution_context.
+
+  Returns:
+    The claim trace of the first derivation of the target that was found, in the same form as minds.get_claim_trace, or None if the budget ran out or every claim that could be derived was found without finding the target. With a batch size, only the claims that can be derived from the claims chosen for each batch are searched. If the target is already one of the mind's claims, its own trace is returned.
+  """
+  if query is None or query["sizes"]!=(len(mind[0]), len(mind[1]), len(mind[2])):
+    query=new_query(mind)
+  key=(target[0], tuple(target[1]))
+  if key in query["seen"]:
+    return get_query_trace(mind, query, query["seen"][key])
+  if query["target"]!=key:
+    score_theories(mind, query, target)
+  scores=query["scores"]
+  base=query["sizes"][2]
+  runs=0
+  outputs_checked=0
+  rounds=0
+  while max_rounds==-1 or rounds<max_rounds:
+    derived_before=len(query["claims"])
+    # Theories that have never produced a claim come after every theory that has, and ties keep the theories in order.
+    order=sorted((i for i in range(len(mind[0])) if query["productive"][i]), key=lambda i: (scores[i] is None, -(scores[i] or 0), i))
+    for theory_index in order:
+      known=get_known_indices(mind, query)
+      if batch_size!=-1 and len(known)>batch_size:
+        # Ties are broken in favour of the newest claims, so a batch moves on to the claims derived in the last round.
+        known=sorted(sorted(known, key=lambda i: (-get_similarity(get_query_claim(mind, query, i), target), -i))[:batch_size])
+      run=(theory_index, tuple(known))
+      if run in query["runs"]:
+        continue
+      if (max_runs!=-1 and runs>=max_runs) or (deadline is not None and time.monotonic()>=deadline):
+        return None
+      runs+=1
+      inputs=[get_query_claim(mind, query, i) for i in known]
+      context=language.new_execution_context(None, deadline, None, True, max_stack_depth, max_claim_ints)
+      for touched, claim in language.iterate_theory(theory_index, mind[0], mind[1], inputs, execution_limit, context=context):
+        outputs_checked+=1
+        claim_key=(claim[0], tuple(claim[1]))
+        if claim_key not in query["seen"]:
+          query["seen"][claim_key]=base+len(query["claims"])
+          query["claims"].append(claim)
+          query["records"].append((theory_index, [known[i] for i in touched]))
+          similarity=get_similarity(claim, target)
+          if scores[theory_index] is None or similarity>scores[theory_index]:
+            scores[theory_index]=similarity
+          if claim_key==key:
+            return get_query_trace(mind, query, query["seen"][key])
+        if max_outputs!=-1 and outputs_checked>=max_outputs:
+          return None
+      if language.get_execution_status(context)==language.TIMED_OUT:
+        return None
+      query["runs"].add(run)
+    if len(query["claims"])==derived_before:
+      return None
+    rounds+=1
+  return None
+
+def can_derive(mind, target, **options):
+  """Checks whether a mind's theories can derive a target claim, as in find_derivation.
+
+  Args:
+    mind (list): The mind to query.
+    target (tuple): The claim to derive.
+    **options: Passed to find_derivation.
+
+  Returns:
+    True if a derivation of the target was found, and False otherwise.
+  """
+  return find_derivation(mind, target, **options) is not None
+
+def find_contradiction(mind, claim, **options):
+  """Searches for a way for a mind's theories to derive a claim that contradicts a given claim, which is the claim with the same integers and the opposite boolean.
+
+  Args:
+    mind (list): The mind to query.
+    claim (tuple): The claim to contradict.
+    **options: Passed to find_derivation.
+
+  Returns:
+    The claim trace of the contradicting claim, as returned by find_derivation, or None if none was found.
+  """
+  return find_derivation(mind, (not claim[0], claim[1]), **options)
@@ -0,0 +1,289 @@
+"""This file contains an asyncio-based scheduler for running many independent minds concurrently. Each mind is run by its own cooperative task, which repeatedly performs a cycle of three phases:
+-"generate" runs a randomly chosen theory on the mind's claims, and adds the outputs to the mind
+-"conjecture" varies a randomly chosen theory, and adds the new theory to the mind
+-"extract" tries to extract a new routine from the mind's programs; this phase only runs every "extract_interval" cycles, since it is the most expensive
+
+The CPU-heavy part of each phase (running the theory, varying it, or searching for a routine) is done in an executor, while the results are applied to the mind on the event loop. The task yields to the other tasks after every phase, so minds are time-sliced fairly. Each mind can be given a step budget, which is the number of cycles it runs before its task finishes.
+
+The number of phases waiting on the executor at once is limited by a semaphore, which provides backpressure: when the executor is saturated, tasks wait for a free slot, in the order they asked for one, instead of piling work onto the executor's queue. By default the event loop's thread pool is used, which needs no copying; a concurrent.futures.ProcessPoolExecutor can be passed instead to run phases in parallel, at the cost of pickling the mind's programs and claims for every phase. The "generate" phase runs its theory in the same way as minds.generate_claims, so it uses the mind's profile, claim index, and superinstructions, and records its metrics, except that a process pool can't use the profile, claim index, or superinstructions of the mind's process.
+
+Individual minds can be paused, resumed, and checkpointed. Every phase is run while holding the mind's lock, so a checkpoint always sees the mind between phases.
+
+A scheduler is a dictionary with the following keys:
+-"minds" maps the name of each mind to its entry
+-"executor" is the executor used for CPU-heavy work, or None for the event loop's default executor
+-"semaphore" is the semaphore that limits the number of phases waiting on the executor
+
+Each entry is a dictionary with the following keys:
+-"mind" is the mind
+-"step_budget" is the number of cycles to run, or -1 to run until the mind is removed
+-"steps" is the number of cycles completed so far
+-"max_outputs", "conjecture_steps", "extract_interval", "batch_size", "sampling", "max_stack_depth", and "max_claim_ints" are the options given to add_mind
+-"state" is "running", "paused", "finished", "failed", or "removed"
+-"error" is the exception that stopped the mind if its state is "failed", and None otherwise
+-"running" is an asyncio.Event that is set while the mind is not paused
+-"lock" is an asyncio.Lock that is held while a phase is running
+-"task" is the mind's asyncio task
+
+Example:
+  async def main():
+    s=scheduler.new_scheduler(max_pending=4)
+    for i in range(10):
+      scheduler.add_mind(s, "mind "+str(i), minds.new_mind(theories=[examples.INCREMENT_THEORY]), step_budget=100)
+    await scheduler.wait_for_minds(s)
+  asyncio.run(main())
+"""
+
+import asyncio
+import concurrent.futures
+import os
+import language
+import extract
+import conjecture
+import minds
+import journal
+import snapshots
+from numpy.random import random
+
+def new_scheduler(executor=None, max_pending=None):
+  """Creates a new scheduler with no minds.
+
+  Args:
+    executor (concurrent.futures.Executor): Defaults to None. The executor to run CPU-heavy work in. If this is None, the event loop's default executor is used.
+    max_pending (int): Defaults to None. The maximum number of phases that can be waiting on the executor at once. If this is None, it is the number of CPUs.
+
+  Returns:
+    The new scheduler, as a dictionary.
+  """
+  return {
+    "minds": {},
+    "executor": executor,
+    "semaphore": asyncio.Semaphore(max_pending if max_pending is not None else (os.cpu_count() or 1))
+  }
+
+def generate_outputs(generation, theories, routines, max_outputs):
+  """Runs the theory of a generation, as created by minds.new_generation, and returns its outputs as a list. This is the work done in the executor by the "generate" phase.
+
+  Returns:
+    A tuple (outputs, limits, memory), where "limits" and "memory" are the limits and memory counters of the generation's execution context, as described in language.new_execution_context. When the executor is a process pool, the generation is a copy, so these are returned to read the status of the execution. The rest of the context isn't returned, since its handlers can't be pickled.
+  """
+  outputs=list(minds.iterate_generation(generation, theories, routines, max_outputs))
+  return (outputs, generation["context"][2], generation["context"][5])
+
+def extract_routine(theories, routines):
+  """Tries to extract a new routine from a set of programs, as in minds.extract_new_routines. This is the work done in the executor by the "extract" phase."""
+  return extract.extract_new_routine(theories, routines, language.instruction_functions.index(language.instruction_exec), language.is_program_valid)
+
+async def run_in_executor(scheduler, function, *args):
+  """Runs a function in the scheduler's executor, after waiting for a free slot in the semaphore.
+
+  Args:
+    scheduler (dict): The scheduler.
+    function (function): The function to run. It must be picklable if the executor is a process pool.
+    *args: The arguments to pass to the function.
+
+  Returns:
+    The function's return value.
+  """
+  async with scheduler["semaphore"]:
+    return await asyncio.get_running_loop().run_in_executor(scheduler["executor"], function, *args)
+
+async def generate_phase(scheduler, entry):
+  """Runs the "generate" phase of a mind's cycle."""
+  mind=entry["mind"]
+  if len(mind[0])==0:
+    return
+  generation=minds.new_generation(mind, batch_size=entry["batch_size"], sampling=entry["sampling"], max_stack_depth=entry["max_stack_depth"], max_claim_ints=entry["max_claim_ints"])
+  if isinstance(scheduler["executor"], concurrent.futures.ProcessPoolExecutor):
+    # Profiles, claim indeces, and superinstructions belong to the mind's process, so they can't be used by a theory run in another process.
+    generation["options"]=(None,)+generation["options"][1:]
+    generation["claim_index"]=None
+    generation["superinstructions"]=None
+  outputs, limits, memory=await run_in_executor(scheduler, generate_outputs, generation, mind[0], mind[1], entry["max_outputs"])
+  if generation["context"] is None:
+    # The theory ran in another process, on a copy of the generation, so its context is rebuilt here from the limits and memory counters it ended with.
+    generation["context"]=language.new_execution_context(*generation["options"])
+    if limits is not None:
+      generation["context"][2][:]=limits
+    if memory is not None:
+      generation["context"][5][:]=memory
+  for output in outputs:
+    minds.add_generated_claim(mind, generation, output)
+  minds.finish_generation(mind, generation)
+
+async def conjecture_phase(scheduler, entry):
+  """Runs the "conjecture" phase of a mind's cycle."""
+  mind=entry["mind"]
+  if len(mind[0])==0:
+    return
+  theory=await run_in_executor(scheduler, conjecture.vary, mind[0], int(random()*len(mind[0])), mind[1], entry["conjecture_steps"])
+  minds.add_theory(mind, theory)
+
+async def extract_phase(scheduler, entry):
+  """Runs the "extract" phase of a mind's cycle, if it is due."""
+  mind=entry["mind"]
+  if entry["extract_interval"]==-1 or entry["steps"]%entry["extract_interval"]!=entry["extract_interval"]-1:
+    return
+  output=await run_in_executor(scheduler, extract_routine, mind[0], mind[1])
+  if output!=False:
+    mind[0]=output[0]
+    mind[1]=output[1]
+    minds.programs_changed(mind)
+
+'''PHASES lists the phases of a mind's cycle, in the order they are run.'''
+PHASES=[generate_phase, conjecture_phase, extract_phase]
+
+async def run_mind(scheduler, entry):
+  """The body of a mind's task. Runs cycles until the mind's step budget is used up, waiting while the mind is paused and yielding to other tasks after every phase."""
+  try:
+    while entry["step_budget"]==-1 or entry["steps"]<entry["step_budget"]:
+      for phase in PHASES:
+        await entry["running"].wait()
+        async with entry["lock"]:
+          await phase(scheduler, entry)
+        await asyncio.sleep(0)
+      entry["steps"]+=1
+    entry["state"]="finished"
+  except asyncio.CancelledError:
+    entry["state"]="removed"
+    raise
+  except Exception as e:
+    entry["state"]="failed"
+    entry["error"]=e
+
+def add_mind(scheduler, name, mind, step_budget=-1, max_outputs=-1, conjecture_steps=1, extract_interval=10, batch_size=-1, sampling="uniform", max_stack_depth=None, max_claim_ints=None):
+  """Adds a mind to a scheduler, and starts its task. Must be called while the event loop is running.
+
+  Args:
+    scheduler (dict): The scheduler.
+    name (str): A name for the mind, which is used to refer to it in the other functions of the scheduler. It must not already be in use.
+    mind (list): The mind to run.
+    step_budget (int): Defaults to -1. The number of cycles to run before the mind's task finishes. If this is -1, the mind runs until it is removed.
+    max_outputs (int): Defaults to -1. If this is not -1, the "generate" phase stops once the theory has produced this many claims.
+    conjecture_steps (int): Defaults to 1. The number of steps of variation used by the "conjecture" phase, as in conjecture.vary.
+    extract_interval (int): Defaults to 10. The "extract" phase is run once every this many cycles. If this is -1, it is never run.
+    batch_size (int): Defaults to -1. If this is not -1, the "generate" phase runs the theory on a minibatch of at most this many claims, as in minds.generate_claims.
+    sampling: Defaults to "uniform". The method used to sample minibatches, as in minds.get_input_set.
+    max_stack_depth (int): Defaults to None. If this is not None, it limits the depth of the stacks in the "generate" phase, as in language.new_execution_context.
+    max_claim_ints (int): Defaults to None. If this is not None, it limits the number of claim integers the "generate" phase can allocate, as in language.new_execution_context.
+
+  Returns:
+    The mind's entry, as a dictionary.
+  """
+  if name in scheduler["minds"]:
+    raise ValueError("a mind named "+repr(name)+" is already scheduled")
+  entry={
+    "mind": mind,
+    "step_budget": step_budget,
+    "steps": 0,
+    "max_outputs": max_outputs,
+    "conjecture_steps": conjecture_steps,
+    "extract_interval": extract_interval,
+    "batch_size": batch_size,
+    "sampling": sampling,
+    "max_stack_depth": max_stack_depth,
+    "max_claim_ints": max_claim_ints,
+    "state": "running",
+    "error": None,
+    "running": asyncio.Event(),
+    "lock": asyncio.Lock(),
+    "task": None
+  }
+  entry["running"].set()
+  entry["task"]=asyncio.get_running_loop().create_task(run_mind(scheduler, entry))
+  scheduler["minds"][name]=entry
+  return entry
+
+def pause_mind(scheduler, name):
+  """Pauses a mind. The phase that is currently running, if any, is finished first.
+
+  Args:
+    scheduler (dict): The scheduler.
+    name (str): The name of the mind.
+  """
+  entry=scheduler["minds"][name]
+  entry["running"].clear()
+  if entry["state"]=="running":
+    entry["state"]="paused"
+
+def resume_mind(scheduler, name):
+  """Resumes a paused mind.
+
+  Args:
+    scheduler (dict): The scheduler.
+    name (str): The name of the mind.
+  """
+  entry=scheduler["minds"][name]
+  entry["running"].set()
+  if entry["state"]=="paused":
+    entry["state"]="running"
+
+async def checkpoint_mind(scheduler, name, path=None):
+  """Checkpoints a mind between two of its phases. The mind's other work waits until the checkpoint is written.
+
+  Args:
+    scheduler (dict): The scheduler.
+    name (str): The name of the mind.
+    path (str): Defaults to None. The path to save a snapshot of the mind to, with snapshots.save_snapshot. If this is None, the mind must be journaled, and a new checkpoint of its journal is taken with journal.checkpoint.
+  """
+  entry=scheduler["minds"][name]
+  async with entry["lock"]:
+    if path is not None:
+      await asyncio.get_running_loop().run_in_executor(None, snapshots.save_snapshot, entry["mind"], path)
+    else:
+      journal.checkpoint(entry["mind"])
+
+async def remove_mind(scheduler, name):
+  """Stops a mind's task and removes the mind from the scheduler. The phase that is currently running, if any, is abandoned, so results it hasn't applied yet are lost.
+
+  Args:
+    scheduler (dict): The scheduler.
+    name (str): The name of the mind.
+
+  Returns:
+    The removed mind.
+  """
+  entry=scheduler["minds"].pop(name)
+  entry["task"].cancel()
+  try:
+    await entry["task"]
+  except asyncio.CancelledError:
+    pass
+  return entry["mind"]
+
+async def wait_for_minds(scheduler):
+  """Waits until every mind in the scheduler has finished, failed, or been removed. Minds without a step budget never finish, so they must be removed for this to return.
+
+  Args:
+    scheduler (dict): The scheduler.
+
+  Returns:
+    A dictionary mapping the name of each mind to its status, as returned by get_status.
+  """
+  await asyncio.gather(*[entry["task"] for entry in scheduler["minds"].values()], return_exceptions=True)
+  return get_status(scheduler)
+
+def get_status(scheduler):
+  """Returns a dictionary mapping the name of each mind in the scheduler to a dictionary with the keys "state", "steps", "step_budget", and "error", as described at the top of this file."""
+  return {name: {"state": entry["state"], "steps": entry["steps"], "step_budget": entry["step_budget"], "error": entry["error"]} for name, entry in scheduler["minds"].items()}
+
+def run_minds(named_minds, executor=None, max_pending=None, **options):
+  """Runs a set of minds concurrently until each of them has used up its step budget. This starts and stops its own event loop, so it can be called from code that doesn't use asyncio.
+
+  Args:
+    named_minds (dict): Maps a name for each mind to the mind.
+    executor (concurrent.futures.Executor): Defaults to None. As in new_scheduler.
+    max_pending (int): Defaults to None. As in new_scheduler.
+    **options: Passed to add_mind for every mind. "step_budget" must be given, and must not be -1.
+
+  Returns:
+    A dictionary mapping the name of each mind to its status, as returned by get_status.
+  """
+  if options.get("step_budget", -1)==-1:
+    raise ValueError("run_minds needs a step budget")
+  async def run():
+    scheduler=new_scheduler(executor, max_pending)
+    for name, mind in named_minds.items():
+      add_mind(scheduler, name, mind, **options)
+    return await wait_for_minds(scheduler)
+  return asyncio.run(run())
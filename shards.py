@@ -0,0 +1,377 @@
+"""This file contains functions for running a sharded mind, whose claims are spread across several worker processes. This lets a mind grow past the memory of a single process, and splits the contradiction scan done when a claim is added between the processes.
+
+Claims are partitioned by the hash of their int list, which is the same hash that minds.add_claim uses to place claims in its hash table. Since claims can only contradict or duplicate claims with the same int list, every contradiction and duplicate is found within a single shard, so shards never need to talk to each other. Each shard keeps its own hash table, indexed by the part of the hash that isn't used to choose the shard.
+
+The coordinator, which is the process that calls these functions, holds the theories and routines, and sends new claims to the shards through ring buffers in shared memory (multiprocessing.shared_memory), one per shard. A ring buffer is an array of 64-bit integers: the first integer is the total number of integers ever written, the second is the total number ever read, and the rest hold the messages. Each message is a claim and its record, encoded as [message length, bool, int count, ints..., theory index, touched count, touched ids...]. When a ring is full, the coordinator waits for the shard to catch up, so a slow shard applies backpressure instead of growing an unbounded queue. Commands that need a reply, like taking a snapshot, are sent through a pipe.
+
+Claims in a sharded mind are identified by global ids rather than by indices. The claim at index i within shard s has the global id i*shard_count+s, and the touched inputs in records are global ids. Problems are stored in each shard as pairs of global ids, and are turned into traces when the shards are gathered into a regular mind.
+
+To read the mind, the coordinator asks every shard to save a snapshot of its claims with snapshots.save_snapshot. Each shard first reads every message that was written to its ring before the request, so the snapshots together form a consistent cut of the mind. Generation workers can open the snapshots, with snapshots.open_snapshot or load_sharded_snapshots, while the shards continue to receive new claims, because snapshots are replaced atomically.
+
+A sharded mind is a dictionary with the following keys:
+-"theories" and "routines" are the mind's programs
+-"shard_count" is the number of shards
+-"directory" is the directory that shard snapshots are written to
+-"rings" is a list of the SharedMemory objects used as each shard's ring buffer
+-"views" is a list of memoryviews of integers over the rings
+-"connections" is a list of the coordinator's ends of the pipes to each shard
+-"processes" is a list of the shard processes
+"""
+
+import bisect
+import multiprocessing
+import os
+import tempfile
+import time
+from array import array
+from multiprocessing import shared_memory
+import language
+import minds
+import snapshots
+from numpy.random import random
+
+'''RING_POLL_SECONDS is how long the coordinator sleeps while waiting for space in a full ring, and how long a shard waits for a command when its ring is empty.'''
+RING_POLL_SECONDS=0.001
+
+def get_shard(claim, shard_count):
+  """Returns the index of the shard that a claim belongs to."""
+  return hash(tuple(claim[1]))%shard_count
+
+def get_global_id(shard, index, shard_count):
+  """Returns the global id of the claim at an index within a shard."""
+  return index*shard_count+shard
+
+def encode_message(claim, record):
+  """Encodes a claim and its record as a message for a ring buffer, as described at the top of this file."""
+  words=array('q',[0, 1 if claim[0] else 0, len(claim[1])])
+  words.extend(claim[1])
+  words.append(record[0])
+  words.append(len(record[1]))
+  words.extend(record[1])
+  words[0]=len(words)
+  return words
+
+def decode_message(words):
+  """Decodes a message from a ring buffer into a tuple (claim, record)."""
+  int_count=words[2]
+  touched_count=words[4+int_count]
+  return ((words[1]!=0, list(words[3:3+int_count])), (words[3+int_count], list(words[5+int_count:5+int_count+touched_count])))
+
+def write_ring(view, words):
+  """Writes a message to a ring buffer, waiting until the ring has enough free space.
+
+  Args:
+    view (memoryview): A memoryview of integers over the ring buffer.
+    words (array): The message to write.
+  """
+  capacity=len(view)-2
+  if len(words)>capacity:
+    raise ValueError("a message of "+str(len(words))+" integers does not fit in a ring buffer of "+str(capacity)+" integers")
+  while capacity-(view[0]-view[1])<len(words):
+    time.sleep(RING_POLL_SECONDS)
+  head=view[0]
+  start=head%capacity
+  first=min(len(words), capacity-start)
+  view[2+start:2+start+first]=words[:first]
+  if first<len(words):
+    view[2:2+len(words)-first]=words[first:]
+  view[0]=head+len(words)
+
+def read_ring(view):
+  """Reads every complete message that has been written to a ring buffer and not yet read.
+
+  Args:
+    view (memoryview): A memoryview of integers over the ring buffer.
+
+  Returns:
+    A list of messages, each as a list of integers.
+  """
+  capacity=len(view)-2
+  head=view[0]
+  tail=view[1]
+  messages=[]
+  while tail<head:
+    start=tail%capacity
+    length=view[2+start]
+    first=min(length, capacity-start)
+    words=view[2+start:2+start+first].tolist()
+    if first<length:
+      words+=view[2:2+length-first].tolist()
+    messages.append(words)
+    tail+=length
+  view[1]=tail
+  return messages
+
+def add_shard_claim(shard_mind, shard, shard_count, claim, record):
+  """Adds a claim to a shard, as in minds.add_claim, except that contradictions are recorded as pairs of global ids.
+
+  Args:
+    shard_mind (list): The shard's claims, in the form of a mind.
+    shard (int): The index of the shard.
+    shard_count (int): The number of shards.
+    claim (tuple): The claim to add.
+    record (tuple): The claim's record, whose touched inputs are global ids.
+  """
+  claim_index=len(shard_mind[2])
+  h=(hash(tuple(claim[1]))//shard_count)%len(shard_mind[4])
+  problem_indeces=[]
+  for old_claim_index in shard_mind[4][h]:
+    claim2=shard_mind[2][old_claim_index]
+    if claim[1]==claim2[1]:
+      if claim[0]==claim2[0]:
+        if record==shard_mind[3][old_claim_index]:
+          return
+      else:
+        problem_indeces.append(old_claim_index)
+  shard_mind[2].append(claim)
+  shard_mind[3].append(record)
+  shard_mind[4][h].append(claim_index)
+  for old_claim_index in problem_indeces:
+    shard_mind[5].append((get_global_id(shard, claim_index, shard_count), get_global_id(shard, old_claim_index, shard_count)))
+
+def run_shard(shard, shard_count, ring_name, connection, hash_table_size):
+  """The main function of a shard process. Adds the claims that arrive through the shard's ring buffer, and answers commands from the coordinator, until it is told to stop.
+
+  Args:
+    shard (int): The index of the shard.
+    shard_count (int): The number of shards.
+    ring_name (str): The name of the shard's ring buffer in shared memory.
+    connection (multiprocessing.connection.Connection): The shard's end of the pipe to the coordinator.
+    hash_table_size (int): The size of the shard's hash table.
+  """
+  ring=shared_memory.SharedMemory(name=ring_name)
+  view=ring.buf.cast('q')
+  shard_mind=minds.new_mind(hash_table_size=hash_table_size)
+
+  def drain(position):
+    # Add every claim that has been written to the ring, up to at least "position".
+    while True:
+      for words in read_ring(view):
+        claim, record=decode_message(words)
+        add_shard_claim(shard_mind, shard, shard_count, claim, record)
+      if view[1]>=position:
+        return
+
+  try:
+    while True:
+      drain(0)
+      if not connection.poll(RING_POLL_SECONDS):
+        continue
+      command=connection.recv()
+      drain(command[1])
+      if command[0]=="snapshot":
+        snapshots.save_snapshot(shard_mind, command[2])
+        connection.send((len(shard_mind[2]), len(shard_mind[5])))
+      elif command[0]=="stop":
+        connection.send((len(shard_mind[2]), len(shard_mind[5])))
+        break
+  finally:
+    view.release()
+    ring.close()
+
+def start_sharded_mind(theories=[], routines=[], claims=[], shard_count=4, ring_capacity=1<<20, hash_table_size=1000, directory=None):
+  """Starts a sharded mind, with one worker process for each shard.
+
+  Args:
+    theories (list): Defaults to an empty list. The theories that the mind will start off with.
+    routines (list): Defaults to an empty list. The routines that the mind will start off with.
+    claims (list): Defaults to an empty list. The claims that the mind will start off with.
+    shard_count (int): Defaults to 4. The number of shards.
+    ring_capacity (int): Defaults to 1<<20. The number of integers that each shard's ring buffer can hold.
+    hash_table_size (int): Defaults to 1000. The size of each shard's hash table, as in minds.new_mind.
+    directory (str): Defaults to None. The directory to write shard snapshots to. If this is None, a new temporary directory is used.
+
+  Returns:
+    The sharded mind, as a dictionary.
+  """
+  sharded={
+    "theories": list(theories),
+    "routines": list(routines),
+    "shard_count": shard_count,
+    "directory": directory if directory is not None else tempfile.mkdtemp(prefix="ctp-shards-"),
+    "rings": [],
+    "views": [],
+    "connections": [],
+    "processes": []
+  }
+  os.makedirs(sharded["directory"], exist_ok=True)
+  for shard in range(shard_count):
+    ring=shared_memory.SharedMemory(create=True, size=8*(2+ring_capacity))
+    view=ring.buf.cast('q')
+    view[0]=0
+    view[1]=0
+    connection, shard_connection=multiprocessing.Pipe()
+    process=multiprocessing.Process(target=run_shard, args=(shard, shard_count, ring.name, shard_connection, hash_table_size), daemon=True)
+    process.start()
+    sharded["rings"].append(ring)
+    sharded["views"].append(view)
+    sharded["connections"].append(connection)
+    sharded["processes"].append(process)
+  for claim in claims:
+    submit_claim(sharded, claim, (-1, []))
+  return sharded
+
+def submit_claim(sharded, claim, record):
+  """Sends a claim to the shard it belongs to. The claim is added by the shard asynchronously; duplicates are discarded and contradictions are recorded as problems, as in minds.add_claim.
+
+  Args:
+    sharded (dict): The sharded mind.
+    claim (tuple): The claim to add. Its ints must fit in 64 bits.
+    record (tuple): The claim's record, whose touched inputs are global ids.
+  """
+  write_ring(sharded["views"][get_shard(claim, sharded["shard_count"])], encode_message(claim, record))
+
+def send_command(sharded, command, *args):
+  """Sends a command to every shard and waits for their replies. Each shard reads every claim submitted before the command before carrying it out.
+
+  Args:
+    sharded (dict): The sharded mind.
+    command (str): The name of the command.
+    *args: Functions that take the index of a shard and return an extra argument to send to it.
+
+  Returns:
+    A list of the replies from each shard.
+  """
+  for shard in range(sharded["shard_count"]):
+    sharded["connections"][shard].send((command, sharded["views"][shard][0])+tuple(arg(shard) for arg in args))
+  return [connection.recv() for connection in sharded["connections"]]
+
+def shard_snapshot_path(sharded, shard):
+  """Returns the path that a shard's snapshot is written to."""
+  return os.path.join(sharded["directory"], "shard-"+str(shard)+".snap")
+
+def sync_shards(sharded):
+  """Asks every shard to save a snapshot of its claims, once it has read every claim submitted so far. Together, the snapshots form a consistent cut of the mind.
+
+  Args:
+    sharded (dict): The sharded mind.
+
+  Returns:
+    A tuple (paths, counts), where "paths" is a list of the paths of each shard's snapshot, and "counts" is a list of tuples (claim_count, problem_count) for each shard.
+  """
+  counts=send_command(sharded, "snapshot", lambda shard: shard_snapshot_path(sharded, shard))
+  return ([shard_snapshot_path(sharded, shard) for shard in range(sharded["shard_count"])], counts)
+
+def load_sharded_snapshots(paths, theories=[], routines=[], hash_table_size=1000):
+  """Gathers the snapshots of every shard into a regular mind. Claims are ordered by their global ids, and problems are turned into traces. This can be called by any process that can read the snapshots.
+
+  Args:
+    paths (list): The paths of the snapshots of each shard, in order, as returned by sync_shards.
+    theories (list): Defaults to an empty list. The theories of the gathered mind.
+    routines (list): Defaults to an empty list. The routines of the gathered mind.
+    hash_table_size (int): Defaults to 1000. The size of the gathered mind's hash table.
+
+  Returns:
+    A tuple (mind, global_ids), where "global_ids" is a list of the global id of each claim in the mind.
+  """
+  parts=[snapshots.open_snapshot(path) for path in paths]
+  shard_count=len(parts)
+  global_ids=[]
+  claims=[]
+  records=[]
+  for i in range(max([len(part[2]) for part in parts]+[0])):
+    for shard in range(shard_count):
+      if i<len(parts[shard][2]):
+        global_ids.append(get_global_id(shard, i, shard_count))
+        claims.append(parts[shard][2][i])
+        records.append(parts[shard][3][i])
+  indeces={global_id: i for i, global_id in enumerate(global_ids)}
+
+  mind=minds.new_mind(theories, routines, hash_table_size=hash_table_size)
+  mind[2]=claims
+  mind[3]=[(record[0], [indeces[global_id] for global_id in record[1]]) for record in records]
+  for i in range(len(claims)):
+    mind[4][hash(tuple(claims[i][1]))%len(mind[4])].append(i)
+  for part in parts:
+    for problem in part[5]:
+      mind[5].append((minds.get_claim_trace(mind, indeces[problem[0]]), minds.get_claim_trace(mind, indeces[problem[1]])))
+  return (mind, global_ids)
+
+def open_sharded_claims(paths):
+  """Opens the claims in the snapshots of every shard as a single sequence, ordered by their global ids as in load_sharded_snapshots, without loading the rest of the snapshots. The snapshots are memory-mapped with snapshots.open_snapshot, so each claim is only decoded when it is read, and the records, hash tables, and problems are never read.
+
+  Args:
+    paths (list): The paths of the snapshots of each shard, in order, as returned by sync_shards.
+
+  Returns:
+    A tuple (claims, global_ids) of two snapshots.LazySequence objects, where global_ids[i] is the global id of claims[i].
+  """
+  parts=[snapshots.open_snapshot(path)[2] for path in paths]
+  shard_count=len(parts)
+  # Ordered by global id, the claims are taken from the shards in turns, one claim from each shard that still has claims left. The shards that have claims left only change when a shard runs out, so the sequence is split into segments, each of which takes claims in turns from a fixed list of shards.
+  segment_starts=[]
+  segments=[]
+  position=0
+  level=0
+  for length in sorted(set(len(part) for part in parts)):
+    shards=[shard for shard in range(shard_count) if len(parts[shard])>level]
+    if length>level and len(shards)>0:
+      segment_starts.append(position)
+      segments.append((level, shards))
+      position+=(length-level)*len(shards)
+    level=length
+
+  def locate(i):
+    segment=bisect.bisect_right(segment_starts, i)-1
+    level, shards=segments[segment]
+    offset=i-segment_starts[segment]
+    return (shards[offset%len(shards)], level+offset//len(shards))
+
+  def decode_claim(i):
+    shard, index=locate(i)
+    return parts[shard][index]
+
+  def decode_global_id(i):
+    shard, index=locate(i)
+    return get_global_id(shard, index, shard_count)
+
+  return (snapshots.LazySequence(position, decode_claim), snapshots.LazySequence(position, decode_global_id))
+
+def gather_mind(sharded, hash_table_size=1000):
+  """Gathers a consistent snapshot of every shard into a regular mind, as in load_sharded_snapshots. This decodes every shard and traces every problem, so it is only meant for explicit full merges; generate_claims only reads the claims it needs.
+
+  Args:
+    sharded (dict): The sharded mind.
+    hash_table_size (int): Defaults to 1000. The size of the gathered mind's hash table.
+
+  Returns:
+    A tuple (mind, global_ids), as in load_sharded_snapshots.
+  """
+  paths, counts=sync_shards(sharded)
+  return load_sharded_snapshots(paths, sharded["theories"], sharded["routines"], hash_table_size)
+
+def generate_claims(sharded, max_outputs=-1):
+  """Randomly chooses a theory, runs it on a consistent snapshot of every shard's claims, and submits the outputs to the shards, as in minds.generate_claims. The claims are read lazily from the shards' snapshots with open_sharded_claims, so the rest of the mind is never gathered.
+
+  Args:
+    sharded (dict): The sharded mind. It must contain at least one theory.
+    max_outputs (int): Defaults to -1. If this is not -1, execution of the theory stops once this many claims have been produced.
+  """
+  paths, counts=sync_shards(sharded)
+  claims, global_ids=open_sharded_claims(paths)
+  chosen_theory_index=int(random()*len(sharded["theories"]))
+  for touched_claim_indeces, claim in language.iterate_theory(chosen_theory_index, sharded["theories"], sharded["routines"], claims, max_outputs=max_outputs):
+    submit_claim(sharded, claim, (chosen_theory_index, [global_ids[i] for i in touched_claim_indeces]))
+
+def stop_sharded_mind(sharded):
+  """Waits for every shard to read the claims submitted so far, stops the shard processes, and frees the ring buffers. The shards' last snapshots are kept in the sharded mind's directory.
+
+  Args:
+    sharded (dict): The sharded mind.
+
+  Returns:
+    A list of tuples (claim_count, problem_count) for each shard.
+  """
+  counts=send_command(sharded, "stop")
+  for process in sharded["processes"]:
+    process.join()
+  for connection in sharded["connections"]:
+    connection.close()
+  for view in sharded["views"]:
+    view.release()
+  for ring in sharded["rings"]:
+    ring.close()
+    ring.unlink()
+  sharded["views"]=[]
+  sharded["rings"]=[]
+  return counts
@@ -0,0 +1,323 @@
+"""This file contains functions for saving minds to, and loading minds from, a binary snapshot format. Unlike pickling, a snapshot can be opened by memory-mapping the file, so even a very large mind opens almost instantly, and each claim, record, or problem is only read from the file when it is used.
+
+A snapshot file starts with a header, followed by a series of sections. The header is made up of 64-bit integers:
+-the first 8 bytes are SNAPSHOT_MAGIC
+-the next integer is the format version, which is SNAPSHOT_VERSION for files written by this version of the code
+-the next integer is the number of sections
+-then, for each section, there are three integers: the size in bytes of each item in the section, the offset in bytes of the section from the start of the file, and the number of items in the section
+
+Each section is a flat array of integers, starting at an offset that is a multiple of 8. The sections, in order, are listed in SECTION_NAMES. Variable-length elements, like programs or claim int-lists, are stored as a flat section of values along with a section of offsets, such that the values for element i lie between offsets i and i+1.
+
+The tombstone of an evicted claim, which is None in the mind, is stored as a claim with a boolean of -1 and no integers.
+
+Programs are stored as a stream of integers, where each instruction is stored as its length followed by the integers of the instruction. Claim traces are stored in prefix order: a claim index is stored as itself (it is always non-negative), and a tuple is stored as the negation of its length followed by its elements. Each problem is stored as its two traces, one after the other.
+
+All integers must fit in 64 bits; saving a mind containing a larger integer will raise an OverflowError. The extensions of a mind are not saved, so minds loaded from snapshots start with no extensions.
+"""
+
+import mmap
+import os
+from array import array
+
+'''SNAPSHOT_MAGIC is the sequence of bytes that every snapshot file starts with.'''
+SNAPSHOT_MAGIC=b"CTPMIND\0"
+
+'''SNAPSHOT_VERSION is the version of the snapshot format. It should be incremented whenever the format changes.'''
+SNAPSHOT_VERSION=1
+
+'''SECTION_NAMES lists the names of the sections of a snapshot, in the order they appear in the file. The "claim_bools" section has 1 byte per item, and all other sections have 8 bytes per item.'''
+SECTION_NAMES=[
+  "theory_offsets",
+  "theory_code",
+  "routine_offsets",
+  "routine_code",
+  "claim_bools",
+  "claim_offsets",
+  "claim_ints",
+  "record_theories",
+  "record_offsets",
+  "record_inputs",
+  "hash_table_offsets",
+  "hash_table_claims",
+  "problem_offsets",
+  "problem_code"
+]
+
+class LazySequence:
+  """A read-only sequence whose elements are decoded from a snapshot only when they are accessed. Supports len(), indexing (including negative indeces and slices), and iteration, so it can be used in place of a list by code that only reads from a mind.
+
+  Args:
+    length (int): The number of elements in the sequence.
+    decode (function): A function that takes a non-negative index and returns the element at that index.
+  """
+  def __init__(self, length, decode):
+    self.length=length
+    self.decode=decode
+
+  def __len__(self):
+    return self.length
+
+  def __getitem__(self, index):
+    if isinstance(index, slice):
+      return [self.decode(i) for i in range(*index.indices(self.length))]
+    if index<0:
+      index+=self.length
+    if index<0 or index>=self.length:
+      raise IndexError("snapshot sequence index out of range")
+    return self.decode(index)
+
+  def __iter__(self):
+    for i in range(self.length):
+      yield self.decode(i)
+
+def encode_programs(programs):
+  """Encodes a list of programs as an offsets array and a code array.
+
+  Args:
+    programs (list): A list of programs.
+
+  Returns:
+    A tuple (offsets, code) of arrays of 64-bit integers.
+  """
+  offsets=array('q',[0])
+  code=array('q')
+  for program in programs:
+    for instruction in program:
+      code.append(len(instruction))
+      code.extend(instruction)
+    offsets.append(len(code))
+  return (offsets, code)
+
+def decode_program(code, start, end):
+  """Decodes a program that was encoded with encode_programs.
+
+  Args:
+    code (sequence): The code array of the encoded programs.
+    start (int): The position in "code" at which the program starts.
+    end (int): The position in "code" at which the program ends.
+
+  Returns:
+    The program, as a list of tuples of integers.
+  """
+  program=[]
+  position=start
+  while position<end:
+    length=code[position]
+    program.append(tuple(code[position+1:position+1+length]))
+    position+=1+length
+  return program
+
+def encode_trace(trace, code):
+  """Appends the encoding of a claim trace to an array.
+
+  Args:
+    trace: A claim trace, as returned by minds.get_claim_trace.
+    code (array): The array to append the encoded trace to.
+  """
+  if isinstance(trace, tuple):
+    code.append(-len(trace))
+    code.append(trace[0])
+    for subtrace in trace[1:]:
+      encode_trace(subtrace, code)
+  else:
+    code.append(trace)
+
+def decode_trace(code, position):
+  """Decodes a claim trace that was encoded with encode_trace.
+
+  Args:
+    code (sequence): The array containing the encoded trace.
+    position (int): The position in "code" at which the trace starts.
+
+  Returns:
+    A tuple (trace, position), where "trace" is the decoded trace and "position" is the position in "code" just after the end of the trace.
+  """
+  value=code[position]
+  if value>=0:
+    return (value, position+1)
+  elements=[code[position+1]]
+  position+=2
+  for i in range(-value-1):
+    subtrace, position=decode_trace(code, position)
+    elements.append(subtrace)
+  return (tuple(elements), position)
+
+def encode_mind(mind):
+  """Encodes each part of a mind as an array, in the order given by SECTION_NAMES.
+
+  Args:
+    mind (list): The mind to encode.
+
+  Returns:
+    A list of arrays, one for each section.
+  """
+  theory_offsets, theory_code=encode_programs(mind[0])
+  routine_offsets, routine_code=encode_programs(mind[1])
+
+  claim_bools=array('b')
+  claim_offsets=array('q',[0])
+  claim_ints=array('q')
+  for claim in mind[2]:
+    if claim is None:
+      claim_bools.append(-1)
+    else:
+      claim_bools.append(1 if claim[0] else 0)
+      claim_ints.extend(claim[1])
+    claim_offsets.append(len(claim_ints))
+
+  record_theories=array('q')
+  record_offsets=array('q',[0])
+  record_inputs=array('q')
+  for record in mind[3]:
+    record_theories.append(record[0])
+    record_inputs.extend(record[1])
+    record_offsets.append(len(record_inputs))
+
+  hash_table_offsets=array('q',[0])
+  hash_table_claims=array('q')
+  for bucket in mind[4]:
+    hash_table_claims.extend(bucket)
+    hash_table_offsets.append(len(hash_table_claims))
+
+  problem_offsets=array('q',[0])
+  problem_code=array('q')
+  for problem in mind[5]:
+    encode_trace(problem[0], problem_code)
+    encode_trace(problem[1], problem_code)
+    problem_offsets.append(len(problem_code))
+
+  return [
+    theory_offsets,
+    theory_code,
+    routine_offsets,
+    routine_code,
+    claim_bools,
+    claim_offsets,
+    claim_ints,
+    record_theories,
+    record_offsets,
+    record_inputs,
+    hash_table_offsets,
+    hash_table_claims,
+    problem_offsets,
+    problem_code
+  ]
+
+def save_snapshot(mind, path):
+  """Saves a mind to a snapshot file. The file is written to a temporary path first and then moved into place, so an existing snapshot at "path" is never left half-written. The file and its directory are synced to disk before this returns, so the snapshot survives a crash once this returns.
+
+  Args:
+    mind (list): The mind to save.
+    path (str): The path of the snapshot file.
+  """
+  sections=encode_mind(mind)
+  header_size=8+16+24*len(sections)
+  offsets=[]
+  offset=header_size
+  for section in sections:
+    offsets.append(offset)
+    offset+=-(-len(section)*section.itemsize//8)*8
+
+  header=array('q',[SNAPSHOT_VERSION, len(sections)])
+  for i in range(len(sections)):
+    header.extend([sections[i].itemsize, offsets[i], len(sections[i])])
+
+  temporary_path=path+".tmp"
+  with open(temporary_path, "wb") as f:
+    f.write(SNAPSHOT_MAGIC)
+    f.write(header.tobytes())
+    for i in range(len(sections)):
+      f.seek(offsets[i])
+      f.write(sections[i].tobytes())
+    f.truncate(offset)
+    f.flush()
+    os.fsync(f.fileno())
+  os.replace(temporary_path, path)
+  sync_directory(os.path.dirname(path))
+
+def sync_directory(path):
+  """Syncs a directory to disk, so that files that were created, renamed or deleted in it stay that way after a crash.
+
+  Args:
+    path (str): The path of the directory. If this is empty, the current directory is synced.
+  """
+  descriptor=os.open(path or ".", os.O_RDONLY)
+  try:
+    os.fsync(descriptor)
+  finally:
+    os.close(descriptor)
+
+def map_sections(path):
+  """Memory-maps a snapshot file and returns a view of each of its sections.
+
+  Args:
+    path (str): The path of the snapshot file.
+
+  Returns:
+    A dictionary mapping the name of each section to a memoryview of integers.
+  """
+  with open(path, "rb") as f:
+    mapped_file=mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+  view=memoryview(mapped_file)
+  if view[:8]!=SNAPSHOT_MAGIC:
+    raise ValueError(path+" is not a mind snapshot")
+  version, section_count=view[8:24].cast('q')
+  if version!=SNAPSHOT_VERSION:
+    raise ValueError(path+" has snapshot version "+str(version)+", but only version "+str(SNAPSHOT_VERSION)+" is supported")
+  table=view[24:24+24*section_count].cast('q')
+  sections={}
+  for i in range(section_count):
+    itemsize, offset, count=table[3*i:3*i+3]
+    sections[SECTION_NAMES[i]]=view[offset:offset+itemsize*count].cast('b' if itemsize==1 else 'q')
+  return sections
+
+def open_snapshot(path):
+  """Opens a snapshot file by memory-mapping it. Nothing is decoded up front: each theory, routine, claim, record, hash table location, and problem is decoded from the file when it is accessed. The parts of the returned mind are read-only, so the mind can be used to run theories, trace claims, and describe the mind, but not to add claims. Use load_snapshot to get a mind that can be modified.
+
+  Args:
+    path (str): The path of the snapshot file.
+
+  Returns:
+    A mind whose parts, other than its extensions, are LazySequence objects backed by the file.
+  """
+  s=map_sections(path)
+
+  def program_decoder(offsets, code):
+    return lambda i: decode_program(code, offsets[i], offsets[i+1])
+
+  def decode_claim(i):
+    if s["claim_bools"][i]==-1:
+      return None
+    return (s["claim_bools"][i]!=0, s["claim_ints"][s["claim_offsets"][i]:s["claim_offsets"][i+1]].tolist())
+
+  def decode_record(i):
+    return (s["record_theories"][i], s["record_inputs"][s["record_offsets"][i]:s["record_offsets"][i+1]].tolist())
+
+  def decode_bucket(i):
+    return s["hash_table_claims"][s["hash_table_offsets"][i]:s["hash_table_offsets"][i+1]].tolist()
+
+  def decode_problem(i):
+    trace_1, position=decode_trace(s["problem_code"], s["problem_offsets"][i])
+    trace_2, position=decode_trace(s["problem_code"], position)
+    return (trace_1, trace_2)
+
+  return [
+    LazySequence(len(s["theory_offsets"])-1, program_decoder(s["theory_offsets"], s["theory_code"])),
+    LazySequence(len(s["routine_offsets"])-1, program_decoder(s["routine_offsets"], s["routine_code"])),
+    LazySequence(len(s["claim_bools"]), decode_claim),
+    LazySequence(len(s["record_theories"]), decode_record),
+    LazySequence(len(s["hash_table_offsets"])-1, decode_bucket),
+    LazySequence(len(s["problem_offsets"])-1, decode_problem),
+    {}
+  ]
+
+def load_snapshot(path):
+  """Loads a snapshot file into a regular mind, made of python lists, that can be modified. The result is equal to the mind that was saved, except that it has no extensions.
+
+  Args:
+    path (str): The path of the snapshot file.
+
+  Returns:
+    The loaded mind.
+  """
+  return [list(part) for part in open_snapshot(path)[:6]]+[{}]
@@ -0,0 +1,149 @@
+"""This file contains functions for keeping a content-addressed store of programs. Each program is identified by a fingerprint, which is a hash of its instructions. Identical programs are interned, so that each distinct program is only stored once, along with some metadata about it. This makes it possible to tell whether a newly conjectured program has already been seen with a single hash lookup, rather than compiling, running and criticizing it again.
+
+A store is a dictionary that maps fingerprints to lists of entries. Different programs can have the same fingerprint, so each fingerprint maps to a list of entries, in the same way that the claim hash table in a mind maps each location to a list of claims.
+
+An entry is a list of length 4, [program, verdict, compiled, outcome]
+-program is the interned program, as a tuple of tuples of integers.
+-verdict is None if the program hasn't been analyzed yet, and otherwise is the bool returned by language.is_program_valid.
+-compiled is None if the program hasn't been compiled yet, and otherwise is the control map returned by language.get_control_map.
+-outcome is None if no outcome has been recorded for the program yet, and otherwise is the last value passed to record_outcome.
+"""
+
+import language
+
+'''FINGERPRINT_BASE and FINGERPRINT_MODULUS are the base and modulus of the polynomial rolling hash used to fingerprint programs. The modulus is the Mersenne prime 2^61-1.'''
+FINGERPRINT_BASE=1000003
+FINGERPRINT_MODULUS=2**61-1
+
+def normalize_program(program):
+  """Converts a program into the canonical form used by the store, a tuple of tuples of python integers. Programs produced by conjecture can contain numpy integers, which compare equal to python integers but are converted here so that equal programs always have equal normal forms.
+
+  Args:
+    program (list): The program to normalize.
+
+  Returns:
+    A tuple of tuples of integers, with one tuple for each instruction in the program.
+  """
+  return tuple(tuple(int(value) for value in instruction) for instruction in program)
+
+def program_fingerprint(program):
+  """Computes the fingerprint of a program, using a polynomial rolling hash over its instruction stream. The length of each instruction is included in the stream before the instruction itself, so that programs whose instructions are split differently get different fingerprints.
+
+  Args:
+    program (list): The program to fingerprint.
+
+  Returns:
+    A non-negative integer less than FINGERPRINT_MODULUS.
+  """
+  h=len(program)
+  for instruction in program:
+    h=(h*FINGERPRINT_BASE+len(instruction))%FINGERPRINT_MODULUS
+    for value in instruction:
+      h=(h*FINGERPRINT_BASE+int(value))%FINGERPRINT_MODULUS
+  return h
+
+def new_store(programs=[]):
+  """Creates a new store, which is empty by default, but can optionally be started with a set of programs.
+
+  Args:
+    programs (list): Defaults to an empty list. The programs that will be interned in the new store.
+
+  Returns:
+    The new store, as a dictionary.
+  """
+  program_store={}
+  for program in programs:
+    intern_program(program_store, program)
+  return program_store
+
+def find_program(program_store, program):
+  """Looks up the entry for a program in a store.
+
+  Args:
+    program_store (dict): The store to search.
+    program (list): The program to look up.
+
+  Returns:
+    The entry for the program, or None if the program has not been interned in the store.
+  """
+  normal_program=normalize_program(program)
+  for entry in program_store.get(program_fingerprint(normal_program), []):
+    if entry[0]==normal_program:
+      return entry
+  return None
+
+def intern_program(program_store, program):
+  """Adds a program to a store, unless an identical program is already present.
+
+  Args:
+    program_store (dict): The store to add the program to.
+    program (list): The program to intern.
+
+  Returns:
+    A tuple (entry, is_new)
+      entry (list): The entry for the program. The interned program can be found in the first element of the entry.
+      is_new (bool): True if the program was not present in the store before this call, and False otherwise.
+  """
+  normal_program=normalize_program(program)
+  bucket=program_store.setdefault(program_fingerprint(normal_program), [])
+  for entry in bucket:
+    if entry[0]==normal_program:
+      return (entry, False)
+  entry=[normal_program, None, None, None]
+  bucket.append(entry)
+  return (entry, True)
+
+def get_program_verdict(program_store, program):
+  """Returns whether a program is valid, according to language.is_program_valid. The result is cached in the program's entry, so each distinct program is only analyzed once.
+
+  Args:
+    program_store (dict): The store that will be used to cache the verdict. The program will be interned in the store if it is not already present.
+    program (list): The program to analyze.
+
+  Returns:
+    A bool that is True if the program is valid, and False otherwise.
+  """
+  entry=intern_program(program_store, program)[0]
+  if entry[1] is None:
+    entry[1]=language.is_program_valid(entry[0])
+  return entry[1]
+
+def get_compiled_program(program_store, program):
+  """Returns the control map of a program, as produced by language.get_control_map. The result is cached in the program's entry, so each distinct program is only compiled once.
+
+  Args:
+    program_store (dict): The store that will be used to cache the control map. The program will be interned in the store if it is not already present.
+    program (list): An inlined program, which must not contain any "exec" instructions.
+
+  Returns:
+    The control map of the program.
+  """
+  entry=intern_program(program_store, program)[0]
+  if entry[2] is None:
+    entry[2]=language.get_control_map(entry[0])
+  return entry[2]
+
+def record_outcome(program_store, program, outcome):
+  """Records the outcome of the most recent run of a program, replacing any previously recorded outcome.
+
+  Args:
+    program_store (dict): The store in which to record the outcome. The program will be interned in the store if it is not already present.
+    program (list): The program that was run.
+    outcome: Any value describing the outcome of the run, such as the number of problems a conjectured theory created.
+  """
+  intern_program(program_store, program)[0][3]=outcome
+
+def get_outcome(program_store, program):
+  """Returns the outcome most recently recorded for a program.
+
+  Args:
+    program_store (dict): The store to search.
+    program (list): The program to look up.
+
+  Returns:
+    The last outcome recorded with record_outcome, or None if no outcome has been recorded for the program.
+  """
+  entry=find_program(program_store, program)
+  if entry is None:
+    return None
+  return entry[3]
@@ -1,67 +1,40 @@
+import asyncio
+import concurrent.futures
+import multiprocessing
+import os
+import tempfile
+import numpy.random
 import language
+import codegen
 import conjecture
+import differential
 import extract
+import journal
 import minds
+import pipeline
+import scheduler
+import snapshots
+import store
+from examples import INCREMENT_THEORY, REPEAT_INCREMENT_THEORY, REPEAT_INCREMENT_10_TIMES_THEORY, SUM_THEORY
 
 def test_theories():
   """Demonstrates the execution of theories."""
   print("Executing test_theories:")
-  increment_theory=[
-    (26,-1),
-    (13,1),
-    (14,),
-    (31,-1),
-    (30,),
-    (8,0),
-    (8,0),
-    (8,0)
-  ]
-
-  repeat_increment_theory=[
-    (3,),
-    (33,0),
-    (4,)
-  ]
-
-  repeat_increment_10_times_theory=[
-    (13,10),
-    (33,1)
-  ]
-
-  sum_theory=[
-    (13,0),
-    (13,1),
-    (2,),
-    (8,0),
-
-    (26,-1),
-    (31,-1),
-    (14,),
-    (8,1),
-    (8,1),
-
-    (24,),
-    (4,),
-    
-    (8,0),
-    (30,)
-  ]
-
   print("increment_theory:")
-  print(language.program_string(increment_theory))
+  print(language.program_string(INCREMENT_THEORY))
 
   print("Running increment_theory on (True, [0, 0])")
-  print(language.run_theory(0, [increment_theory], [], [(True, [0, 0])]))
+  print(language.run_theory(0, [INCREMENT_THEORY], [], [(True, [0, 0])]))
   print("\n")
 
   print("repeat_increment_theory:")
-  print(language.program_string(repeat_increment_theory))
+  print(language.program_string(REPEAT_INCREMENT_THEORY))
 
   print("repeat_increment_10_times_theory:")
-  print(language.program_string(repeat_increment_10_times_theory))
+  print(language.program_string(REPEAT_INCREMENT_10_TIMES_THEORY))
 
   print("Running repeat_increment_10_times_theory on (True, [0, 0])")
-  print(language.run_theory(0, [repeat_increment_10_times_theory], [increment_theory, repeat_increment_theory], [(True, [0, 0])]))
+  print(language.run_theory(0, [REPEAT_INCREMENT_10_TIMES_THEORY], [INCREMENT_THEORY, REPEAT_INCREMENT_THEORY], [(True, [0, 0])]))
 
 def test_claim_generation():
   """Demonstrates the process of claim generation, including the process of finding problems."""
@@ -134,4 +107,342 @@ def test_conjecture():
   for i in range(10):
     theory=conjecture.vary([theory], 0, [], steps=1)
     print(f"Theory after {i+1} stages of variation:")
-    print(language.program_string(theory))
\ No newline at end of file
+    print(language.program_string(theory))
+
+def new_tombstone_mind(claim_count=12, evicted=(0, 3, 4, 9)):
+  """Creates a mind whose only theory is INCREMENT_THEORY, with some of its claims evicted. Each claim is added with minds.add_claim, so that it is in the mind's hash table."""
+  mind=minds.new_mind(theories=[INCREMENT_THEORY])
+  for i in range(claim_count):
+    minds.add_claim(mind, (True, [i, 10*i]), (-1, []))
+  for i in evicted:
+    minds.evict_claim(mind, i)
+  return mind
+
+def check_new_records(mind, first_claim):
+  """Checks that the records of the claims added to a mind from "first_claim" on only refer to claims that haven't been evicted, and that every claim produced by INCREMENT_THEORY is its touched input with the last integer incremented."""
+  for i in range(first_claim, len(mind[2])):
+    theory_index, touched_claim_indeces=mind[3][i]
+    for j in touched_claim_indeces:
+      assert mind[2][j] is not None
+    if theory_index==0 and mind[0][0]==INCREMENT_THEORY:
+      assert len(touched_claim_indeces)==1
+      claim=mind[2][touched_claim_indeces[0]]
+      assert mind[2][i]==(claim[0], claim[1][:-1]+[claim[1][-1]+1])
+
+def test_eviction_oldest():
+  """The "oldest" eviction policy keeps the most recently added claims."""
+  mind=minds.new_mind()
+  minds.set_claim_capacity(mind, 3)
+  for i in range(6):
+    minds.add_claim(mind, (True, [i]), (-1, []))
+  assert mind[2]==[None, None, None, (True, [3]), (True, [4]), (True, [5])]
+  assert mind[6]["capacity"]["live_count"]==3
+
+def test_eviction_least_used():
+  """The "least_used" eviction policy evicts the claim used as an input the fewest times, and the oldest of those on a tie."""
+  mind=minds.new_mind()
+  minds.set_claim_capacity(mind, 3, "least_used")
+  minds.add_claim(mind, (True, [0]), (-1, []))
+  minds.add_claim(mind, (True, [1]), (-1, []))
+  minds.add_claim(mind, (True, [2]), (0, [0]))
+  minds.add_claim(mind, (True, [3]), (0, [0]))
+  assert mind[2]==[(True, [0]), None, (True, [2]), (True, [3])]
+  minds.add_claim(mind, (True, [4]), (0, [3]))
+  assert mind[2]==[(True, [0]), None, None, (True, [3]), (True, [4])]
+
+def test_eviction_keep_problems():
+  """The "keep_problems" eviction policy evicts the oldest claim that isn't part of a problem, and falls back to the oldest claim when every claim is."""
+  mind=minds.new_mind()
+  minds.set_claim_capacity(mind, 3, "keep_problems")
+  minds.add_claim(mind, (True, [0]), (-1, []))
+  minds.add_claim(mind, (False, [0]), (-1, []))
+  minds.add_claim(mind, (True, [5]), (-1, []))
+  minds.add_claim(mind, (True, [6]), (-1, []))
+  assert len(mind[5])==1
+  assert mind[2]==[(True, [0]), (False, [0]), None, (True, [6])]
+  minds.remove_claim_capacity(mind)
+  mind=minds.new_mind()
+  minds.set_claim_capacity(mind, 2, "keep_problems")
+  minds.add_claim(mind, (True, [0]), (-1, []))
+  minds.add_claim(mind, (False, [0]), (-1, []))
+  minds.add_claim(mind, (True, [5]), (-1, []))
+  assert mind[2]==[None, (False, [0]), (True, [5])]
+
+def test_eviction_custom_policy():
+  """A function can be given as an eviction policy."""
+  mind=minds.new_mind()
+  minds.set_claim_capacity(mind, 2, lambda mind, capacity: max(i for i in range(len(mind[2])-1) if mind[2][i] is not None))
+  for i in range(4):
+    minds.add_claim(mind, (True, [i]), (-1, []))
+  assert mind[2]==[(True, [0]), None, None, (True, [3])]
+
+def test_tombstones_keep_records_traces_and_problems():
+  """Evicting a claim keeps its record, the traces of the claims derived from it, and the traces of problems it is part of."""
+  mind=minds.new_mind(theories=[INCREMENT_THEORY])
+  minds.add_claim(mind, (True, [1]), (-1, []))
+  minds.add_claim(mind, (True, [2]), (0, [0]))
+  minds.add_claim(mind, (False, [2]), (-1, []))
+  records=mind[3][:]
+  traces=[minds.get_claim_trace(mind, i) for i in range(len(mind[2]))]
+  problems=mind[5][:]
+  assert len(problems)==1
+  minds.evict_claim(mind, 0)
+  minds.evict_claim(mind, 1)
+  assert mind[2]==[None, None, (False, [2])]
+  assert mind[3]==records
+  assert [minds.get_claim_trace(mind, i) for i in range(len(mind[2]))]==traces
+  assert mind[5]==problems
+
+def test_eviction_removes_claims_from_hash_table():
+  """An evicted claim is removed from the hash table, so it is neither a duplicate of nor contradicted by claims added later."""
+  mind=minds.new_mind()
+  minds.add_claim(mind, (True, [7]), (-1, []))
+  minds.evict_claim(mind, 0)
+  assert all(0 not in bucket for bucket in mind[4])
+  minds.add_claim(mind, (False, [7]), (-1, []))
+  minds.add_claim(mind, (True, [7]), (-1, []))
+  assert mind[2]==[None, (False, [7]), (True, [7])]
+  assert mind[5]==[(minds.get_claim_trace(mind, 2), minds.get_claim_trace(mind, 1))]
+  assert all(0 not in bucket for bucket in mind[4])
+  assert [i for bucket in mind[4] for i in bucket]==[1, 2]
+
+def test_snapshot_round_trip_with_tombstones():
+  """A snapshot of a mind with evicted claims loads as the same mind."""
+  mind=new_tombstone_mind()
+  minds.generate_claims(mind)
+  minds.add_claim(mind, (False, [2, 20]), (-1, []))
+  with tempfile.TemporaryDirectory() as directory:
+    path=os.path.join(directory, "mind.snap")
+    snapshots.save_snapshot(mind, path)
+    loaded=snapshots.load_snapshot(path)
+  assert loaded[:6]==mind[:6]
+
+def test_journal_round_trip_with_tombstones():
+  """A mind resumed from its journal has the same claims, tombstones, records, and problems as the journaled mind."""
+  mind=new_tombstone_mind(evicted=(1,))
+  with tempfile.TemporaryDirectory() as directory:
+    journal.start_journal(mind, directory, batch_size=3)
+    minds.evict_claim(mind, 5)
+    minds.generate_claims(mind)
+    minds.evict_claim(mind, 6)
+    minds.add_claim(mind, (False, [2, 20]), (-1, []))
+    journal.stop_journal(mind)
+    resumed=journal.resume_mind(directory)
+  assert None in resumed[2]
+  assert resumed[:6]==mind[:6]
+
+def test_generate_claims_remaps_records():
+  """generate_claims records the indeces of the touched inputs in the mind, rather than in the input set, when claims have been evicted or the input set is sampled."""
+  for batch_size in (-1, 3):
+    for sampling in minds.SAMPLING_METHODS:
+      mind=new_tombstone_mind()
+      first_claim=len(mind[2])
+      minds.generate_claims(mind, batch_size=batch_size, sampling=sampling)
+      assert len(mind[2])>first_claim
+      check_new_records(mind, first_claim)
+
+def test_scheduler_remaps_records():
+  """The scheduler's generate phase records the indeces of the touched inputs in the mind when claims have been evicted or the input set is sampled."""
+  for batch_size in (-1, 3):
+    mind=new_tombstone_mind()
+    first_claim=len(mind[2])
+    async def main():
+      s=scheduler.new_scheduler()
+      scheduler.add_mind(s, "mind", mind, step_budget=3, extract_interval=-1, batch_size=batch_size)
+      await scheduler.wait_for_minds(s)
+      assert scheduler.get_status(s)["mind"]["state"]=="finished"
+    asyncio.run(main())
+    assert len(mind[2])>first_claim
+    check_new_records(mind, first_claim)
+
+def test_scheduler_process_pool_with_memory_limits():
+  """The scheduler's generate phase can run in a process pool with memory limits set, and the status of each execution is still recorded in the mind's metrics."""
+  push_100_ints_theory=[(13, 100), (3,), (13, 1), (30,), (4,)]
+  mind=minds.new_mind(theories=[push_100_ints_theory], claims=[(True, [1])])
+  minds.enable_metrics(mind)
+  async def main():
+    with concurrent.futures.ProcessPoolExecutor(1, mp_context=multiprocessing.get_context(pipeline.WORKER_START_METHOD)) as executor:
+      s=scheduler.new_scheduler(executor=executor)
+      scheduler.add_mind(s, "mind", mind, step_budget=3, extract_interval=-1, max_stack_depth=50, max_claim_ints=10)
+      await scheduler.wait_for_minds(s)
+      return scheduler.get_status(s)["mind"]
+  status=asyncio.run(main())
+  assert status["state"]=="finished", status["error"]
+  assert mind[6]["metrics"]["counters"].get("generate_claims_memory_limit_total", 0)>=1
+
+def test_pipeline_remaps_records():
+  """The pipeline records the indeces of the touched inputs of admitted theories' outputs in the mind when claims have been evicted."""
+  numpy.random.seed(0)
+  mind=new_tombstone_mind()
+  first_claim=len(mind[2])
+  admitted, stats=pipeline.run_pipeline(mind, 20, workers=1, max_problems=len(mind[2]))
+  assert len(admitted)>0 and len(mind[2])>first_claim
+  check_new_records(mind, first_claim)
+
+def test_pipeline_survives_failing_candidates():
+  """A candidate that raises an exception while it is fingerprinted or evaluated is filtered or rejected, and the pipeline goes on with the other candidates."""
+  # The first candidate raises on every claim, so it fails in the filter stage. The second only raises on claims whose first integer is 99, which the probe bank doesn't contain, so it fails in the evaluate stage.
+  failing=[[(25,), (11, 0)], [(26, 0), (13, 99), (15,), (0,), (11, 0), (4,)]]
+  candidates=[theory[:] for theory in failing]
+  vary_novel=conjecture.vary_novel
+  def vary_failing_first(theories, theory_index, routines, program_store, steps=1, max_attempts=100):
+    if len(candidates)>0:
+      theory=candidates.pop(0)
+      store.intern_program(program_store, theory)
+      return theory
+    return vary_novel(theories, theory_index, routines, program_store, steps, max_attempts)
+  conjecture.vary_novel=vary_failing_first
+  try:
+    mind=minds.new_mind(theories=[INCREMENT_THEORY[:]], claims=[(True, [99]), (True, [1])])
+    running_pipeline=pipeline.start_pipeline(mind, 6, workers=1)
+    stats=pipeline.wait_for_pipeline(running_pipeline)
+  finally:
+    conjecture.vary_novel=vary_novel
+  assert store.get_outcome(running_pipeline["store"], failing[0])==("filtered", "error")
+  assert store.get_outcome(running_pipeline["store"], failing[1])==("rejected", "error")
+  assert running_pipeline["errors"]==[]
+  assert stats["generate"]["items"]==6
+
+def new_routine_mind():
+  """Creates a mind whose theories execute routines and other theories, with an attached exec index. Routine 0 is used three times, routine 1 once, and routine 2 not at all."""
+  theories=[
+    REPEAT_INCREMENT_10_TIMES_THEORY,
+    [(33, 0), (33, 0)],
+    INCREMENT_THEORY,
+    [(33, -3), (33, 0)]
+  ]
+  routines=[INCREMENT_THEORY, REPEAT_INCREMENT_THEORY, [(13, 1), (30,)]]
+  # The programs are copied, since deleting and inlining routines rewrites exec instructions in place, and the constants are shared with the other tests.
+  mind=minds.new_mind(theories=[theory[:] for theory in theories], routines=[routine[:] for routine in routines], claims=[(True, [0, 0]), (False, [3])])
+  minds.enable_exec_index(mind)
+  return mind
+
+def get_all_outputs(mind):
+  """Runs every theory of a mind on the mind's claims, and returns a list of their outputs."""
+  return [language.run_theory(i, mind[0], mind[1], mind[2]) for i in range(len(mind[0]))]
+
+def test_exec_index_after_add_theory():
+  """The exec index stays up to date when a theory is added."""
+  mind=new_routine_mind()
+  minds.add_theory(mind, [(33, 1), (33, -1), (33, 2)])
+  assert mind[6]["exec_index"]==minds.new_exec_index(mind)
+
+def test_exec_index_after_delete_routines():
+  """The exec index stays up to date when routines are deleted, and the exec instructions of later routines are renumbered."""
+  mind=new_routine_mind()
+  minds.delete_routines(mind, [2])
+  assert mind[6]["exec_index"]==minds.new_exec_index(mind)
+  assert mind[1]==[INCREMENT_THEORY, REPEAT_INCREMENT_THEORY]
+  minds.delete_routines(mind, [0])
+  assert mind[6]["exec_index"]==minds.new_exec_index(mind)
+  assert mind[1]==[REPEAT_INCREMENT_THEORY]
+
+def test_routine_tests_leave_examples_unchanged():
+  """Deleting and inlining the routines of a mind made by new_routine_mind doesn't change the example programs it was made from."""
+  examples_before=[program[:] for program in (INCREMENT_THEORY, REPEAT_INCREMENT_THEORY, REPEAT_INCREMENT_10_TIMES_THEORY)]
+  mind=new_routine_mind()
+  minds.delete_routines(mind, [0])
+  minds.inline_and_delete_all_routines(mind)
+  assert [INCREMENT_THEORY, REPEAT_INCREMENT_THEORY, REPEAT_INCREMENT_10_TIMES_THEORY]==examples_before
+
+def test_exec_index_after_inlining():
+  """inline_and_delete_underused_routines keeps the exec index up to date, and doesn't change the outputs of any theory."""
+  mind=new_routine_mind()
+  outputs=get_all_outputs(mind)
+  minds.inline_and_delete_underused_routines(mind)
+  assert mind[6]["exec_index"]==minds.new_exec_index(mind)
+  assert mind[1]==[INCREMENT_THEORY]
+  assert get_all_outputs(mind)==outputs
+
+def test_snapshot_round_trip():
+  """A snapshot loads as the same mind, both with load_snapshot and lazily with open_snapshot, and saving it again replaces the old file."""
+  mind=new_routine_mind()
+  for i in range(5):
+    minds.generate_claims(mind)
+  minds.add_claim(mind, (not mind[2][-1][0], mind[2][-1][1]), (-1, []))
+  assert len(mind[5])>0
+  with tempfile.TemporaryDirectory() as directory:
+    path=os.path.join(directory, "mind.snap")
+    snapshots.save_snapshot(minds.new_mind(), path)
+    snapshots.save_snapshot(mind, path)
+    assert os.listdir(directory)==["mind.snap"]
+    loaded=snapshots.load_snapshot(path)
+    opened=snapshots.open_snapshot(path)
+    assert [list(part) for part in opened[:6]]==mind[:6]
+    assert opened[2][len(mind[2])-1]==mind[2][-1]
+    assert minds.get_claim_trace(opened, len(mind[2])-1)==minds.get_claim_trace(mind, len(mind[2])-1)
+  assert loaded[:6]==mind[:6]
+  assert loaded[6]=={}
+
+def test_journal_replay():
+  """A mind resumed from its journal equals the journaled mind after claims, problems, and every kind of program change are replayed, including across a checkpoint."""
+  mind=new_routine_mind()
+  with tempfile.TemporaryDirectory() as directory:
+    journal.start_journal(mind, directory, batch_size=2)
+    minds.generate_claims(mind)
+    minds.add_theory(mind, [(33, 1), (33, 0)])
+    minds.delete_routines(mind, [2])
+    journal.checkpoint(mind)
+    minds.generate_claims(mind)
+    minds.add_claim(mind, (not mind[2][-1][0], mind[2][-1][1]), (-1, []))
+    minds.inline_and_delete_underused_routines(mind)
+    mind[0][0]=mind[0][0]+[(13, 1)]
+    minds.programs_changed(mind)
+    journal.flush_journal(mind)
+    resumed=journal.resume_mind(directory)
+    journal.stop_journal(mind)
+    assert sorted(os.listdir(directory))==["checkpoint-1.snap", "log-1.bin"]
+  assert len(mind[5])>0
+  assert resumed[:6]==mind[:6]
+
+def test_journal_ignores_damaged_frames():
+  """Reading a log stops at a frame that was cut short or fails its checksum, and keeps every event before it."""
+  mind=minds.new_mind()
+  with tempfile.TemporaryDirectory() as directory:
+    journal.start_journal(mind, directory, batch_size=1)
+    for i in range(3):
+      minds.add_claim(mind, (True, [i]), (-1, []))
+    journal.stop_journal(mind)
+    path=journal.log_path(directory, journal.get_latest_sequence(directory))
+    with open(path, "rb") as f:
+      data=f.read()
+    frame_size=len(data)//3
+    events=list(journal.read_log(path))
+    assert [event[1] for event in events]==[(True, [0]), (True, [1]), (True, [2])]
+    with open(path, "wb") as f:
+      f.write(data[:-1])
+    assert list(journal.read_log(path))==events[:2]
+    with open(path, "wb") as f:
+      f.write(data[:frame_size+journal.FRAME_HEADER.size-1])
+    assert list(journal.read_log(path))==events[:1]
+    corrupted=bytearray(data)
+    corrupted[frame_size+journal.FRAME_HEADER.size]^=0xff
+    with open(path, "wb") as f:
+      f.write(bytes(corrupted))
+    assert list(journal.read_log(path))==events[:1]
+    assert journal.resume_mind(directory)[2]==[(True, [0])]
+
+def run_theory_with_claim_index(theory_index, theories, routines, input_set, execution_limit=100):
+  """An engine for differential.compare_engines that runs a theory with a claim index of its input set, so that fork guards only branch over the claims that can pass them."""
+  return list(language.iterate_theory(theory_index, theories, routines, input_set, execution_limit, claim_index=language.new_claim_index(input_set)))
+
+def run_theory_with_superinstructions(theory_index, theories, routines, input_set, execution_limit=100):
+  """An engine for differential.compare_engines that runs a theory with superinstructions for every routine that can have one."""
+  return list(language.iterate_theory(theory_index, theories, routines, input_set, execution_limit, superinstructions=codegen.get_superinstructions(theories, routines, -1)))
+
+def test_engine_variants_match_run_theory():
+  """Running theories with a claim index or with superinstructions gives exactly the same results as language.run_theory, on random cases and on cases with fork guards and repeated claims."""
+  guarded_theories=[
+    [(25,), (32,), (13, 7), (30,)],
+    [(25,), (18,), (32,), (13, 7), (30,)],
+    [(24,), (13, 2), (15,), (32,), (13, 5), (30,)],
+    [(26, 0), (13, 1), (15,), (32,), (33, 0)],
+    [(26, 0), (13, 1), (15,), (0,), (13, 3), (30,), (4,)]
+  ]
+  input_set=[(True, [1, 2]), (False, [1]), (True, [1, 2]), (True, []), (False, [1, 3]), (False, [1])]
+  corpus=differential.generate_corpus(200, seed=1)
+  corpus+=[(i, guarded_theories, differential.SEED_ROUTINES, input_set, 100) for i in range(len(guarded_theories))]
+  for engine in (run_theory_with_claim_index, run_theory_with_superinstructions):
+    report=differential.compare_engines(engine, corpus=corpus)
+    assert report["divergence"] is None, differential.report_string(report)
+    assert report["cases"]==len(corpus)